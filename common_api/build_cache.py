@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Persistent build cache for the benchmark tools.
+
+The benchmark tests extract the tool sources and build them, on the
+host and on the peer, in every setUp. BuildCache keeps the built source
+trees in a persistent directory of each host, named after a hash of the
+source archive, the extra input files (e.g. patches), the compiler, the
+architecture and the build command line, and only builds when there is
+no complete tree for that key yet. Tests running in parallel hold a lock
+on the entry while they check, build and mark it.
+
+Usage::
+
+    cache = BuildCache(log)
+    peer_cache = BuildCache(log, session=session)
+    srcdir = cache.build('iperf', tarball, './configure && make')
+    peer_srcdir = peer_cache.build('iperf', tarball, './configure && make')
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from avocado.utils import archive, process
+
+__all__ = ['BuildCache', 'CACHE_DIR', 'file_digest']
+
+CACHE_DIR = '/var/cache/avocado-misc-tests/builds'
+# created once the build succeeded, a tree without it is rebuilt
+COMPLETE = '.complete'
+TOOLCHAIN_CMD = 'uname -m; gcc --version 2>&1 | head -n 1'
+
+
+def file_digest(path):
+    """Returns the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def archive_topdir(path):
+    """
+    Returns the directory the archive extracts to, '' when its members
+    are not all in one top level directory.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as source:
+            names = source.namelist()
+    else:
+        with tarfile.open(path) as source:
+            names = source.getnames()
+    tops = {name.lstrip('./').split('/', 1)[0] for name in names}
+    tops.discard('')
+    if len(tops) != 1:
+        return ''
+    return tops.pop()
+
+
+class BuildCache():
+    """Built source trees of a host, keyed by source and toolchain.
+
+    :param log: logger of the calling test
+    :param session: ssh Session of the peer the trees are built on, None
+                    for the local host
+    :param cache_dir: persistent directory of the built trees
+    :param rebuild: builds again even when a matching tree exists
+    """
+
+    def __init__(self, log, session=None, cache_dir=CACHE_DIR,
+                 rebuild=False):
+        self.log = log
+        self.session = session
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.rebuild = rebuild
+        self.host = 'peer' if session else 'host'
+        self._toolchain = None
+
+    def run(self, cmd):
+        """Runs a shell command on the host, returns a CmdResult."""
+        if self.session:
+            return self.session.cmd(cmd)
+        return process.run(cmd, shell=True, ignore_status=True)
+
+    def copy(self, path, destination):
+        """Copies a local file or directory to destination on the host."""
+        if self.session:
+            return self.session.copy_files(
+                path, '%s:%s' % (self.session.host, destination),
+                recursive=os.path.isdir(path))
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(destination,
+                                               os.path.basename(path)))
+        else:
+            shutil.copy(path, destination)
+        return True
+
+    def toolchain(self):
+        """Returns the architecture and the compiler version of the host."""
+        if self._toolchain is None:
+            self._toolchain = self.run(TOOLCHAIN_CMD).stdout_text.strip()
+        return self._toolchain
+
+    def key(self, tarball, build_cmd, inputs=()):
+        """
+        Returns the cache key of the tarball built with build_cmd, after
+        copying inputs to the source tree.
+        """
+        digest = hashlib.sha256()
+        for item in [file_digest(tarball)] + \
+                [file_digest(path) for path in inputs] + \
+                [self.toolchain(), build_cmd]:
+            digest.update(item.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()[:16]
+
+    @contextlib.contextmanager
+    def lock(self, entry):
+        """
+        Holds an exclusive lock on entry while the block runs. The lock
+        file is local, the tests sharing a peer all drive it from here.
+        """
+        if self.session:
+            path = os.path.join(self.cache_dir, '%s-%s.lock' % (
+                self.session.host, os.path.basename(entry)))
+        else:
+            path = '%s.lock' % entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.log.info("%s: waiting for the %s build lock",
+                              self.host, os.path.basename(entry))
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def cached(self, entry, since=None):
+        """
+        Returns whether entry holds a complete build. With since, the
+        host time in seconds, only a build completed since then counts.
+        """
+        marker = '%s/%s' % (entry, COMPLETE)
+        if since is None:
+            cmd = 'test -f %s' % marker
+        else:
+            cmd = 'test "$(stat -c %%Y %s 2>/dev/null)" -ge %s' % (
+                marker, since)
+        return self.run(cmd).exit_status == 0
+
+    def build(self, name, tarball, build_cmd, inputs=()):
+        """
+        Returns the path of the source tree of tarball built with
+        build_cmd, run from the top of the tree after inputs were copied
+        there. The tree comes from the cache when it was built before,
+        None is returned when the build fails.
+
+        With rebuild, a tree another test rebuilt while this one waited
+        for the lock is used as is, rather than deleted under it.
+        """
+        entry = '%s/%s-%s' % (self.cache_dir, name, self.key(tarball,
+                                                             build_cmd,
+                                                             inputs))
+        since = None
+        if self.rebuild:
+            since = self.run('date +%s').stdout_text.strip()
+        with self.lock(entry):
+            return self._build(entry, name, tarball, build_cmd, inputs,
+                               since)
+
+    def _build(self, entry, name, tarball, build_cmd, inputs, since):
+        topdir = archive_topdir(tarball)
+        srcdir = '%s/%s' % (entry, topdir) if topdir else entry
+        if self.cached(entry, since):
+            self.log.info("%s: using the cached %s build %s", self.host,
+                          name, srcdir)
+            return srcdir
+        self.log.info("%s: building %s in %s", self.host, name, entry)
+        self.run('rm -rf %s; mkdir -p %s' % (entry, entry))
+        if self.session:
+            # the archive is extracted locally, the peer may lack unzip
+            staging = tempfile.mkdtemp(prefix='build-cache-')
+            try:
+                archive.extract(tarball, staging)
+                for path in os.listdir(staging):
+                    if not self.copy(os.path.join(staging, path), entry):
+                        self.log.error("%s: unable to copy %s", self.host,
+                                       path)
+                        return None
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        else:
+            archive.extract(tarball, entry)
+        for path in inputs:
+            if not self.copy(path, srcdir):
+                self.log.error("%s: unable to copy %s", self.host, path)
+                return None
+        result = self.run('cd %s && %s && touch %s/%s' % (srcdir, build_cmd,
+                                                          entry, COMPLETE))
+        if result.exit_status != 0:
+            self.log.error("%s: %s build failed: %s", self.host, name,
+                           result.stderr_text or result.stdout_text)
+            return None
+        return srcdir
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+HTX run monitor.
+
+The HTX tests used to wake up once a minute, dump the error log and
+print 'htxcmdline -query' unparsed. HtxMonitor waits on the local HTX
+error log with inotify, so an error is noticed as soon as it is logged,
+and samples the query output of every host at a fixed interval into a
+time series of per-device cycle and error counts.
+
+Usage::
+
+    monitor = HtxMonitor(log, outputdir, 'htxcmdline -query -mdt mdt.all')
+    monitor.add_host('host', run_local)
+    monitor.add_host('peer', session.cmd)
+    error = monitor.run(time_limit)
+"""
+
+import collections
+import csv
+import ctypes
+import os
+import re
+import select
+import struct
+import time
+
+__all__ = ['HtxDevice', 'HtxMonitor', 'parse_query', 'HTX_ERRLOG']
+
+HTX_ERRLOG = '/tmp/htxerr'
+GETERRLOG_CMD = 'htxcmdline -geterrlog'
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT = struct.Struct('iIII')
+
+# a query row: device, state, ACTIVE/SUSPEND, RUNNING/HALTED, COE/SOE,
+# cycle count, stanza, then the update time, error count and last error
+# time
+_QUERY_REGEXP = re.compile(
+    r'^\s*(?P<device>\S+)\s+(?P<state>[A-Z]{1,3})\s+(?P<active>[A-Z]+)\s+'
+    r'(?P<run>[A-Z]+)\s+(?P<coe>COE|SOE)\s+(?P<cycles>\d+)\s+'
+    r'(?P<stanza>\d+)\s*(?P<rest>.*)$')
+_TIME_REGEXP = re.compile(r'[A-Z][a-z]{2}\s+[A-Z][a-z]{2}\s+\d+\s+'
+                          r'\d+:\d+:\d+\s+\d{4}')
+
+HtxDevice = collections.namedtuple(
+    'HtxDevice', 'device state active run cycles errors')
+
+
+def parse_query(output):
+    """
+    Parses 'htxcmdline -query' output, returns an HtxDevice per device.
+    """
+    devices = []
+    for line in output.splitlines():
+        match = _QUERY_REGEXP.match(line)
+        if not match:
+            continue
+        # the error count is the first number after the update time
+        numbers = _TIME_REGEXP.sub(' ', match.group('rest')).split()
+        errors = next((int(value) for value in numbers if value.isdigit()),
+                      0)
+        devices.append(HtxDevice(match.group('device'), match.group('state'),
+                                 match.group('active'), match.group('run'),
+                                 int(match.group('cycles')), errors))
+    return devices
+
+
+class _ErrlogWatch():
+    """Waits for writes to the local error log, using inotify."""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory, self.name = os.path.split(path)
+        self.fd = -1
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            # watch the directory, the log may not exist yet or be recreated
+            if self.fd >= 0 and libc.inotify_add_watch(
+                    self.fd, self.directory.encode(),
+                    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(self.fd)
+                self.fd = -1
+        except (AttributeError, OSError):
+            self.fd = -1
+
+    def wait(self, timeout):
+        """
+        Returns True when the error log was written within timeout seconds.
+        Without inotify, the log size is polled every second instead.
+        """
+        if self.fd < 0:
+            time.sleep(min(timeout, 1))
+            return self.size() > 0
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+        written = False
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, _, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length]
+            if name.rstrip(b'\0').decode() == self.name:
+                written = True
+            offset += _EVENT.size + length
+        return written and self.size() > 0
+
+    def size(self):
+        try:
+            return os.stat(self.path).st_size
+        except OSError:
+            return 0
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class HtxMonitor():
+    """Monitors an HTX run on one or more hosts.
+
+    :param log: logger of the calling test
+    :param outputdir: directory the htx-timeseries.csv is written to
+    :param query_cmd: htxcmdline -query command line to sample
+    :param interval: seconds between two samples of the query output
+    :param errlog: HTX error log path, on every host
+    """
+
+    def __init__(self, log, outputdir, query_cmd, interval=60,
+                 errlog=HTX_ERRLOG):
+        self.log = log
+        self.query_cmd = query_cmd
+        self.interval = interval
+        self.errlog = errlog
+        self.hosts = collections.OrderedDict()
+        self.last = {}
+        self.path = os.path.join(outputdir, 'htx-timeseries.csv')
+        with open(self.path, 'w') as series:
+            csv.writer(series).writerow(
+                ['time', 'host', 'device', 'state', 'active', 'run', 'cycles',
+                 'cycles_per_min', 'errors', 'stalled'])
+
+    def add_host(self, name, run):
+        """
+        Adds a host, run(cmd) runs a command on it and returns a CmdResult
+        (e.g. process.run or Session.cmd). The first host added is the
+        local one, its error log is watched with inotify.
+        """
+        self.hosts[name] = run
+
+    def check_errlog(self, name):
+        """
+        Returns the error log of host name, an empty string if there are
+        no errors.
+        """
+        run = self.hosts[name]
+        run(GETERRLOG_CMD)
+        result = run('test -s %s && cat %s' % (self.errlog, self.errlog))
+        if result.exit_status != 0:
+            return ''
+        return result.stdout_text or '%s is not empty' % self.errlog
+
+    def sample(self):
+        """
+        Appends the current state of every device of every host to the
+        time series.
+        """
+        now = time.time()
+        with open(self.path, 'a') as series:
+            writer = csv.writer(series)
+            for name, run in self.hosts.items():
+                for dev in parse_query(run(self.query_cmd).stdout_text):
+                    rate, stalled = '', ''
+                    if (name, dev.device) in self.last:
+                        when, cycles = self.last[(name, dev.device)]
+                        rate = '%.2f' % ((dev.cycles - cycles) * 60.0 /
+                                         max(now - when, 1))
+                        stalled = int(dev.cycles == cycles)
+                        if stalled:
+                            self.log.warning("%s: %s made no progress in "
+                                             "the last %.0fs", name,
+                                             dev.device, now - when)
+                    self.last[(name, dev.device)] = (now, dev.cycles)
+                    writer.writerow([int(now), name, dev.device, dev.state,
+                                     dev.active, dev.run, dev.cycles, rate,
+                                     dev.errors, stalled])
+
+    def run(self, duration):
+        """
+        Monitors the run for duration seconds, returns a description of the
+        first error found, None when there was none.
+        """
+        hosts = list(self.hosts)
+        watch = _ErrlogWatch(self.errlog)
+        try:
+            end = time.time() + duration
+            next_sample = time.time()
+            while True:
+                now = time.time()
+                if now >= next_sample or now >= end:
+                    # the remote logs, and the local one when the HTX
+                    # daemon does not write to it directly
+                    for name in hosts:
+                        errors = self.check_errlog(name)
+                        if errors:
+                            return "%s: %s" % (name, errors)
+                    self.sample()
+                    if now >= end:
+                        return None
+                    next_sample = now + self.interval
+                if watch.wait(min(next_sample, end) - now) and hosts:
+                    errors = self.check_errlog(hosts[0])
+                    if errors:
+                        return "%s: %s" % (hosts[0], errors)
+        finally:
+            watch.close()
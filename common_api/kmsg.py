@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Incremental kernel log watcher.
+
+Tests used to run 'dmesg -Txl 1,2,3,4' after every step, decode the
+whole ring buffer and look for each error string in every line, and
+clear the buffer between steps. KmsgWatcher keeps /dev/kmsg open and
+only reads the records logged since the previous check, matching all
+the error signatures with a single compiled regular expression.
+
+Usage::
+
+    kmsg = KmsgWatcher(['Oops', 'Call Trace:'])
+    ... do something ...
+    for record in kmsg.check():
+        log.error(record)
+"""
+
+import collections
+import errno
+import os
+import re
+
+__all__ = ['KmsgRecord', 'KmsgWatcher', 'KMSG_PATH', 'ERROR_LEVELS']
+
+KMSG_PATH = '/dev/kmsg'
+# alert, crit, err and warning, same as 'dmesg -l 1,2,3,4'
+ERROR_LEVELS = (1, 2, 3, 4)
+
+
+class KmsgRecord(collections.namedtuple('KmsgRecord',
+                                        'seq timestamp level message')):
+    """A /dev/kmsg record, timestamp is in seconds since boot."""
+
+    def __str__(self):
+        return '[%12.6f] %s' % (self.timestamp, self.message)
+
+
+def parse_record(data):
+    """
+    Parses a /dev/kmsg record, 'prio,seq,usec,flags;message', returns
+    None for anything else.
+    """
+    header, _, message = data.partition(';')
+    fields = header.split(',')
+    if not message or len(fields) < 3:
+        return None
+    try:
+        prio, seq, usec = int(fields[0]), int(fields[1]), int(fields[2])
+    except ValueError:
+        return None
+    # dictionary lines (' KEY=value') follow the message
+    message = message.split('\n', 1)[0]
+    return KmsgRecord(seq, usec / 1000000.0, prio & 7, message)
+
+
+class KmsgWatcher():
+    """Tails /dev/kmsg and returns the new records matching patterns.
+
+    :param patterns: strings looked for in the messages, None matches
+                     every record
+    :param levels: log levels to consider, None for all of them
+    :param start_seq: sequence number to start from, by default only the
+                      records logged after the watcher creation are read
+    """
+
+    def __init__(self, patterns=None, levels=ERROR_LEVELS, start_seq=None):
+        self.levels = levels
+        self.regex = None
+        if patterns:
+            self.regex = re.compile('|'.join(re.escape(pattern)
+                                             for pattern in patterns))
+        self.fd = os.open(KMSG_PATH, os.O_RDONLY | os.O_NONBLOCK)
+        self.start_seq = start_seq
+        self.last_seq = None
+        if start_seq is None:
+            os.lseek(self.fd, 0, os.SEEK_END)
+
+    def read(self):
+        """
+        Returns all the records logged since the previous read.
+        """
+        records = []
+        while True:
+            try:
+                data = os.read(self.fd, 8192)
+            except OSError as ex:
+                if ex.errno == errno.EPIPE:
+                    # records were overwritten before being read, go on
+                    # with the oldest one still available
+                    continue
+                if ex.errno == errno.EAGAIN:
+                    break
+                raise
+            if not data:
+                break
+            record = parse_record(data.decode('utf-8', 'replace'))
+            if record is None:
+                continue
+            self.last_seq = record.seq
+            if self.start_seq is not None and record.seq < self.start_seq:
+                continue
+            records.append(record)
+        return records
+
+    def check(self):
+        """
+        Returns the new records of the watched levels matching patterns.
+        """
+        return [record for record in self.read()
+                if (self.levels is None or record.level in self.levels) and
+                (self.regex is None or self.regex.search(record.message))]
+
+    def mark(self):
+        """
+        Skips everything logged so far and returns the sequence number
+        the next check starts from.
+        """
+        self.read()
+        if self.last_seq is None:
+            # nothing was logged since the watcher start, find out the
+            # sequence number of the newest record from the whole buffer
+            with KmsgWatcher(levels=None, start_seq=0) as watcher:
+                watcher.read()
+                self.last_seq = watcher.last_seq
+        if self.last_seq is None:
+            return self.start_seq or 0
+        return max(self.last_seq + 1, self.start_seq or 0)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
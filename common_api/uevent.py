@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Kernel uevent listener.
+
+Instead of polling sysfs or dmesg until a device shows up, goes away or
+changes state, UeventMonitor subscribes to the kernel uevents netlink
+group and returns every event as it is sent, stamped with the monotonic
+time it was received. Events are received when read() is called, unless
+the monitor runs in the background, which a test needs when it times
+events that arrive while it waits for a command to complete.
+
+Usage::
+
+    with UeventMonitor(subsystems=['pci']) as uevents:
+        ... do something ...
+        for event in uevents.read(timeout=1):
+            log.info('%s %s', event.action, event.devpath)
+"""
+
+import collections
+import queue
+import select
+import socket
+import threading
+import time
+
+__all__ = ['Uevent', 'UeventMonitor', 'parse_uevent']
+
+NETLINK_KOBJECT_UEVENT = 15
+# the kernel multicast group, udev re-broadcasts on group 2
+KERNEL_GROUP = 1
+
+
+class Uevent(collections.namedtuple('Uevent',
+                                    'timestamp action devpath env')):
+    """A kernel uevent, env holds its KEY=value pairs."""
+
+    def __str__(self):
+        return '%s@%s' % (self.action, self.devpath)
+
+
+def parse_uevent(data, timestamp=None):
+    """
+    Parses a kernel uevent message, 'action@devpath' followed by
+    KEY=value pairs, all NUL terminated. Returns None for anything else
+    (e.g. the udev re-broadcast of the event).
+    """
+    fields = data.decode('utf-8', 'replace').split('\0')
+    action, sep, devpath = fields[0].partition('@')
+    if not sep:
+        return None
+    env = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition('=')
+        if sep:
+            env[key] = value
+    if timestamp is None:
+        timestamp = time.monotonic()
+    return Uevent(timestamp, env.get('ACTION', action),
+                  env.get('DEVPATH', devpath), env)
+
+
+class UeventMonitor():
+    """Receives the kernel uevents.
+
+    :param subsystems: subsystems whose events are returned, None for all
+    :param background: receives the events in a thread as they arrive,
+                       read() returns them from there
+    """
+
+    def __init__(self, subsystems=None, background=False):
+        self.subsystems = subsystems
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                  NETLINK_KOBJECT_UEVENT)
+        # large enough for the bursts of a device tree removal
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((0, KERNEL_GROUP))
+        self.sock.setblocking(False)
+        self._queue = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._receive_loop,
+                                            daemon=True)
+            self._thread.start()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _receive_loop(self):
+        while not self._stop_event.is_set():
+            for event in self._receive(timeout=0.1):
+                self._queue.put(event)
+
+    def read(self, timeout=0):
+        """
+        Returns the events received so far, waiting up to timeout seconds
+        for the first one when there are none.
+        """
+        if self._queue is None:
+            return self._receive(timeout)
+        events = []
+        try:
+            if timeout > 0:
+                events.append(self._queue.get(timeout=timeout))
+            while True:
+                events.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def _receive(self, timeout):
+        events = []
+        if timeout and not select.select([self.sock], [], [], timeout)[0]:
+            return events
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            event = parse_uevent(data)
+            if event is None:
+                continue
+            if self.subsystems is None or \
+                    event.env.get('SUBSYSTEM') in self.subsystems:
+                events.append(event)
+        return events
+
+    def close(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
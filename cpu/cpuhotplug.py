@@ -18,12 +18,19 @@
 Stress test for CPU
 """
 
+import os
+import json
+import math
+import time
+import random
 import multiprocessing
 from random import randint
 from avocado import Test
-from avocado.utils import process, cpu, distro, dmesg
+from avocado.utils import process, cpu, distro
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from common_api.kmsg import KmsgWatcher
+
 
 pids = []
 totalcpus = int(multiprocessing.cpu_count()) - 1
@@ -35,10 +42,162 @@ errorlog = ['WARNING: CPU:', 'Oops',
             'Call Trace:']
 
 
+CPU_ONLINE = '/sys/devices/system/cpu/cpu%s/online'
+PLANS = ('serial', 'reverse', 'toggle', 'random')
+
+
 def collect_dmesg(object):
     object.whiteboard = process.system_output("dmesg").decode('utf-8')
 
 
+class LatencyHistogram():
+    """
+    Log scale histogram of latencies in microseconds, 20 buckets per
+    decade (about 12% wide) starting at 1us.
+    """
+
+    BUCKETS_PER_DECADE = 20
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, usec):
+        index = int(math.log10(max(usec, 1.0)) * self.BUCKETS_PER_DECADE)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += usec
+        self.max = max(self.max, usec)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the percentile.
+        """
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(10 ** ((index + 1.0) / self.BUCKETS_PER_DECADE),
+                           self.max)
+        return 0.0
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50), 'p99': self.percentile(99),
+                'max': self.max}
+
+
+class HotplugEngine():
+    """
+    Drives cpu online/offline transitions through file descriptors kept
+    open on /sys/devices/system/cpu/cpuN/online, and records how long
+    each transition takes.
+
+    :param cpus: cpu numbers to drive, the ones which can not be
+                 hotplugged (no online file) are left out
+    """
+
+    def __init__(self, cpus):
+        self.fds = {}
+        for num in cpus:
+            if os.path.exists(CPU_ONLINE % num):
+                self.fds[num] = os.open(CPU_ONLINE % num, os.O_RDWR)
+        self.cpus = sorted(self.fds)
+        self.state = {}
+        # latencies per direction, and per cpu and direction
+        self.latency = {True: LatencyHistogram(), False: LatencyHistogram()}
+        self.cpu_latency = {}
+        self.failures = {True: 0, False: 0}
+
+    def refresh(self, cpus=None):
+        """Reads back the current state of cpus, all of them by default."""
+        for num in self.fds if cpus is None else cpus:
+            self.state[num] = os.pread(self.fds[num], 8, 0).strip() == b'1'
+
+    def set(self, num, online):
+        """
+        Onlines or offlines a cpu, nothing is done (nor timed) when it is
+        already in that state. Returns False when the kernel refused it.
+        """
+        if self.state.get(num) == online:
+            return True
+        start = time.perf_counter()
+        try:
+            os.pwrite(self.fds[num], b'1' if online else b'0', 0)
+        except OSError:
+            self.failures[online] += 1
+            return False
+        usec = (time.perf_counter() - start) * 1000000
+        self.state[num] = online
+        self.latency[online].add(usec)
+        if (num, online) not in self.cpu_latency:
+            self.cpu_latency[(num, online)] = LatencyHistogram()
+        self.cpu_latency[(num, online)].add(usec)
+        return True
+
+    def run(self, plan, cycles=1):
+        """
+        Runs the (cpu, online) transitions of plan cycles times, returns
+        the number of transitions the kernel refused.
+        """
+        failures = sum(self.failures.values())
+        # the state may have been changed behind our back, e.g. by an smt
+        # change, so read it back before running
+        self.refresh(set(num for num, _ in plan))
+        for _ in range(cycles):
+            for num, online in plan:
+                self.set(num, online)
+        return sum(self.failures.values()) - failures
+
+    @staticmethod
+    def build_plan(kind, cpus, seed=None):
+        """
+        Returns the (cpu, online) transitions of a plan:
+        serial: offline in ascending order, online in descending order
+        reverse: offline in descending order, online in ascending order
+        toggle: offline and online again each cpu, in ascending order
+        random: offline and online all cpus, both in random order
+        """
+        cpus = list(cpus)
+        if kind == 'serial':
+            return [(num, False) for num in cpus] + \
+                [(num, True) for num in reversed(cpus)]
+        if kind == 'reverse':
+            return [(num, False) for num in reversed(cpus)] + \
+                [(num, True) for num in cpus]
+        if kind == 'toggle':
+            return [(num, online) for num in cpus for online in (False, True)]
+        if kind == 'random':
+            rand = random.Random(seed)
+            offline, online = cpus[:], cpus[:]
+            rand.shuffle(offline)
+            rand.shuffle(online)
+            return [(num, False) for num in offline] + \
+                [(num, True) for num in online]
+        raise ValueError('Unknown hotplug plan %s' % kind)
+
+    def summary(self):
+        result = {}
+        for online, direction in ((False, 'offline'), (True, 'online')):
+            result[direction] = self.latency[online].summary()
+            result[direction]['failures'] = self.failures[online]
+        result['cpus'] = {}
+        for (num, online), histogram in sorted(self.cpu_latency.items()):
+            direction = 'online' if online else 'offline'
+            result['cpus'].setdefault(str(num), {})[direction] = \
+                histogram.summary()
+        return result
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
 class cpuHotplug(Test):
 
     """
@@ -50,6 +209,7 @@ class cpuHotplug(Test):
     2. off/on single cpu 100 times all cpus
     3. off/on one cpu at a time all cpus
     4. toggle first off and second half cpus on
+    4a. off/on all cpus in random order
     5. Affine task to single cpu and do off on check for the process (init)
     6. affine to shared multiple cpus and off on (sleep)
     7. Do multiple cpu off on at once ppc64_cpu --smt
@@ -73,17 +233,15 @@ class cpuHotplug(Test):
                 self.cancel("%s is required to continue..." % pkg)
         self.iteration = int(self.params.get('iteration', default='10'))
         self.tests = self.params.get('test', default='all')
+        self.seed = self.params.get('seed', default=None)
+        self.max_p99 = self.params.get('max_p99_latency', default=None)
+        self.kmsg = KmsgWatcher(errorlog)
+        self.engine = HotplugEngine(range(totalcpus + 1))
+        # cpu0 is left online by the plans, as the serial test always did
+        self.hotplug_cpus = [num for num in self.engine.cpus if num != 0]
 
-    @staticmethod
-    def __error_check():
-        ERROR = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4"
-                                     "").decode("utf-8").splitlines()
-        for error in errorlog:
-            for log in logs:
-                if error in log:
-                    ERROR.append(log)
-        return "\n".join(ERROR)
+    def __error_check(self):
+        return "\n".join(str(record) for record in self.kmsg.check())
 
     @staticmethod
     def __isSMT():
@@ -114,6 +272,30 @@ class cpuHotplug(Test):
         for pid in pids:
             process.run("kill -9 %s" % pid, ignore_status=True)
 
+    def __run_plan(self, kind, cpus, cycles=1, seed=None):
+        plan = self.engine.build_plan(kind, cpus, seed)
+        failures = self.engine.run(plan, cycles)
+        self.log.info("%s plan: %s transitions over %s cpus, %s cycles, "
+                      "%s refused", kind, len(plan), len(cpus), cycles,
+                      failures)
+
+    def __report_latency(self):
+        summary = self.engine.summary()
+        with open(os.path.join(self.outputdir, 'hotplug-latency.json'),
+                  'w') as latency_file:
+            json.dump(summary, latency_file, indent=4)
+        failed = []
+        for direction in ('offline', 'online'):
+            stats = summary[direction]
+            self.log.info("%s latency: %s transitions, p50 %.0fus, "
+                          "p99 %.0fus, max %.0fus, %s refused", direction,
+                          stats['count'], stats['p50'], stats['p99'],
+                          stats['max'], stats['failures'])
+            if self.max_p99 and stats['p99'] > float(self.max_p99):
+                failed.append("%s p99 latency %.0fus > %sus" %
+                              (direction, stats['p99'], self.max_p99))
+        return failed
+
     def test(self):
         """
         calls each of the test in a loop for the given values
@@ -123,6 +305,7 @@ class cpuHotplug(Test):
             tests = ['cpu_serial_off_on',
                      'single_cpu_toggle',
                      'cpu_toggle_one_by_one',
+                     'cpu_random_off_on',
                      'multiple_cpus_toggle',
                      'pinned_cpu_stress',
                      'dlpar_cpu_hotplug']
@@ -130,43 +313,33 @@ class cpuHotplug(Test):
             tests = self.tests.split()
 
         for method in tests:
+            run_test = getattr(self, method, None)
+            if run_test is None:
+                self.cancel("Unknown cpu hotplug test %s" % method)
             self.log.info("\nTEST: %s\n", method)
-            dmesg.clear_dmesg()
-            run_test = 'self.%s()' % method
-            eval(run_test)
+            run_test()
             msg = self.__error_check()
             if msg:
-                collect_dmesg()
-                self.log.info('Test: %s. ERROR Message: %s', run_test, msg)
+                collect_dmesg(self)
+                self.log.info('Test: %s. ERROR Message: %s', method, msg)
             self.log.info("\nEND: %s\n", method)
+        failed = self.__report_latency()
+        if failed:
+            self.fail("CPU hotplug latency regression: %s" %
+                      ", ".join(failed))
 
     def cpu_serial_off_on(self):
         """
         Offline all the cpus serially and online again
-        offline 0 -> 99
-        online 99 -> 0
-        offline 99 -> 0
-        online 0 -> 99
+        offline 1 -> 99
+        online 99 -> 1
+        offline 99 -> 1
+        online 1 -> 99
         """
+        self.log.info("OFF-ON Serial Test %s", totalcpus)
         for _ in range(self.iteration):
-            self.log.info("OFF-ON Serial Test %s", totalcpus)
-            if totalcpus != 0:
-                for cpus in range(1, totalcpus):
-                    self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
-            self.log.info("Online CPU's in reverse order %s", totalcpus)
-            for cpus in range(totalcpus, -1, -1):
-                self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
-            self.log.info("Offline CPU's in reverse order %s", totalcpus)
-            if totalcpus != 0:
-                for cpus in range(totalcpus, -1, -2):
-                    self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
-            self.log.info("Online CPU's in serial")
-            for cpus in range(0, totalcpus):
-                self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+            self.__run_plan('serial', self.hotplug_cpus)
+            self.__run_plan('reverse', self.hotplug_cpus)
 
     def single_cpu_toggle(self):
         """
@@ -174,26 +347,26 @@ class cpuHotplug(Test):
         and loop over all cpus.
         @BUG: https://lkml.org/lkml/2017/6/12/212
         """
-        for cpus in range(1, totalcpus):
-            for _ in range(self.iteration):
-                if totalcpus != 0:
-                    self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
-                self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+        for num in self.hotplug_cpus:
+            self.__run_plan('toggle', [num], self.iteration)
 
     def cpu_toggle_one_by_one(self):
         """
-        Wait for the given timeout between Off/On single cpu.
-        loop over all cpus for given iteration.
+        Off/On single cpu, loop over all cpus for given iteration.
         """
-        for _ in range(self.iteration):
-            for cpus in range(totalcpus):
-                if totalcpus != 0:
-                    self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
-                self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+        self.__run_plan('toggle', self.engine.cpus, self.iteration)
+
+    def cpu_random_off_on(self):
+        """
+        Offline all the cpus in random order and online them again in a
+        different random order, a new order for every iteration.
+        """
+        for iteration in range(self.iteration):
+            seed = None
+            if self.seed is not None:
+                # reproducible, but a different order every iteration
+                seed = int(self.seed) + iteration
+            self.__run_plan('random', self.hotplug_cpus, seed=seed)
 
     def multiple_cpus_toggle(self):
         """
@@ -299,3 +472,7 @@ class cpuHotplug(Test):
                 "ppc64_cpu --smt=off && ppc64_cpu --smt=on && ppc64_cpu --smt=%s"
                 % self.curr_smt, shell=True)
         self.__online_cpus(totalcpus)
+        if hasattr(self, 'kmsg'):
+            self.kmsg.close()
+        if hasattr(self, 'engine'):
+            self.engine.close()
@@ -34,9 +34,17 @@ import time
 from avocado import *
 from avocado.utils import process
 from avocado.utils.ssh import Session
-__all__ = ['TestException', 'SshMachine', 'TestLog',
+__all__ = ['TestException', 'SshMachine', 'HmcCache', 'TestLog',
            'TestCase', 'DedicatedCpu', 'CpuUnit', 'Memory']
 
+# Attributes fetched together by a single lshwres call
+PROC_ATTRS = ('curr_proc_mode', 'curr_min_procs', 'curr_procs',
+              'curr_max_procs', 'curr_min_proc_units', 'curr_proc_units',
+              'curr_max_proc_units')
+MEM_ATTRS = ('curr_min_mem', 'curr_mem', 'curr_max_mem')
+SYS_MEM_ATTRS = ('mem_region_size', 'curr_avail_sys_mem',
+                 'configurable_sys_mem')
+
 
 class TestException(Exception):
     """Base Class for all test exceptions."""
@@ -78,7 +86,14 @@ class SshMachine():
 
         self.log = log
         if machine_type == "hmc" or machine_type == "linux_secondary":
-            self.sshcnx = self.__init_ssh(self.user, self.passwd, self.name)
+            # a local command backend (e.g. FakeHmc) can stand in for the
+            # ssh connection
+            backend = config_payload.get('hmc_backend')
+            if backend is not None:
+                self.sshcnx = backend
+            else:
+                self.sshcnx = self.__init_ssh(self.user, self.passwd,
+                                              self.name)
 
     def __init_ssh(self, hmc_username, hmc_pwd,  hmc_ip):
         """Return the SSH connection"""
@@ -94,6 +109,52 @@ class SshMachine():
         return self.session_hmc
 
 
+class HmcCache():
+    """Cache of the lshwres attributes read from the HMC.
+
+    Every lshwres is an SSH round-trip, and the validation of a single
+    DLPAR operation used to issue one per attribute it reads. The cache
+    fetches all the known attributes of a partition (or managed system)
+    in a single 'lshwres -F a,b,c' call and serves the following reads
+    from memory, until invalidate() is called after a chhwres.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self.values = {}
+
+    def get(self, sshcnx, query, attrs, option):
+        """
+        Returns the value of option for the lshwres query, fetching attrs
+        along with it when it is not cached yet.
+        """
+        values = self.values.setdefault(query, {})
+        if option not in values:
+            fields = list(attrs)
+            if option not in fields:
+                fields.append(option)
+            values.update(self.__fetch(sshcnx, query, fields))
+            if option not in values:
+                # some attribute is not valid here, ask for option alone
+                values.update(self.__fetch(sshcnx, query, [option]))
+        return values.get(option, '')
+
+    def __fetch(self, sshcnx, query, fields):
+        output = sshcnx.cmd(query + ' -F ' + ','.join(fields))
+        output = output.stdout_text.strip()
+        if len(fields) == 1:
+            return {fields[0]: output}
+        if output.count(',') != len(fields) - 1:
+            if self.log:
+                self.log.debug('Unexpected lshwres output: %s' % output)
+            return {}
+        return dict(zip(fields, output.split(',')))
+
+    def invalidate(self):
+        """Drops all the cached values."""
+        self.values.clear()
+
+
 class TestLog(logging.Logger):
     """Log Object.
 
@@ -167,6 +228,10 @@ class TestCase:
         self.log.info('Starting %s Test Case.' % test_name)
 
         self.cpu_per_processor = int(config_payload.get('cfg_cpu_per_proc'))
+        self.hmc_cache = HmcCache(self.log)
+        # a local HMC stand-in (e.g. FakeHmc) has no linux partitions
+        # behind it to check the processors at
+        self.linux_checks = config_payload.get('hmc_backend') is None
 
     def get_connections(self, config_payload, clients='both'):
         """
@@ -217,6 +282,8 @@ class TestCase:
         else:
             self.log.error("Invalid DLPAR flag")
         self.cmd_result = self.hmc.sshcnx.cmd(cmd)
+        # the partitions and the managed system changed, forget about them
+        self.hmc_cache.invalidate()
         return self.cmd_result
 
     def Dlpar_cpu_validation(self, flag, linux_machine, quantity,
@@ -268,6 +335,10 @@ class TestCase:
                 self.log.error(e_msg)
                 raise TestException()
             # Check at both linux partitions
+            if not self.linux_checks:
+                self.log.info('Skipping the linux partition checks, the '
+                              'HMC backend has no partitions behind it.')
+                return
             self.linux_check_rm_cpu(
                 linux_machine[0], curr_procs_info[0], quantity)
             self.linux_check_add_cpu(linux_machine[1], quantity)
@@ -377,8 +448,9 @@ class TestCase:
 
         o_cmd = 'lshwres -m ' + linux_machine.machine + \
                 ' --level lpar -r proc --filter lpar_names="' + \
-                linux_machine.partition + '" -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+                linux_machine.partition + '"'
+        opt_value = self.hmc_cache.get(self.hmc.sshcnx, o_cmd, PROC_ATTRS,
+                                       option)
         d_msg = option + ": " + opt_value + " for partition " + \
             linux_machine.partition
         self.log.debug(d_msg)
@@ -388,8 +460,9 @@ class TestCase:
         """Just to help getting a memory option from hmc."""
         o_cmd = 'lshwres -m ' + linux_machine.machine + \
                 ' --level lpar -r mem --filter lpar_names="' + \
-                linux_machine.partition + '" -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+                linux_machine.partition + '"'
+        opt_value = self.hmc_cache.get(self.hmc.sshcnx, o_cmd, MEM_ATTRS,
+                                       option)
         d_msg = option + ": " + opt_value + " for partition " + \
             linux_machine.partition
         self.log.debug(d_msg)
@@ -397,9 +470,9 @@ class TestCase:
 
     def get_lmb_value(self, linux_machine, option):
         """to get lmb size of a managed system"""
-        o_cmd = 'lshwres -r mem -m ' + linux_machine.machine + \
-                ' --level sys -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+        o_cmd = 'lshwres -r mem -m ' + linux_machine.machine + ' --level sys'
+        opt_value = self.hmc_cache.get(self.hmc.sshcnx, o_cmd, SYS_MEM_ATTRS,
+                                       option)
         d_msg = option + ": " + opt_value + " for CEC " + \
             linux_machine.machine
         self.log.debug(d_msg)
@@ -870,10 +943,8 @@ class Memory(TestCase):
         self.log.debug("Machine: %s" % linux_machine.name)
 
         # Getting memory configuration
-        m_cmd = 'lshwres -m ' + linux_machine.machine + \
-                ' --level sys -r mem -F curr_avail_sys_mem'
-        curr_avail_sys_mem = int(
-            self.hmc.sshcnx.cmd(m_cmd).stdout_text.strip())
+        curr_avail_sys_mem = int(self.get_lmb_value(linux_machine,
+                                                    'curr_avail_sys_mem'))
         curr_max_mem = int(self.get_mem_option(linux_machine, 'curr_max_mem'))
         curr_mem = int(self.get_mem_option(linux_machine, 'curr_mem'))
         # Check if the system support the memory units to remove
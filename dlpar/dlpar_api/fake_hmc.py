@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Local stand-in for the HMC used by the DLPAR test suite API.
+
+FakeHmc keeps the processor and memory configuration of a managed system
+and its partitions in memory, and answers the chhwres, lshwres and
+lssyscfg command lines the API sends, with a configurable latency. It
+has the same cmd() method as the SSH session, so it can be passed to
+SshMachine through the 'hmc_backend' payload entry, e.g.::
+
+    hmc = FakeHmc('system', latency=0.5, dlpar_latency=5)
+    hmc.add_partition('lpar1', procs=(1, 4, 16), mem=(2048, 8192, 32768))
+    payload['hmc_backend'] = hmc
+"""
+
+import shlex
+import threading
+import time
+
+from avocado.utils import process
+
+__all__ = ['FakeHmc']
+
+PROC_MODES = ('ded', 'shared')
+
+
+class FakeHmc():
+    """In-memory HMC managing a single system.
+
+    :param machine: managed system name
+    :param latency: seconds every command takes
+    :param dlpar_latency: additional seconds every chhwres takes
+    :param mem_region_size: LMB size of the system in MB
+    :param avail_mem: memory not assigned to any partition in MB
+    :param avail_procs: processors not assigned to any partition
+    :param avail_proc_units: processor units not assigned to any partition
+    """
+
+    def __init__(self, machine, latency=0.0, dlpar_latency=0.0,
+                 mem_region_size=256, avail_mem=65536, avail_procs=32,
+                 avail_proc_units=32.0):
+        self.machine = machine
+        self.latency = latency
+        self.dlpar_latency = dlpar_latency
+        self.system = {'mem_region_size': mem_region_size,
+                       'curr_avail_sys_mem': avail_mem,
+                       'configurable_sys_mem': avail_mem,
+                       'curr_avail_sys_proc_units': avail_proc_units,
+                       'curr_avail_sys_procs': avail_procs}
+        self.partitions = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def add_partition(self, name, proc_mode='ded', procs=(1, 2, 8),
+                      proc_units=(0.1, 1.0, 8.0), mem=(1024, 4096, 16384)):
+        """
+        Adds a running partition, procs, proc_units and mem are
+        (min, current, max) tuples, mem is in MB.
+        """
+        if proc_mode not in PROC_MODES:
+            raise ValueError('Invalid processor mode %s' % proc_mode)
+        lpar = {'name': name, 'lpar_id': len(self.partitions) + 1,
+                'state': 'Running', 'rmc_state': 'active',
+                'dlpar_mem_capable': 1, 'dlpar_proc_capable': 1,
+                'curr_proc_mode': proc_mode}
+        for prefix, values in (('procs', procs), ('proc_units', proc_units),
+                               ('mem', mem)):
+            for level, value in zip(('curr_min_', 'curr_', 'curr_max_'),
+                                    values):
+                lpar[level + prefix] = value
+        if proc_mode == 'ded':
+            for level in ('curr_min_', 'curr_', 'curr_max_'):
+                lpar[level + 'proc_units'] = None
+        self.partitions[name] = lpar
+        return lpar
+
+    def cmd(self, command):
+        """Runs an HMC command line, returns a CmdResult."""
+        args = shlex.split(command)
+        verb = args[0] if args else ''
+        handler = getattr(self, '_' + verb, None)
+        with self._lock:
+            self.stats[verb] = self.stats.get(verb, 0) + 1
+            if handler is None:
+                output, status = 'bash: %s: command not found' % verb, 127
+            else:
+                output, status = handler(self.__options(args[1:]))
+        delay = self.latency
+        if verb == 'chhwres':
+            delay += self.dlpar_latency
+        if delay:
+            time.sleep(delay)
+        return process.CmdResult(command, output.encode(), b'', status)
+
+    @staticmethod
+    def __options(args):
+        options = {}
+        for index, arg in enumerate(args):
+            if arg.startswith('-'):
+                value = None
+                if index + 1 < len(args) and not args[index + 1].startswith('-'):
+                    value = args[index + 1]
+                options[arg] = value
+        return options
+
+    @staticmethod
+    def __format(value):
+        if value is None:
+            return 'null'
+        if isinstance(value, float):
+            return str(round(value, 2))
+        return str(value)
+
+    def __fields(self, entry, options):
+        fields = options.get('-F')
+        if not fields:
+            return ','.join('%s=%s' % (key, self.__format(value))
+                            for key, value in entry.items()), 0
+        values = []
+        for field in fields.split(','):
+            if field not in entry:
+                return ('HSCL8012 The attribute %s is not valid for this '
+                        'command.' % field), 1
+            values.append(self.__format(entry[field]))
+        return ','.join(values), 0
+
+    def __lpar(self, options, option='-p'):
+        name = options.get(option)
+        if name is None and '--filter' in options:
+            name = (options['--filter'] or '').partition('lpar_names=')[2]
+        return self.partitions.get(name)
+
+    def _lshwres(self, options):
+        if options.get('-m') != self.machine:
+            return 'HSCL8012 The managed system was not found.', 1
+        resource = options.get('-r')
+        if resource not in ('proc', 'mem'):
+            return 'HSCL1234 Invalid resource type %s.' % resource, 1
+        if options.get('--level') == 'sys':
+            return self.__fields(self.system, options)
+        lpar = self.__lpar(options)
+        if lpar is None:
+            return 'HSCL8012 The partition was not found.', 1
+        return self.__fields(lpar, options)
+
+    def _lssyscfg(self, options):
+        if options.get('-r') == 'sys':
+            return self.__fields({'name': self.machine,
+                                  'state': 'Operating'}, options)
+        if options.get('-m') != self.machine:
+            return 'HSCL8012 The managed system was not found.', 1
+        lpars = list(self.partitions.values())
+        if '--filter' in options:
+            lpar = self.__lpar(options)
+            lpars = [lpar] if lpar else []
+        lines = []
+        for lpar in lpars:
+            output, status = self.__fields(lpar, options)
+            if status:
+                return output, status
+            lines.append(output)
+        return '\n'.join(lines), 0
+
+    def _chhwres(self, options):
+        if options.get('-m') != self.machine:
+            return 'HSCL8012 The managed system was not found.', 1
+        lpar = self.__lpar(options)
+        if lpar is None:
+            return 'HSCL8012 The partition was not found.', 1
+        operation = options.get('-o')
+        resource = options.get('-r')
+        if resource == 'mem':
+            attr, quantity = 'mem', options.get('-q')
+        elif '--procunits' in options:
+            attr, quantity = 'proc_units', options.get('--procunits')
+        else:
+            attr, quantity = 'procs', options.get('--procs')
+        try:
+            quantity = float(quantity) if attr == 'proc_units' \
+                else int(quantity)
+        except (TypeError, ValueError):
+            return 'HSCL1234 Invalid quantity %s.' % quantity, 1
+        if attr == 'proc_units' and lpar['curr_proc_mode'] != 'shared':
+            return ('HSCLA2C3 Processing units cannot be changed for a '
+                    'partition using dedicated processors.'), 1
+        if operation == 'a':
+            return self.__change(lpar, attr, quantity, True)
+        if operation == 'r':
+            return self.__change(lpar, attr, -quantity, True)
+        if operation == 'm':
+            target = self.__lpar(options, '-t')
+            if target is None:
+                return 'HSCL8012 The target partition was not found.', 1
+            output, status = self.__change(lpar, attr, -quantity, False)
+            if status:
+                return output, status
+            output, status = self.__change(target, attr, quantity, False)
+            if status:
+                # roll back the removal from the source partition
+                self.__change(lpar, attr, quantity, False)
+            return output, status
+        return 'HSCL1234 Invalid operation %s.' % operation, 1
+
+    def __change(self, lpar, attr, delta, pool):
+        avail = {'mem': 'curr_avail_sys_mem', 'procs': 'curr_avail_sys_procs',
+                 'proc_units': 'curr_avail_sys_proc_units'}[attr]
+        value = lpar['curr_' + attr] + delta
+        if attr == 'proc_units':
+            value = round(value, 2)
+        if pool and delta > self.system[avail]:
+            return 'The quantity to be added exceeds the available resources.', 1
+        if attr == 'mem':
+            if delta % self.system['mem_region_size']:
+                return ('HSCL2932 The memory quantity must be a multiple '
+                        'of the memory region size.'), 1
+            if value > lpar['curr_max_mem']:
+                return "Your memory request exceeds the profile's Maximum " \
+                       "memory limit.", 1
+            if value < lpar['curr_min_mem']:
+                return "Your memory request is below the profile’s " \
+                       "Minimum memory limit.", 1
+        elif not lpar['curr_min_' + attr] <= value <= lpar['curr_max_' + attr]:
+            return ('HSCL1566 The operation failed because the resulting '
+                    '%s %s is outside of the profile limits.' % (attr, value)), 1
+        if lpar['curr_proc_mode'] == 'shared' and attr != 'mem':
+            units = value if attr == 'proc_units' else lpar['curr_proc_units']
+            procs = value if attr == 'procs' else lpar['curr_procs']
+            if not 0.05 <= units / procs <= 1:
+                return ('The operation failed because the ratio of assigned '
+                        'processing units to assigned virtual processors '
+                        'would be out of range.'), 1
+        lpar['curr_' + attr] = value
+        # virtual processors do not come from the shared pool
+        if pool and not (attr == 'procs' and
+                         lpar['curr_proc_mode'] == 'shared'):
+            self.system[avail] -= delta
+            if attr == 'proc_units':
+                self.system[avail] = round(self.system[avail], 2)
+        return '', 0
@@ -17,6 +17,8 @@
 
 import re
 import os
+import json
+import time
 import random
 
 from avocado import Test
@@ -24,6 +26,7 @@ from avocado.utils import process
 from avocado.utils import wait
 from avocado.utils.software_manager.manager import SoftwareManager
 from dlpar_api.api import DedicatedCpu, CpuUnit, Memory
+from dlpar_api.fake_hmc import FakeHmc
 list_payload = ["cfg_cpu_per_proc", "hmc_manageSystem", "hmc_user",
                 "hmc_passwd", "target_lpar_hostname", "target_partition",
                 "target_user", "target_passwd", "ded_quantity_to_test",
@@ -198,28 +201,67 @@ class DlparTests(Test):
 
         return result_list
 
+    def setup_fake_hmc(self):
+        '''
+        creates the local HMC stand-in with the primary and the target
+        partitions, both in the lp_mode processor mode
+        '''
+        def limits(name, default, cast=int):
+            return tuple(cast(value) for value in
+                         self.params.get(name, default=default).split())
+
+        self.res['hmc_manageSystem'] = self.res['hmc_manageSystem'] or \
+            'fake-system'
+        self.res['target_partition'] = self.res['target_partition'] or \
+            'fake-lpar2'
+        hmc = FakeHmc(self.res['hmc_manageSystem'],
+                      latency=float(self.params.get('fake_latency',
+                                                    default=0.0)),
+                      dlpar_latency=float(self.params.get(
+                          'fake_dlpar_latency', default=0.0)),
+                      mem_region_size=int(self.params.get('fake_lmb',
+                                                          default=256)))
+        proc_mode = 'ded' if self.lpar_mode == 'dedicated' else 'shared'
+        for partition in (self.pri_partition, self.res['target_partition']):
+            hmc.add_partition(
+                partition, proc_mode=proc_mode,
+                procs=limits('fake_procs', '1 2 16'),
+                proc_units=limits('fake_proc_units', '0.1 1.0 8.0', float),
+                mem=limits('fake_mem', '2048 8192 32768'))
+        return hmc
+
     def setUp(self):
         self.list_data = []
         self.lpar_mode = self.params.get('lp_mode', default='dedicated')
+        self.hmc_backend = self.params.get('hmc_backend', default='ssh')
         for i in list_payload:
             self.data = self.params.get(i, default='')
             self.list_data.append(self.data)
 
-        # Get HMC IP
-        self.hmc_ip = wait.wait_for(
-            lambda: self.get_mcp_component("HMCIPAddr"), timeout=30)
+        if self.hmc_backend == 'fake':
+            self.hmc_ip = 'localhost'
+            self.pri_partition = 'fake-lpar1'
+            self.pri_name = 'localhost'
+        else:
+            # Get HMC IP
+            self.hmc_ip = wait.wait_for(
+                lambda: self.get_mcp_component("HMCIPAddr"), timeout=30)
 
-        # Primary lpar details
-        self.pri_partition = self.get_partition_name("Partition Name")
-        self.pri_name = self.get_partition_name("Node Name")
+            # Primary lpar details
+            self.pri_partition = self.get_partition_name("Partition Name")
+            self.pri_name = self.get_partition_name("Node Name")
         pri_data = {"src_partition": self.pri_partition,
                     "src_name": self.pri_name,
                     "hmc_name": self.hmc_ip}
         self.res = {list_payload[i]: self.list_data[i]
                     for i in range(len(list_payload))}
         self.res = dict(list(pri_data.items()) + list(self.res.items()))
+        if self.hmc_backend == 'fake':
+            self.fake_hmc = self.setup_fake_hmc()
         self.log.info("Calling Config file creation method--!!")
         self.sorted_payload = dict(sorted(self.res.items()))
+        if self.hmc_backend == 'fake':
+            self.sorted_payload['hmc_backend'] = self.fake_hmc
         self.iterations = self.sorted_payload.get('iterations')
 
     def test_cpu_add(self):
@@ -793,6 +835,80 @@ class DlparTests(Test):
         set_smt_value = process.system_output(
             'ppc64_cpu --smt=8', shell=True, ignore_status=False)
 
+    def benchmark_payload(self, name, payload, add, remove):
+        '''
+        adds every value of the payload and then removes them back in
+        reverse order, returns the timing of both phases
+        '''
+        results = {}
+        for phase, operation, values in (('add', add, payload),
+                                         ('remove', remove,
+                                          list(reversed(payload)))):
+            durations = []
+            for value in values:
+                start = time.monotonic()
+                if operation(value) == 1:
+                    self.fail("%s %s of %s failed please check the logs" %
+                              (name, phase, value))
+                durations.append(time.monotonic() - start)
+            elapsed = sum(durations)
+            results[phase] = {'operations': len(durations),
+                              'elapsed': elapsed,
+                              'ops_per_minute': (len(durations) * 60.0 /
+                                                 elapsed if elapsed else 0),
+                              'mean': (elapsed / len(durations)
+                                       if durations else 0),
+                              'max': max(durations, default=0)}
+            self.log.info("%s %s: %s operations, %.2f ops/minute, "
+                          "mean %.3fs, max %.3fs", name, phase,
+                          len(durations), results[phase]['ops_per_minute'],
+                          results[phase]['mean'], results[phase]['max'])
+        return results
+
+    def test_dlpar_benchmark(self):
+        '''
+        measures the DLPAR operations per minute for the cpu and memory
+        payload sequences, run against the HMC or the local stand-in
+        (hmc_backend: fake)
+        '''
+        if self.lpar_mode == 'dedicated':
+            cpu_obj = DedicatedCpu(self.sorted_payload,
+                                   log='dedicated_cpu.log')
+            cpu_payload = self.cpu_payload_data(cpu_obj.get_max_proc(),
+                                                cpu_obj.get_curr_proc())
+            cpu_add, cpu_rem = cpu_obj.add_ded_cpu, cpu_obj.rem_ded_cpu
+        else:
+            cpu_obj = CpuUnit(self.sorted_payload, log='cpu_unit.log')
+            cpu_payload = self.cpu_payload_data(
+                cpu_obj.get_shared_max_proc(), cpu_obj.get_shared_curr_proc())
+
+            def cpu_add(cpu):
+                return cpu_obj.add_proc(cpu, '--procs')
+
+            def cpu_rem(cpu):
+                return cpu_obj.remove_proc(cpu, '--procs')
+        mem_obj = Memory(self.sorted_payload, log='memory.log')
+        mem_payload = self.mem_payload_data(mem_obj.get_curr_mem(),
+                                            mem_obj.get_lmb_size(),
+                                            mem_obj.get_max_mem())[:-1]
+        if not cpu_payload and not mem_payload:
+            self.cancel("Partition has no room to add cpus or memory")
+        self.log.info("cpu payload: %s, memory payload: %s",
+                      cpu_payload, mem_payload)
+
+        results = {'sleep_time': self.sorted_payload.get('sleep_time'),
+                   'cpu': self.benchmark_payload('cpu', cpu_payload,
+                                                 cpu_add, cpu_rem),
+                   'mem': self.benchmark_payload('memory', mem_payload,
+                                                 mem_obj.mem_add,
+                                                 mem_obj.mem_rem)}
+        if self.hmc_backend == 'fake':
+            results['hmc_commands'] = dict(self.fake_hmc.stats)
+        with open(os.path.join(self.outputdir, 'dlpar-benchmark.json'),
+                  'w') as result_file:
+            json.dump(results, result_file, indent=4)
+        self.whiteboard = json.dumps(results)
+
     def _cancel_on_capacity_exceeded(self, stdout=""):
         if not stdout:
             return
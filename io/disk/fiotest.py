@@ -23,8 +23,11 @@ FIO Test
 """
 
 import os
+import json
 import time
+import threading
 import avocado
+from concurrent.futures import ThreadPoolExecutor
 
 from avocado import Test
 from avocado.utils import archive
@@ -39,6 +42,163 @@ from avocado.utils.partition import Partition
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils.partition import PartitionError
 
+from common_api.build_cache import BuildCache, CACHE_DIR
+
+# percentiles reported in the whiteboard, fio reports them as '99.000000'
+PERCENTILES = ('50.000000', '90.000000', '99.000000', '99.900000')
+
+
+def parse_fio_json(output):
+    """
+    Summarizes the per job results of a fio --output-format=json+ run.
+
+    :param output: JSON document written by fio
+    :return: dict keyed by job name, with bw (KiB/s), iops, io_bytes,
+             total_ios and the completion latency (usec) mean/min/max,
+             percentiles and histogram of every data direction with I/O done
+    """
+    results = {}
+    for job in json.loads(output).get('jobs', []):
+        summary = {}
+        for ddir in ('read', 'write', 'trim'):
+            stats = job.get(ddir)
+            if not stats or not stats.get('io_bytes'):
+                continue
+            # fio >= 3 reports latencies in nsec, older ones in usec
+            if 'clat_ns' in stats:
+                clat, scale = stats['clat_ns'], 1000.0
+            else:
+                clat, scale = stats.get('clat', {}), 1.0
+            percentiles = {key: value / scale for key, value in
+                           clat.get('percentile', {}).items()}
+            summary[ddir] = {
+                'bw': stats['bw'],
+                'iops': stats['iops'],
+                'io_bytes': stats['io_bytes'],
+                'total_ios': stats.get('total_ios', 0),
+                'clat_mean': clat.get('mean', 0) / scale,
+                'clat_min': clat.get('min', 0) / scale,
+                'clat_max': clat.get('max', 0) / scale,
+                'clat_percentiles': percentiles,
+                # json+ only: latency (nsec/usec) -> number of I/Os
+                'clat_histogram': clat.get('bins', {})}
+        for unit in ('latency_ns', 'latency_us', 'latency_ms'):
+            if unit in job:
+                summary.setdefault('latency', {})[unit] = job[unit]
+        results[job['jobname']] = summary
+    return results
+
+
+class FioTarget(object):
+
+    """
+    A disk of the multi disk mode, along with the raid, lv and filesystem
+    created on it. Names are suffixed with the disk index so that every
+    disk can be prepared concurrently.
+    """
+
+    def __init__(self, l_disk, index, workdir, fio_file):
+        self.disk = l_disk
+        self.name = os.path.basename(l_disk)
+        self.target = l_disk
+        self.lv_disk = l_disk
+        self.dir = os.path.join(workdir, 'disk%s' % index)
+        self.fio_file = fio_file
+        self.raid_name = '/dev/md/sraid%s' % index
+        self.vgname = 'avocado_vg%s' % index
+        self.lvname = 'avocado_lv%s' % index
+        self.sraid = None
+        self.lv_create = False
+        self.part_obj = None
+
+    @property
+    def filename(self):
+        """
+        File or device fio runs on
+        """
+        if self.part_obj:
+            return os.path.join(self.dir, self.fio_file)
+        return self.target
+
+    def pre_cleanup(self):
+        """
+        Removes the filesystem, lv and raid a previous run left on the disk,
+        like FioTest.pre_cleanup does in the single disk mode.
+        """
+        def is_mounted(path):
+            return disk.is_disk_mounted(path) or disk.is_dir_mounted(path)
+
+        lv_path = '/dev/mapper/%s-%s' % (self.vgname, self.lvname)
+        for path in (self.dir, lv_path, self.raid_name, self.disk):
+            if is_mounted(path):
+                process.system("umount %s" % path, shell=True,
+                               ignore_status=True)
+                if is_mounted(path):
+                    raise RuntimeError("failed to unmount %s" % path)
+        for path in (lv_path, self.raid_name, self.disk):
+            if os.path.exists(path) and disk.fs_exists(path):
+                process.system("wipefs -af %s" % path, shell=True,
+                               ignore_status=True)
+        if lv_utils.lv_check(self.vgname, self.lvname):
+            lv_utils.lv_remove(self.vgname, self.lvname)
+        if lv_utils.vg_check(self.vgname):
+            lv_utils.vg_remove(self.vgname)
+        sraid = softwareraid.SoftwareRaid(self.raid_name, '0', [self.disk],
+                                          '1.2')
+        if sraid.exists():
+            sraid.stop()
+            sraid.clear_superblock()
+            process.system("wipefs -af %s" % self.disk, shell=True,
+                           ignore_status=True)
+            if sraid.exists():
+                raise RuntimeError("failed to delete raid %s" %
+                                   self.raid_name)
+
+    def prepare(self, raid_needed, lv_needed, fstype, fs_args, mnt_args):
+        """
+        Cleans up and creates the raid, lv and filesystem asked for on the
+        disk.
+        """
+        self.pre_cleanup()
+        if raid_needed:
+            self.sraid = softwareraid.SoftwareRaid(self.raid_name, '0',
+                                                   [self.disk], '1.2')
+            self.sraid.create()
+            self.target = self.raid_name
+        if lv_needed:
+            self.lv_disk = self.target
+            lv_size = lv_utils.get_device_total_space(self.target) / 2330168
+            lv_utils.vg_create(self.vgname, self.target, force=True)
+            lv_utils.lv_create(self.vgname, self.lvname, lv_size)
+            self.lv_create = True
+            self.target = '/dev/%s/%s' % (self.vgname, self.lvname)
+        if fstype:
+            if not os.path.isdir(self.dir):
+                os.makedirs(self.dir)
+            self.part_obj = Partition(self.target, mountpoint=self.dir)
+            self.part_obj.unmount()
+            self.part_obj.mkfs(fstype, args=fs_args)
+            self.part_obj.mount(args=mnt_args)
+
+    def cleanup(self):
+        """
+        Removes the filesystem, lv and raid created on the disk.
+        """
+        if self.part_obj:
+            self.part_obj.unmount()
+            process.system("wipefs -af %s" % self.target, shell=True,
+                           ignore_status=True)
+        if self.lv_create:
+            lv_utils.lv_remove(self.vgname, self.lvname)
+            lv_utils.vg_remove(self.vgname)
+            process.system("wipefs -af %s" % self.lv_disk, shell=True,
+                           ignore_status=True)
+        if self.sraid:
+            self.sraid.stop()
+            self.sraid.clear_superblock()
+            process.system("wipefs -af %s" % self.disk, shell=True,
+                           ignore_status=True)
+
 
 class FioTest(Test):
 
@@ -50,6 +210,13 @@ class FioTest(Test):
 
     :param fio_tarbal: name of the tarball of fio suite located in deps path
     :param fio_job: config defining set of executed tests located in deps path
+    :param min_iops: minimum IOPS every job has to reach on each direction
+    :param max_p99_latency: maximum p99 completion latency (usec) of a job
+    :param disks: space separated disks fio runs on concurrently, one fio
+                  process per disk, instead of the single disk one
+    :param build_cache_dir: persistent directory fio is built in, and
+                            reused from when it was built before
+    :param rebuild: builds fio again even when it is in the build cache
     """
 
     def setUp(self):
@@ -70,10 +237,22 @@ class FioTest(Test):
         self.lv_create = False
         self.raid_create = False
         self.devdax_file = None
+        self.targets = []
+        self.summary = {}
+        self.gate_failures = []
         self.disk_type = self.params.get('disk_type', default='')
         device = self.params.get('disk', default=None)
+        disks = self.params.get('disks', default=None)
         detected_distro = distro.detect()
-        if device and not self.disk_type:
+        if disks and not self.disk_type:
+            self.disk = None
+            for index, device in enumerate(disks.split()):
+                l_disk = disk.get_absolute_disk_path(device)
+                if l_disk not in disk.get_all_disk_paths():
+                    self.cancel("Missing disk %s in OS" % l_disk)
+                self.targets.append(FioTarget(l_disk, index, self.workdir,
+                                              self.fio_file))
+        elif device and not self.disk_type:
             self.disk = disk.get_absolute_disk_path(device)
             if self.disk not in disk.get_all_disk_paths():
                 self.cancel("Missing disk %s in OS" % self.disk)
@@ -120,8 +299,11 @@ class FioTest(Test):
                 self.cancel("Package %s is missing and could not be installed"
                             % pkg)
 
-        tarball = self.fetch_asset(url)
-        archive.extract(tarball, self.teststmpdir)
+        self.tarball = self.fetch_asset(url)
+        self.build_cache = BuildCache(
+            self.log, cache_dir=self.params.get('build_cache_dir',
+                                                default=CACHE_DIR),
+            rebuild=self.params.get('rebuild', default=False))
         self.sourcedir = os.path.join(self.teststmpdir, "fio")
         fio_flags = ""
         self.ld_path = ""
@@ -131,6 +313,8 @@ class FioTest(Test):
 
         if self.disk_type == 'nvdimm':
             self.setup_pmem_disk(mnt_args)
+            # fio links with the PMDK built in this run, not cached
+            archive.extract(self.tarball, self.teststmpdir)
             self.log.info("Building PMDK for NVDIMM fio engines")
             pmdk_url = self.params.get('pmdk_url', default='')
             tar = self.fetch_asset(pmdk_url, expire='7d')
@@ -163,6 +347,11 @@ class FioTest(Test):
             self.pre_cleanup()
         dmesg.clear_dmesg()
 
+        if self.targets:
+            self.prepare_targets(fio_flags, raid_needed, lv_needed, fstype,
+                                 fs_args, mnt_args)
+            return
+
         if raid_needed:
             self.create_raid(self.target, self.raid_name)
             self.raid_create = True
@@ -177,7 +366,44 @@ class FioTest(Test):
             self.create_fs(self.target, self.dir, fstype, fs_args, mnt_args)
             self.fs_create = True
 
-        build.make(self.sourcedir, extra_args=fio_flags)
+        self.build_fio(fio_flags)
+        if not os.path.exists(os.path.join(self.sourcedir, 'fio')):
+            self.fail("fio build failed")
+
+    def build_fio(self, fio_flags):
+        """
+        Builds fio, in the build cache unless it is built with the PMDK
+        of this run.
+        """
+        if fio_flags:
+            build.make(self.sourcedir, extra_args=fio_flags)
+            return
+        sourcedir = self.build_cache.build('fio', self.tarball,
+                                           'make -j$(nproc)')
+        if sourcedir:
+            self.sourcedir = sourcedir
+
+    def prepare_targets(self, fio_flags, raid_needed, lv_needed, fstype,
+                        fs_args, mnt_args):
+        """
+        Builds fio once while all the disks of the multi disk mode are
+        prepared concurrently.
+        """
+        builder = threading.Thread(target=self.build_fio, args=(fio_flags,))
+        builder.start()
+        with ThreadPoolExecutor(max_workers=len(self.targets)) as pool:
+            futures = [pool.submit(target.prepare, raid_needed, lv_needed,
+                                   fstype, fs_args, mnt_args)
+                       for target in self.targets]
+        builder.join()
+        errors = []
+        for target, future in zip(self.targets, futures):
+            if future.exception():
+                errors.append("%s: %s" % (target.disk, future.exception()))
+        if errors:
+            self.fail("Preparing disks failed: %s" % ', '.join(errors))
+        if not os.path.exists(os.path.join(self.sourcedir, 'fio')):
+            self.fail("fio build failed")
 
     @avocado.fail_on(pmem.PMemException)
     def setup_pmem_disk(self, mnt_args):
@@ -393,8 +619,14 @@ class FioTest(Test):
         """
         Execute 'fio' with appropriate parameters.
         """
-        self.log.info("Test will run on %s", self.dir)
         fio_job = self.params.get('fio_job', default='fio-simple.job')
+        if self.targets:
+            self.log.info("Test will run on %s",
+                          ', '.join(target.disk for target in self.targets))
+            self.run_targets(fio_job)
+            self.check_gates()
+            return
+        self.log.info("Test will run on %s", self.dir)
 
         # if fs is present create a file on that fs, if no fs
         # self.dirs = path to disk, thus a filename is not needed
@@ -406,10 +638,10 @@ class FioTest(Test):
             filename = self.target
         else:
             filename = self.dir
-        cmd = '%s %s/fio %s --filename=%s' % (self.ld_path,
-                                              self.sourcedir,
-                                              self.get_data(fio_job),
-                                              filename)
+        fio_output = os.path.join(self.outputdir, 'fio-output.json')
+        cmd = '%s %s/fio %s --filename=%s --output-format=json+ ' \
+              '--output=%s' % (self.ld_path, self.sourcedir,
+                               self.get_data(fio_job), filename, fio_output)
         self.log.info("running fio test using command : %s" % cmd)
         status = process.system(cmd, ignore_status=True, shell=True)
         if status:
@@ -420,6 +652,139 @@ class FioTest(Test):
                 self.log.warning("Warnings during fio run")
             else:
                 self.fail("fio run failed")
+        self.check_results(fio_output)
+        self.check_gates()
+
+    def run_targets(self, fio_job):
+        """
+        Runs one fio process per disk of the multi disk mode concurrently,
+        and aggregates the per device and total throughput.
+        """
+        runs = []
+        for target in self.targets:
+            fio_output = os.path.join(self.outputdir, 'fio-output-%s.json'
+                                      % target.name)
+            cmd = '%s %s/fio %s --filename=%s --output-format=json+ ' \
+                  '--output=%s' % (self.ld_path, self.sourcedir,
+                                   self.get_data(fio_job), target.filename,
+                                   fio_output)
+            self.log.info("running fio on %s using command : %s",
+                          target.disk, cmd)
+            runs.append((target, fio_output, cmd))
+
+        def run_fio(run):
+            start = time.time()
+            status = process.system(run[2], ignore_status=True, shell=True)
+            return status, max(time.time() - start, 0.001)
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=len(runs)) as pool:
+            statuses = list(pool.map(run_fio, runs))
+        elapsed = time.time() - start
+
+        failed = []
+        aggregate = {'devices': {}}
+        for (target, fio_output, _), (status, device_time) in zip(runs,
+                                                                  statuses):
+            if status == 3:
+                self.log.warning("Warnings during fio run on %s",
+                                 target.disk)
+            elif status:
+                failed.append(target.disk)
+            results = self.check_results(fio_output, target.name)
+            io_bytes = sum(stats['io_bytes'] for summary in results.values()
+                           for ddir, stats in summary.items()
+                           if ddir != 'latency')
+            total_ios = sum(stats['total_ios'] for summary in results.values()
+                            for ddir, stats in summary.items()
+                            if ddir != 'latency')
+            aggregate['devices'][target.disk] = {
+                'io_bytes': io_bytes, 'elapsed': device_time,
+                'bw': io_bytes / 1024.0 / device_time,
+                'iops': total_ios / device_time}
+        devices = aggregate['devices'].values()
+        aggregate['total'] = {
+            'io_bytes': sum(device['io_bytes'] for device in devices),
+            'elapsed': elapsed,
+            'bw': sum(device['io_bytes'] for device in devices) / 1024.0 /
+            elapsed,
+            'iops': sum(device['iops'] * device['elapsed']
+                        for device in devices) / elapsed}
+        for device, stats in sorted(aggregate['devices'].items()):
+            self.log.info("%s: %.2f KiB/s, %.2f IOPS", device, stats['bw'],
+                          stats['iops'])
+        self.log.info("total: %.2f KiB/s, %.2f IOPS over %s disks",
+                      aggregate['total']['bw'], aggregate['total']['iops'],
+                      len(runs))
+        with open(os.path.join(self.outputdir, 'fio-aggregate.json'),
+                  'w') as result_file:
+            json.dump(aggregate, result_file, indent=1)
+        self.summary['aggregate'] = aggregate
+        if failed:
+            self.fail("fio run failed on %s" % ', '.join(failed))
+
+    def check_results(self, fio_output, device=None):
+        """
+        Records the fio results and checks them against the IOPS and p99
+        latency gates given for the disk type.
+
+        :param fio_output: fio JSON output file
+        :param device: device name the results are recorded for, in the
+                       multi disk mode
+        :return: dict with the parsed results
+        """
+        min_iops = self.params.get('min_iops', default=None)
+        max_p99 = self.params.get('max_p99_latency', default=None)
+        try:
+            with open(fio_output) as output:
+                results = parse_fio_json(output.read())
+        except (IOError, ValueError) as ex:
+            self.log.warning("Could not parse fio results: %s", ex)
+            return {}
+        name = 'fio-results.json'
+        prefix = ''
+        if device:
+            name = 'fio-results-%s.json' % device
+            prefix = '%s-' % device
+        with open(os.path.join(self.outputdir, name), 'w') as result_file:
+            json.dump(results, result_file, indent=1)
+
+        for job, summary in results.items():
+            for ddir, stats in summary.items():
+                if ddir == 'latency':
+                    continue
+                p99 = stats['clat_percentiles'].get('99.000000')
+                self.log.info("%s%s %s: bw=%sKiB/s iops=%.2f clat p99=%sus",
+                              prefix, job, ddir, stats['bw'], stats['iops'],
+                              p99)
+                self.summary['%s%s-%s' % (prefix, job, ddir)] = {
+                    'bw': stats['bw'], 'iops': stats['iops'],
+                    'clat_mean': stats['clat_mean'],
+                    'clat_percentiles': {
+                        key: value for key, value in
+                        stats['clat_percentiles'].items()
+                        if key in PERCENTILES}}
+                if min_iops is not None and stats['iops'] < float(min_iops):
+                    self.gate_failures.append(
+                        "%s%s %s iops %.2f < %s"
+                        % (prefix, job, ddir, stats['iops'], min_iops))
+                if max_p99 is not None and p99 is not None and \
+                        p99 > float(max_p99):
+                    self.gate_failures.append(
+                        "%s%s %s p99 latency %sus > %sus"
+                        % (prefix, job, ddir, p99, max_p99))
+        return results
+
+    def check_gates(self):
+        """
+        Stores the results summary in the whiteboard and fails the test
+        when some of them are out of the gates.
+        """
+        self.whiteboard = json.dumps(self.summary, indent=1)
+        if self.gate_failures:
+            self.fail("fio results below the %s gates: %s"
+                      % (self.disk_type or 'disk',
+                         ', '.join(self.gate_failures)))
 
     def tearDown(self):
         '''
@@ -433,6 +798,14 @@ class FioTest(Test):
             self.delete_lv()
         if self.raid_create:
             self.delete_raid()
+        if self.targets:
+            with ThreadPoolExecutor(max_workers=len(self.targets)) as pool:
+                for target, future in [(target, pool.submit(target.cleanup))
+                                       for target in self.targets]:
+                    if future.exception():
+                        self.err_mesg.append("cleanup of %s failed: %s"
+                                             % (target.disk,
+                                                future.exception()))
         dmesg.clear_dmesg()
         if self.err_mesg:
             self.log.warn("test failed with errors: %s" % self.err_mesg)
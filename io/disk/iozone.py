@@ -26,23 +26,44 @@ import json
 import logging
 
 from avocado import Test
-from avocado.utils import archive
 from avocado.utils import process
-from avocado.utils import build
 from avocado.utils import distro
 from avocado.utils import disk
 from avocado.utils import lv_utils
 from avocado.utils import softwareraid
 from avocado.utils.partition import Partition
-from avocado.utils import data_structures
 from avocado.utils import astring
 from avocado.utils.partition import PartitionError
 from avocado.utils.software_manager.manager import SoftwareManager
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from common_api.build_cache import BuildCache, CACHE_DIR
 
 
 _LABELS = ['file_size', 'record_size', 'write', 'rewrite', 'read', 'reread',
            'randread', 'randwrite', 'bkwdread', 'recordrewrite', 'strideread',
            'fwrite', 'frewrite', 'fread', 'freread']
+_THROUGHPUT_LABELS = _LABELS[2:]
+
+# iozone throughput mode (-t) result lines, e.g.
+#   Children see throughput for  4 initial writers  =  123456.78 kB/sec
+#   Parent sees throughput for  4 initial writers   =  120000.12 kB/sec
+#   Min throughput per process                      =   30000.00 kB/sec
+#   Min xfer                                        =  102400.00 kB
+_CHILD_REGEXP = re.compile(r'Children see throughput for\s+(\d+)\s+'
+                           r'([-\w]+[-\w\s]*?)\s*=\s*([\d.]+)\s*[kK]B/sec')
+_PARENT_REGEXP = re.compile(r'Parent sees throughput for\s+(\d+)\s+'
+                            r'([-\w]+[-\w\s]*?)\s*=\s*([\d.]+)\s*[kK]B/sec')
+_WORKER_REGEXP = re.compile(r'^(Min|Max|Avg) throughput per '
+                            r'(?:thread|process)\s*=\s*([\d.]+)\s*[kK]B/sec')
+_XFER_REGEXP = re.compile(r'^Min xfer\s*=\s*([\d.]+)\s*[kK]B')
+# throughput record fields and the keyval suffixes used for them
+_THROUGHPUT_KEYS = [('children', 'kids'), ('parent', 'parent'),
+                    ('min', 'Min'), ('max', 'Max'), ('avg', 'Avg'),
+                    ('min_xfer', 'MinXfer')]
 
 
 class IOzoneAnalyzer(object):
@@ -55,61 +76,72 @@ class IOzoneAnalyzer(object):
     * Summary of throughput for all file sizes
     * Summary of throughput for all record sizes
 
-    If more than one file is provided to the analyzer object, a comparison
-    between the two runs is made, searching for regressions in performance.
+    Results are kept in a structured NumPy array, one field per IOzone
+    column, and the geometric means for every file or record size are
+    computed in a single pass over it.
+
+    If more than one file is provided to the analyzer object, the first one
+    is the run under analysis and the other ones are historical runs: a
+    trend of the overall results of all the runs is reported, and the
+    first run is compared against each of the others, searching for
+    regressions in performance larger than threshold percent.
     """
 
-    def __init__(self, log, list_files, output_dir):
+    def __init__(self, log, list_files, output_dir, threshold=5.0):
         self.list_files = list_files
         if not os.path.isdir(output_dir):
             os.makedirs(output_dir)
         self.output_dir = output_dir
+        self.threshold = float(threshold)
         self.log = log
         self.log.info("Results will be stored in %s", output_dir)
 
     @staticmethod
-    def average_performance(results, size=None):
-        """
-        Flattens a list containing performance results.
-        :param results: List of n lists containing data from performance runs.
-        :param size: Numerical value of a size (say, file_size) that was used
-                     to filter the original results list.
-        :return: List with 1 list containing average data from the performance
-                 run.
-        """
-        average_line = []
-        if size is not None:
-            average_line.append(size)
-        for i in range(2, 15):
-            average = data_structures.geometric_mean(
-                [line[i] for line in results]) / 1024.0
-            average = int(average)
-            average_line.append(average)
-        return average_line
+    def group_performance(results, label=None):
+        """
+        Computes the geometric mean throughput of results grouped by label.
+
+        :param results: Structured array with IOzone results.
+        :param label: IOzone column label used to group results, either
+                      'file_size' or 'record_size', None for a single group
+                      with all the results.
+        :return: Tuple with the array of sizes (None when not grouped) and a
+                 (sizes x 13) array with the averages in MB/sec.
+        """
+        values = numpy.stack([results[column]
+                              for column in _THROUGHPUT_LABELS], axis=1)
+        # zero throughput cells would make the logarithm undefined
+        logs = numpy.log(numpy.maximum(values, 1).astype(numpy.float64))
+        if label is None:
+            sizes = None
+            inverse = numpy.zeros(len(results), dtype=numpy.intp)
+            groups = 1
+        else:
+            sizes, inverse = numpy.unique(results[label],
+                                          return_inverse=True)
+            inverse = inverse.reshape(-1)
+            groups = len(sizes)
+        sums = numpy.zeros((groups, len(_THROUGHPUT_LABELS)))
+        numpy.add.at(sums, inverse, logs)
+        counts = numpy.bincount(inverse, minlength=groups)[:, None]
+        return sizes, numpy.exp(sums / counts) / 1024.0
 
     def process_results(self, results, label=None):
         """
-        Process a list of IOzone results according to label.
+        Process IOzone results according to label.
 
         :label: IOzone column label that we'll use to filter and compute
                 geometric mean results, in practical term either 'file_size'
                 or 'record_size'.
-        :result: A list of n x m columns with original iozone results.
+        :result: Structured array with original iozone results.
         :return: A list of n-? x (m-1) columns with geometric averages for
                 values of each label (ex, average for all file_sizes).
         """
-        performance = []
-        if label is not None:
-            index = _LABELS.index(label)
-            sizes = data_structures.ordered_list_unique(
-                [line[index] for line in results])
-            for size in sizes:
-                r_results = [line for line in results if line[index] == size]
-                performance.append(self.average_performance(r_results, size))
-        else:
-            performance.append(self.average_performance(results))
-
-        return performance
+        sizes, performance = self.group_performance(results, label)
+        performance = performance.astype(numpy.int64).tolist()
+        if sizes is None:
+            return performance
+        return [[int(size)] + line for size, line in zip(sizes, performance)]
 
     @staticmethod
     def parse_file(p_file):
@@ -117,7 +149,8 @@ class IOzoneAnalyzer(object):
         Parse an IOzone results file.
 
         :param file: File object that will be parsed.
-        :return: Matrix containing IOzone results extracted from the file.
+        :return: Structured array containing IOzone results extracted from
+                 the file, one field per IOzone column.
         """
         lines = []
         for line in p_file.readlines():
@@ -125,10 +158,29 @@ class IOzoneAnalyzer(object):
             if len(fields) != 15:
                 continue
             try:
-                lines.append([int(i) for i in fields])
+                lines.append(tuple(int(i) for i in fields))
             except ValueError:
                 continue
-        return lines
+        return numpy.array(lines, dtype=[(label, numpy.int64)
+                                         for label in _LABELS])
+
+    def compare(self, results, baseline, label):
+        """
+        Compares the throughput of two runs for every size of label.
+
+        :param results: Structured array with the results under analysis.
+        :param baseline: Structured array with the results compared against.
+        :param label: 'file_size' or 'record_size'.
+        :return: Tuple with the sizes present in both runs and the matrix
+                 of percentage deltas of results against baseline.
+        """
+        sizes, current = self.group_performance(results, label)
+        base_sizes, base = self.group_performance(baseline, label)
+        sizes, index, base_index = numpy.intersect1d(
+            sizes, base_sizes, return_indices=True)
+        base = base[base_index]
+        deltas = (current[index] - base) * 100.0 / base
+        return sizes, deltas
 
     def report(self, overall_results, record_size_results, file_size_results):
         """
@@ -198,84 +250,122 @@ class IOzoneAnalyzer(object):
 
         self.log.info("")
 
-    def report_comparison(self, record, files):
+    def report_trend(self, runs):
         """
-        Generates comparison data for 2 IOZone runs.
+        Reports the overall results of every run, one row per run, and
+        stores them in the 'trend.csv' file of the output directory.
 
-        It compares 2 sets of nxm results and outputs a table with differences.
-        If a difference higher or smaller than 5% is found, a warning is
-        triggered.
-
-        :param record: Tuple with 4 elements containing results for record
-        size.
-        :param file: Tuple with 4 elements containing results for file size.
+        :param runs: List of (path, results) tuples.
         """
-        (record_size, record_improvements, record_regressions,
-         record_total) = record
-        (file_size, file_improvements, file_regressions,
-         file_total) = files
-        header_list = ['RECORD SIZE (KB)', 'INIT WRITE', 'RE WRITE', 'READ',
-                       'RE READ', 'RANDOM READ', 'RANDOM WRITE', 'BACKWD READ',
+        rows = []
+        for path, results in runs:
+            rows.append([path] + self.process_results(results)[0])
+        header_list = ['RUN', 'INIT WRITE', 'RE WRITE', 'READ', 'RE READ',
+                       'RANDOM READ', 'RANDOM WRITE', 'BACKWD READ',
                        'RECRE WRITE', 'STRIDE READ', 'F WRITE', 'FRE WRITE',
                        'F READ', 'FRE READ']
-        self.log.info("\n%s", astring.tabular_output(
-            record_size, header=header_list))
-
-        self.log.info("ANALYSIS of DRILLED DATA:")
-
-        self.log.info("")
-        self.log.info("TABLE:  RECsize Difference between runs              "
-                      "Results are % DIFF")
         self.log.info("")
-        self.log.info("REGRESSIONS: %d (%.2f%%)    Improvements: %d (%.2f%%)",
-                      record_regressions,
-                      (100 * record_regressions / float(record_total)),
-                      record_improvements,
-                      (100 * record_improvements / float(record_total)))
+        self.log.info("TABLE:  TREND of ALL FILE and RECORD SIZES per run   "
+                      "Results in MB/sec")
         self.log.info("")
+        self.log.info("\n%s", astring.tabular_output(rows,
+                                                     header=header_list))
+        with open(os.path.join(self.output_dir, 'trend.csv'), 'w') as t_file:
+            t_file.write(','.join(['run'] + _THROUGHPUT_LABELS) + '\n')
+            for row in rows:
+                t_file.write(','.join(str(value) for value in row) + '\n')
+
+    def report_comparison(self, label, sizes, deltas):
+        """
+        Reports the percentage deltas of a comparison between 2 runs.
+
+        Deltas higher or smaller than the threshold are shown and counted as
+        improvements or regressions, the others are shown as '.'.
 
+        :param label: 'file_size' or 'record_size'.
+        :param sizes: Sizes compared.
+        :param deltas: Matrix with the percentage deltas of every size.
+        :return: Tuple with the number of improvements, regressions and
+                 cells compared.
+        """
+        improvements = int(numpy.count_nonzero(deltas > self.threshold))
+        regressions = int(numpy.count_nonzero(deltas < -self.threshold))
+        total = deltas.size
+        table = []
+        for size, line in zip(sizes, deltas):
+            table.append([int(size)] + ['%+.2f' % delta
+                                        if abs(delta) > self.threshold
+                                        else '.' for delta in line])
+        header_list = ['%s (KB)' % label.replace('_', ' ').upper(),
+                       'INIT WRITE', 'RE WRITE', 'READ', 'RE READ',
+                       'RANDOM READ', 'RANDOM WRITE', 'BACKWD READ',
+                       'RECRE WRITE', 'STRIDE READ', 'F WRITE', 'FRE WRITE',
+                       'F READ', 'FRE READ']
         self.log.info("")
-        self.log.info("TABLE:  FILEsize Difference between runs               "
-                      "Results are % DIFF")
+        self.log.info("TABLE:  %s Difference between runs              "
+                      "Results are %% DIFF", label)
         self.log.info("")
-
-        self.log.info("\n%s", astring.tabular_output(
-            file_size, header=header_list))
-        self.log.info("REGRESSIONS: %d (%.2f%%)    Improvements: %d (%.2f%%)",
-                      file_regressions,
-                      (100 * file_regressions / float(file_total)),
-                      file_improvements,
-                      (100 * file_improvements / float(file_total)))
+        self.log.info("\n%s", astring.tabular_output(table,
+                                                     header=header_list))
+        if total:
+            self.log.info("REGRESSIONS: %d (%.2f%%)    Improvements: %d "
+                          "(%.2f%%)", regressions,
+                          (100 * regressions / float(total)), improvements,
+                          (100 * improvements / float(total)))
         self.log.info("")
+        return improvements, regressions, total
 
     def analyze(self):
         """
         Analyzes and eventually compares sets of IOzone data.
-        """
-        overall = []
-        record_size = []
-        file_size = []
-        for path in self.list_files:
-            c_file = open(path, 'r')
-            self.log.info('FILE: %s', path)
-
-            results = self.parse_file(c_file)
 
-            overall_results = self.process_results(results)
-            record_size_results = self.process_results(results, 'record_size')
-            file_size_results = self.process_results(results, 'file_size')
-            self.report(overall_results, record_size_results,
-                        file_size_results)
-
-            if len(self.list_files) == 2:
-                overall.append(overall_results)
-                record_size.append(record_size_results)
-                file_size.append(file_size_results)
-
-        if len(self.list_files) == 2:
-            record_comparison = data_structures.compare_matrices(*record_size)
-            file_comparison = data_structures.compare_matrices(*file_size)
-            self.report_comparison(record_comparison, file_comparison)
+        :return: Dictionary with the comparison of the first run against
+                 every other run, also stored in 'comparison.json' of the
+                 output directory, None when the first run has no results.
+        """
+        runs = []
+        for index, path in enumerate(self.list_files):
+            with open(path, 'r') as c_file:
+                results = self.parse_file(c_file)
+            if not results.size:
+                if not index:
+                    self.log.error('FILE: %s has no IOzone results', path)
+                    return None
+                self.log.warning('FILE: %s has no IOzone results, skipping',
+                                 path)
+                continue
+            runs.append((path, results))
+        if not runs:
+            return {}
+
+        path, results = runs[0]
+        self.log.info('FILE: %s', path)
+        self.report(self.process_results(results),
+                    self.process_results(results, 'record_size'),
+                    self.process_results(results, 'file_size'))
+        if len(runs) == 1:
+            return {}
+
+        self.report_trend(runs)
+        comparison = {}
+        for base_path, baseline in runs[1:]:
+            self.log.info("ANALYSIS of DRILLED DATA against %s:", base_path)
+            summary = {'improvements': 0, 'regressions': 0, 'total': 0}
+            for label in ('record_size', 'file_size'):
+                sizes, deltas = self.compare(results, baseline, label)
+                counts = self.report_comparison(label, sizes, deltas)
+                for key, count in zip(('improvements', 'regressions',
+                                       'total'), counts):
+                    summary[key] += count
+                summary[label] = {
+                    str(int(size)): dict(zip(_THROUGHPUT_LABELS,
+                                             numpy.round(line, 2).tolist()))
+                    for size, line in zip(sizes, deltas)}
+            comparison[base_path] = summary
+        with open(os.path.join(self.output_dir, 'comparison.json'),
+                  'w') as c_file:
+            json.dump(comparison, c_file, indent=1)
+        return comparison
 
 
 class IOzonePlotter(object):
@@ -416,6 +506,8 @@ class IOZone(Test):
         '''
         Build IOZone
         '''
+        if numpy is None:
+            self.cancel("python3-numpy is needed for the test to be run")
         fstype = self.params.get('fs', default='')
         self.fs_create = False
         lv_needed = self.params.get('lv', default=False)
@@ -453,24 +545,25 @@ class IOZone(Test):
                             'btrfs-progs is needed for the test to be run')
 
         tarball = self.fetch_asset(self.source_url)
-        archive.extract(tarball, self.teststmpdir)
-        version = os.path.basename(tarball.split('.tar')[0])
-        self.sourcedir = os.path.join(self.teststmpdir, version)
-
-        make_dir = os.path.join(self.sourcedir, 'src', 'current')
-        os.chdir(make_dir)
         patch = self.params.get('patch', default='makefile.patch')
         patch = self.get_data(patch)
-        process.run('patch -p3 < %s' % patch, shell=True)
-
         if detected_distro.arch == 'ppc':
-            build.make(make_dir, extra_args='linux-powerpc')
+            target = 'linux-powerpc'
         elif detected_distro.arch == 'ppc64' or detected_distro.arch == 'ppc64le':
-            build.make(make_dir, extra_args='linux-powerpc64')
+            target = 'linux-powerpc64'
         elif detected_distro.arch == 'x86_64':
-            build.make(make_dir, extra_args='linux-AMD64')
+            target = 'linux-AMD64'
         else:
-            build.make(make_dir, extra_args='linux')
+            target = 'linux'
+        build_cmd = 'cd src/current && patch -p3 < ../../%s && make %s' % (
+            os.path.basename(patch), target)
+        self.sourcedir = BuildCache(
+            self.log, cache_dir=self.params.get('build_cache_dir',
+                                                default=CACHE_DIR),
+            rebuild=self.params.get('rebuild', default=False)).build(
+                'iozone', tarball, build_cmd, [patch])
+        if not self.sourcedir:
+            self.fail("Unable to compile iozone")
         self.dirs = self.disk
         if self.disk is not None:
             if self.disk in disk.get_all_disk_paths():
@@ -535,9 +628,67 @@ class IOZone(Test):
         """
         return desc.strip().replace(' ', '_')
 
+    @classmethod
+    def parse_throughput(cls, results):
+        """
+        Parses the output of an iozone throughput mode (-t) run.
+
+        :param results: iozone output.
+        :return: List with one record per test section, holding the worker
+                 count, children and parent throughput, the min/max/avg
+                 throughput per worker in KB/sec and the min xfer in KB.
+        """
+        records = []
+        record = None
+        for line in results.splitlines():
+            line = line.strip()
+            # Check for the beginning of a new result section
+            match = _CHILD_REGEXP.search(line)
+            if match:
+                record = {'section': cls.__get_section_name(match.group(2)),
+                          'workers': int(match.group(1)),
+                          'children': float(match.group(3))}
+                records.append(record)
+                continue
+            if record is None or '=' not in line:
+                continue
+            match = _PARENT_REGEXP.search(line)
+            if match:
+                # The section name and the worker count better match
+                if (cls.__get_section_name(match.group(2)) ==
+                        record['section'] and
+                        int(match.group(1)) == record['workers']):
+                    record['parent'] = float(match.group(3))
+                continue
+            match = _WORKER_REGEXP.search(line)
+            if match:
+                record[match.group(1).lower()] = float(match.group(2))
+                continue
+            match = _XFER_REGEXP.search(line)
+            if match:
+                record['min_xfer'] = float(match.group(1))
+        return records
+
+    def write_throughput(self, records):
+        """
+        Stores throughput mode records as JSON and CSV next to raw_output.
+        """
+        fields = ['section', 'workers'] + [field for field, _ in
+                                           _THROUGHPUT_KEYS]
+        with open(os.path.join(self.outputdir, 'throughput.json'),
+                  'w') as j_file:
+            json.dump(records, j_file, indent=1)
+        with open(os.path.join(self.outputdir, 'throughput.csv'),
+                  'w') as c_file:
+            c_file.write(','.join(fields) + '\n')
+            for record in records:
+                c_file.write(','.join(str(record.get(field, ''))
+                                      for field in fields) + '\n')
+
     def generate_keyval(self):
         """
-        Generating key-value list from results and recording it in JSON file
+        Generating key-value list from results and recording it in JSON file,
+        throughput mode records are also stored as JSON and CSV files
         """
         keylist = {}
 
@@ -557,66 +708,31 @@ class IOZone(Test):
                     key_name = "%d-%d-%s" % (fields[0], fields[1], lin)
                     keylist[key_name] = val
         else:
-            child_regexp = re.compile(r'Children see throughput for[s]+'
-                                      r'([d]+)s+([-w]+[-ws]*)=[s]+([d.]*) '
-                                      'KB/sec')
-            parent_regexp = re.compile(r'Parent sees throughput for[s]+'
-                                       r'([d]+)s+([-w]+[-ws]*)=[s]+([d.]*) '
-                                       'KB/sec')
-
-            kbsec_regexp = re.compile(r'=[s]+([d.]*) KB/sec')
-            kbval_regexp = re.compile(r'=[s]+([d.]*) KB')
-
-            section = None
-            w_count = 0
-
-            for line in self.results.splitlines():
-                line = line.strip()
-
-                # Check for the beginning of a new result section
-                match = child_regexp.search(line)
-                if match:
-                    # Extract the section name and the worker count
-                    w_count = int(match.group(1))
-                    section = self.__get_section_name(match.group(2))
-
-                    # Output the appropriate keyval pair
-                    key_name = '%s-%d-kids' % (section, w_count)
-                    keylist[key_name] = match.group(3)
-                    continue
-
-                # Check for any other interesting lines
-                if '=' in line:
-                    # Is it something we recognize? First check for parent.
-                    match = parent_regexp.search(line)
-                    if match:
-                        # The section name and the worker count better match
-                        p_count = int(match.group(1))
-                        p_secnt = self.__get_section_name(match.group(2))
-                        if p_secnt != section or p_count != w_count:
-                            continue
-
-                        # Set the base name for the keyval
-                        basekey = 'parent'
-                    else:
-                        # Check for the various 'throughput' values
-                        if line[3:26] == ' throughput per thread ':
-                            basekey = line[0:3]
-                            match_x = kbsec_regexp
-                        else:
-                            # The only other thing we expect is 'Min xfer'
-                            if not line.startswith('Min xfer '):
-                                continue
-                            basekey = 'MinXfer'
-                            match_x = kbval_regexp
-
-                        match = match_x.search(line)
-                        if match:
-                            result = match.group(1)
-                            key_name = "%s-%d-%s" % (section, w_count, basekey)
-                            keylist[key_name] = result
+            records = self.parse_throughput(self.results)
+            self.write_throughput(records)
+            for record in records:
+                prefix = '%s-%d' % (record['section'], record['workers'])
+                for field, suffix in _THROUGHPUT_KEYS:
+                    if field in record:
+                        keylist['%s-%s' % (prefix, suffix)] = record[field]
         self.whiteboard = json.dumps(keylist, indent=1)
 
+    @staticmethod
+    def get_baseline_files(baseline_dir):
+        """
+        Returns the raw_output files of the historical runs stored under
+        baseline_dir, oldest first, or all its files if none is named so.
+        """
+        all_files = []
+        raw_files = []
+        for root, _, files in os.walk(baseline_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                all_files.append(path)
+                if name.startswith('raw_output'):
+                    raw_files.append(path)
+        return sorted(raw_files or all_files, key=os.path.getmtime)
+
     def test(self):
         '''
         Test method for performing IOZone test and analysis.
@@ -624,6 +740,10 @@ class IOZone(Test):
         directory = self.params.get('dir', default=None)
         args = self.params.get('args', default=None)
         previous_results = self.params.get('previous_results', default=None)
+        baseline_dir = self.params.get('baseline_dir', default=None)
+        threshold = self.params.get('regression_threshold', default=5.0)
+        fail_on_regression = self.params.get('fail_on_regression',
+                                             default=False)
 
         if not directory:
             directory = self.base_dir
@@ -645,16 +765,22 @@ class IOZone(Test):
 
         self.generate_keyval()
         if self.auto_mode:
+            list_files = [results_path]
             if previous_results:
-                analysis = IOzoneAnalyzer(self.log,
-                                          list_files=[results_path,
-                                                      previous_results],
-                                          output_dir=analysisdir)
-                analysis.analyze()
-            else:
-                analysis = IOzoneAnalyzer(self.log, list_files=[results_path],
-                                          output_dir=analysisdir)
-                analysis.analyze()
+                list_files.append(previous_results)
+            if baseline_dir:
+                list_files.extend(self.get_baseline_files(baseline_dir))
+            analysis = IOzoneAnalyzer(self.log, list_files=list_files,
+                                      output_dir=analysisdir,
+                                      threshold=threshold)
+            comparison = analysis.analyze()
+            if comparison is None:
+                self.fail("No IOzone results in %s" % results_path)
+            regressions = [path for path, summary in comparison.items()
+                           if summary['regressions']]
+            if regressions and fail_on_regression:
+                self.fail("Throughput regressed by more than %s%% against %s"
+                          % (threshold, ', '.join(regressions)))
             plotter = IOzonePlotter(self.log, results_file=results_path,
                                     output_dir=analysisdir)
             plotter.plot_2d_graphs()
@@ -21,7 +21,13 @@ Needs to be run as root.
 """
 
 import os
+import json
+import mmap
+import array
+import bisect
+import random
 import shutil
+import threading
 import time
 from pprint import pprint
 from avocado import Test
@@ -29,8 +35,79 @@ from avocado.utils import distro, process
 from avocado.utils import multipath
 from avocado.utils import service
 from avocado.utils import wait
+from avocado.utils import genio
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from common_api.uevent import UeventMonitor
+
+
+class MpathIO(threading.Thread):
+    """
+    Direct IO on random blocks of a multipath device, with the time every
+    IO completed at, to find out how long IO stalled around a path event.
+    With write set, every block read is written back as it was. An error
+    that stops the IO, e.g. opening the device, is kept in exception.
+    """
+
+    def __init__(self, device, block_size=4096, write=False):
+        threading.Thread.__init__(self, daemon=True)
+        self.device = device
+        self.block_size = block_size
+        self.write = write
+        self.completions = array.array('d')
+        self.errors = 0
+        self.exception = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as exc:
+            self.exception = exc
+
+    def _run(self):
+        flags = os.O_RDWR if self.write else os.O_RDONLY
+        fd = os.open(self.device, flags | os.O_DIRECT)
+        # anonymous mappings are page aligned, as O_DIRECT needs
+        buf = mmap.mmap(-1, self.block_size)
+        try:
+            blocks = os.lseek(fd, 0, os.SEEK_END) // self.block_size
+            rand = random.Random(blocks)
+            while not self._stop_event.is_set():
+                offset = rand.randrange(blocks) * self.block_size
+                try:
+                    os.preadv(fd, [buf], offset)
+                    if self.write:
+                        os.pwritev(fd, [buf], offset)
+                except OSError:
+                    self.errors += 1
+                    time.sleep(0.01)
+                    continue
+                self.completions.append(time.monotonic())
+        finally:
+            buf.close()
+            os.close(fd)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def completed(self, start, end):
+        """
+        Returns the number of IO completed between start and end.
+        """
+        return bisect.bisect_left(self.completions, end) - \
+            bisect.bisect_right(self.completions, start)
+
+    def max_stall(self, start, end):
+        """
+        Returns the longest time no IO completed between start and end.
+        """
+        first = bisect.bisect_right(self.completions, start)
+        last = bisect.bisect_left(self.completions, end)
+        times = [start] + list(self.completions[first:last]) + [end]
+        return max(after - before for before, after in zip(times, times[1:]))
+
 
 class MultipathTest(Test):
     """
@@ -49,8 +126,14 @@ class MultipathTest(Test):
         # iteration.
         self.policies.remove(self.policy)
         self.policies.append(self.policy)
-        self.op_shot_sleep_time = 60
-        self.op_long_sleep_time = 180
+        self.op_shot_sleep_time = int(self.params.get('op_shot_sleep_time',
+                                                      default=60))
+        self.op_long_sleep_time = int(self.params.get('op_long_sleep_time',
+                                                      default=180))
+        self.failover_hold = int(self.params.get('failover_hold', default=5))
+        self.event_timeout = int(self.params.get('event_timeout',
+                                                 default=30))
+        self.io_write = self.params.get('io_write', default=False)
         # Install needed packages
         dist = distro.detect()
         pkg_name = ""
@@ -125,7 +208,8 @@ class MultipathTest(Test):
             for policy in self.policies:
                 cmd = "path_selector \"%s 0\"" % policy
                 multipath.form_conf_mpath_file(defaults_extra=cmd)
-                time.sleep(5)
+                wait.wait_for(lambda: multipath.get_policy(
+                    path_dic["wwid"]) == policy, timeout=10, step=0.5)
                 if multipath.get_policy(path_dic["wwid"]) != policy:
                     msg += "%s for %s fails\n" % (policy, path_dic["wwid"])
 
@@ -242,17 +326,40 @@ class MultipathTest(Test):
         '''
         err_paths = []
         self.log.info("Failing and reinstating the n-1 paths")
-        for dic_path in self.mpath_list:
-            for path in dic_path['paths'][:-1]:
-                if multipath.fail_path(path) is False:
-                    self.log.info("could not fail %s under n-1 path", path)
-                    err_paths.append(path)
-
-            time.sleep(self.op_long_sleep_time)
-            for path in dic_path['paths'][:-1]:
-                if multipath.reinstate_path(path) is False:
-                    self.log.info("couldn't reinstate in n-1 path: %s", path)
-                    err_paths.append(path)
+        with UeventMonitor(subsystems=('block',),
+                           background=True) as uevents:
+            for dic_path in self.mpath_list:
+                for path in dic_path['paths'][:-1]:
+                    if multipath.fail_path(path) is False:
+                        self.log.info("could not fail %s under n-1 path",
+                                      path)
+                        err_paths.append(path)
+                    elif not self.wait_dm_event(uevents, 'PATH_FAILED', path,
+                                                self.event_timeout):
+                        self.log.info("no PATH_FAILED event for %s", path)
+                        err_paths.append(path)
+
+                io_start = time.monotonic()
+                mpath_io = self.start_io(dic_path["name"])
+                time.sleep(self.failover_hold)
+                mpath_io.stop()
+                self.log.info("%s: %s IOs on a single path, %s errors, max "
+                              "stall %.3fs", dic_path["name"],
+                              len(mpath_io.completions), mpath_io.errors,
+                              mpath_io.max_stall(io_start, time.monotonic()))
+                if mpath_io.errors or not mpath_io.completions:
+                    self.log.info("IO failed on single path of %s",
+                                  dic_path["name"])
+                    err_paths.append(dic_path['paths'][-1])
+                for path in dic_path['paths'][:-1]:
+                    if multipath.reinstate_path(path) is False:
+                        self.log.info("couldn't reinstate in n-1 path: %s",
+                                      path)
+                        err_paths.append(path)
+                    elif not self.wait_dm_event(uevents, 'PATH_REINSTATED',
+                                                path, self.event_timeout):
+                        self.log.info("no PATH_REINSTATED event for %s", path)
+                        err_paths.append(path)
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -264,17 +371,28 @@ class MultipathTest(Test):
         '''
         err_paths = []
         self.log.info("Failing and reinstating the n-1 paths")
-        for dic_path in self.mpath_list:
-            for path in dic_path["paths"]:
-                if multipath.fail_path(path) is False:
-                    self.log.info("could not fail under all path %s", path)
-                    err_paths.append(path)
-
-            time.sleep(self.op_long_sleep_time)
-            for path in dic_path["paths"]:
-                if multipath.reinstate_path(path) is False:
-                    self.log.info("couldn't reinstate in all path %s", path)
-                    err_paths.append(path)
+        with UeventMonitor(subsystems=('block',),
+                           background=True) as uevents:
+            for dic_path in self.mpath_list:
+                for path in dic_path["paths"]:
+                    if multipath.fail_path(path) is False:
+                        self.log.info("could not fail under all path %s",
+                                      path)
+                        err_paths.append(path)
+                    elif not self.wait_dm_event(uevents, 'PATH_FAILED', path,
+                                                self.event_timeout):
+                        self.log.info("no PATH_FAILED event for %s", path)
+                        err_paths.append(path)
+
+                for path in dic_path["paths"]:
+                    if multipath.reinstate_path(path) is False:
+                        self.log.info("couldn't reinstate in all path %s",
+                                      path)
+                        err_paths.append(path)
+                    elif not self.wait_dm_event(uevents, 'PATH_REINSTATED',
+                                                path, self.event_timeout):
+                        self.log.info("no PATH_REINSTATED event for %s", path)
+                        err_paths.append(path)
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -302,6 +420,93 @@ class MultipathTest(Test):
         if err_paths:
             self.fail("failed paths in remove indvdl paths: %s" % err_paths)
 
+    def start_io(self, name):
+        """
+        Starts direct IO on the multipath device name in the background.
+        """
+        mpath_io = MpathIO(os.path.join('/dev/mapper', name),
+                           write=self.io_write)
+        mpath_io.start()
+        return mpath_io
+
+    def wait_dm_event(self, uevents, action, path, timeout):
+        """
+        Returns when the device mapper sent the action (PATH_FAILED,
+        PATH_REINSTATED) uevent for path, None if it did not in timeout
+        seconds.
+        """
+        devnum = genio.read_file("/sys/block/%s/dev" % path).strip()
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            for event in uevents.read(max(0, end - time.monotonic())):
+                if event.env.get('DM_ACTION') == action and \
+                        event.env.get('DM_PATH') == devnum:
+                    return event.timestamp
+        return None
+
+    def test_failover_latency(self):
+        '''
+        Fails and reinstates every path of each mpath, one at a time, with
+        direct IO running on the mpath, and reports how long the failover
+        and the reinstate took from the dm uevents, and how long IO
+        stalled meanwhile
+        '''
+        results = []
+        err_paths = []
+        # received in the background, the dm uevents arrive while the
+        # fail and reinstate commands run
+        with UeventMonitor(subsystems=('block',),
+                           background=True) as uevents:
+            for dic_path in self.mpath_list:
+                if len(dic_path["paths"]) < 2:
+                    self.log.info("%s has a single path, skipping",
+                                  dic_path["name"])
+                    continue
+                mpath_io = self.start_io(dic_path["name"])
+                for path in dic_path["paths"]:
+                    result = {'mpath': dic_path["name"], 'path': path}
+                    errors = mpath_io.errors
+                    fail_time = time.monotonic()
+                    if multipath.fail_path(path) is False:
+                        self.log.info("could not fail %s", path)
+                        err_paths.append(path)
+                        continue
+                    event = self.wait_dm_event(uevents, 'PATH_FAILED', path,
+                                               self.event_timeout)
+                    if event:
+                        result['fail_event'] = event - fail_time
+                    time.sleep(self.failover_hold)
+                    reinstate_time = time.monotonic()
+                    if multipath.reinstate_path(path) is False:
+                        self.log.info("couldn't reinstate %s", path)
+                        err_paths.append(path)
+                        continue
+                    event = self.wait_dm_event(uevents, 'PATH_REINSTATED',
+                                               path, self.event_timeout)
+                    if event:
+                        result['path_up'] = event - reinstate_time
+                    time.sleep(self.failover_hold)
+                    result['max_io_stall_failover'] = mpath_io.max_stall(
+                        fail_time, reinstate_time)
+                    result['max_io_stall_reinstate'] = mpath_io.max_stall(
+                        reinstate_time, time.monotonic())
+                    result['io_errors'] = mpath_io.errors - errors
+                    result['io_completed'] = mpath_io.completed(
+                        fail_time, time.monotonic())
+                    self.log.info("%s", result)
+                    if not mpath_io.is_alive():
+                        self.fail("IO on %s stopped: %s" % (
+                            dic_path["name"], mpath_io.exception))
+                    if result['io_errors'] or not result['io_completed']:
+                        err_paths.append(path)
+                    results.append(result)
+                mpath_io.stop()
+        with open(os.path.join(self.outputdir, 'multipath-latency.json'),
+                  'w') as latency_file:
+            json.dump(results, latency_file, indent=4)
+        if err_paths:
+            self.fail("failover with IO fails for paths : %s" % err_paths)
+
     def test_suspend_resume_individual_mpath(self):
         '''
         suspending the mpathX and Resume it Back
@@ -21,6 +21,10 @@ using nvme cli.
 """
 
 import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from avocado import Test
 from avocado.utils import disk
 from avocado.utils import process
@@ -29,6 +33,35 @@ from avocado.utils import download
 from avocado.utils import nvme
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from common_api.uevent import UeventMonitor
+
+# nvme-cli command lines of the namespace IO command tests
+IO_COMMANDS = {'read': '%(binary)s read %(ns)s -z %(size)d -t',
+               'write': 'echo 1|%(binary)s write %(ns)s -z %(size)d -t',
+               'compare': 'echo 1|%(binary)s compare %(ns)s -z %(size)d',
+               'flush': '%(binary)s flush %(ns)s',
+               'writezeroes': '%(binary)s write-zeroes %(ns)s',
+               'dsm': '%(binary)s dsm %(ns)s -a 1 -b 1 -s 1 -d -w -r'}
+# order of the IO command tests on a namespace, compare checks the write
+IO_TESTS = ('write', 'read', 'compare', 'flush', 'writezeroes', 'dsm')
+# Optional NVM Command Support (oncs) bit of the optional commands
+ONCS_BITS = {'compare': 0, 'dsm': 2, 'writezeroes': 3}
+# steps of the namespace operations, in seconds, in ns_provisioning.json
+NS_STEPS = ('create', 'attach', 'rescan', 'delete', 'command', 'device',
+            'total')
+
+
+def resolve_controller(nvme_node):
+    """
+    Returns the controller of an nvme node, which may be a controller
+    (nvmeX), a subsystem (nvme-subsysX) or an NQN.
+    """
+    if "subsys" in nvme_node:
+        return nvme.get_controllers_with_subsys(nvme_node)[0]
+    if nvme_node.startswith("nqn."):
+        return nvme.get_controllers_with_nqn(nvme_node)[0]
+    return nvme_node
+
 
 class NVMeTest(Test):
 
@@ -37,6 +70,8 @@ class NVMeTest(Test):
 
     :param device: Name of the nvme device
     :param namespace: Namespace of the device
+    :param devices: nvme devices (space separated) of test_parallel_io
+    :param workers: namespaces tested in parallel by test_parallel_io
     """
 
     def setUp(self):
@@ -46,10 +81,7 @@ class NVMeTest(Test):
         nvme_node = self.params.get('device', default=None)
         if not nvme_node:
             self.cancel("Please provide valid nvme node name")
-        elif "subsys" in nvme_node:
-            nvme_node = nvme.get_controllers_with_subsys(nvme_node)[0]
-        elif nvme_node.startswith("nqn."):
-            nvme_node = nvme.get_controllers_with_nqn(nvme_node)[0]
+        nvme_node = resolve_controller(nvme_node)
         self.device = disk.get_absolute_disk_path(nvme_node)
         cmd = 'ls %s' % self.device
         if process.system(cmd, ignore_status=True):
@@ -78,6 +110,14 @@ class NVMeTest(Test):
                 self.cancel('nvme-cli is needed for the test to be run')
             self.binary = 'nvme'
 
+        # identify data, shared by the tests of the job
+        self.id_cache_dir = os.path.join(self.teststmpdir, 'nvme-identify')
+        os.makedirs(self.id_cache_dir, exist_ok=True)
+        self.id_ns_cache = {}
+        # namespace operation timings, and the block uevents seen so far
+        self.ns_ops = []
+        self.uevents = None
+        self.block_events = []
         self.format_size = self.get_block_size()
         self.namespace = self.params.get('namespace', default='1')
         self.shared = self.params.get("shared_namespaces", default=False)
@@ -86,8 +126,7 @@ class NVMeTest(Test):
         if 'firmware_upgrade' in str(self.name) and not self.firmware_url:
             self.cancel("firmware url not given")
 
-        cmd = "%s id-ctrl %s -H" % (self.binary, self.device)
-        self.id_ctrl = process.system_output(cmd, shell=True).decode("utf-8")
+        self.id_ctrl = self.identify_ctrl(self.device, human=True)
 
         test_dic = {'compare': 'Compare', 'formatnamespace': 'Format NVM',
                     'dsm': 'Data Set Management',
@@ -121,20 +160,72 @@ class NVMeTest(Test):
         return process.system_output(cmd, ignore_status=True,
                                      shell=True).decode("utf-8").splitlines()
 
-    def get_id_ctrl_prop(self, prop):
+    def nvme_json(self, subcommand, device):
+        """
+        Runs the nvme-cli subcommand on device with JSON output, returns
+        the parsed output, None when the command or the parsing fails
+        (e.g. an nvme-cli without JSON output for it).
+        """
+        cmd = "%s %s %s -o json" % (self.binary, subcommand, device)
+        result = process.run(cmd, shell=True, ignore_status=True,
+                             verbose=False)
+        if result.exit_status:
+            return None
+        try:
+            return json.loads(result.stdout_text)
+        except ValueError:
+            return None
+
+    def identify_ctrl(self, device, human=False, refresh=False):
+        """
+        Returns the identify controller data of device, parsed from the
+        'nvme id-ctrl -o json' output, or the 'nvme id-ctrl -H' output
+        when human is True. It is read once and kept in the test temporary
+        directory for the following tests, unless refresh is True.
+        """
+        path = os.path.join(self.id_cache_dir, "%s.%s" % (
+            os.path.basename(device), 'txt' if human else 'json'))
+        if not refresh and os.path.exists(path):
+            with open(path) as cache:
+                return cache.read() if human else json.load(cache)
+        if human:
+            cmd = "%s id-ctrl %s -H" % (self.binary, device)
+            data = process.system_output(cmd, shell=True).decode("utf-8")
+        else:
+            data = self.nvme_json('id-ctrl', device) or {}
+        with open(path, 'w') as cache:
+            if human:
+                cache.write(data)
+            else:
+                json.dump(data, cache)
+        return data
+
+    def identify_ns(self, id_ns):
+        """
+        Returns the identify namespace data of id_ns, from the
+        'nvme id-ns -o json' output, read once per test.
+        """
+        if id_ns not in self.id_ns_cache:
+            self.id_ns_cache[id_ns] = self.nvme_json('id-ns', id_ns) or {}
+        return self.id_ns_cache[id_ns]
+
+    def get_id_ctrl_prop(self, prop, device=None):
         """
         :param prop: property whose value is requested
         Returns the property value from 'nvme id-ctrl' command
         """
-        for line in self.id_ctrl.splitlines():
-            if line.startswith(prop):
-                return line.split()[-1]
-        return ''
+        value = self.identify_ctrl(device or self.device).get(prop)
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
 
     def get_firmware_version(self):
         """
         Returns the firmware version.
         """
+        self.identify_ctrl(self.device, refresh=True)
         return self.get_id_ctrl_prop('fr')
 
     def get_firmware_log(self):
@@ -190,11 +281,15 @@ class NVMeTest(Test):
             return int(output.replace(',', ''))
         return 0
 
-    def ns_list(self):
+    def ns_list(self, device=None):
         """
         Returns the list of namespaces in the nvme controller
         """
-        cmd = "%s list-ns %s" % (self.binary, self.device)
+        device = device or self.device
+        output = self.nvme_json('list-ns', device)
+        if output is not None:
+            return [entry['nsid'] for entry in output.get('nsid_list', [])]
+        cmd = "%s list-ns %s" % (self.binary, device)
         namespaces = []
         for line in self.run_cmd_return_output_list(cmd):
             if line.startswith('['):
@@ -215,40 +310,33 @@ class NVMeTest(Test):
         """
         Returns the nvme controller id
         """
-        cmd = "%s id-ctrl %s" % (self.binary, self.device)
-        output = process.system_output(cmd, shell=True,
-                                       ignore_status=True).decode("utf-8")
-        for line in output.splitlines():
-            if 'cntlid' in line:
-                return line.split(':')[-1].strip()
-        return ""
+        return self.get_id_ctrl_prop('cntlid')
 
-    def get_lba(self):
+    def get_lba(self, device=None, namespace=None):
         """
         Returns LBA of the namespace.
         If not found, return defaults to 0.
         """
-        namespace = self.ns_list()
+        device = device or self.device
+        namespace = namespace or (self.ns_list(device) or [None])[0]
         if namespace:
-            namespace = namespace[0]
-            cmd = "%s id-ns %sn%s" % (self.binary, self.device, namespace)
-            for line in self.run_cmd_return_output_list(cmd):
-                if 'in use' in line:
-                    return int(line.split()[1])
+            id_ns = self.identify_ns("%sn%s" % (device, namespace))
+            if 'flbas' in id_ns:
+                return id_ns['flbas'] & 0xf
         return '0'
 
-    def get_block_size(self):
+    def get_block_size(self, device=None, namespace=None):
         """
         Returns the block size of the namespace.
         If not found, return defaults to 4k.
         """
-        namespace = self.ns_list()
+        device = device or self.device
+        namespace = namespace or (self.ns_list(device) or [None])[0]
         if namespace:
-            namespace = namespace[0]
-            cmd = "%s id-ns %sn%s" % (self.binary, self.device, namespace)
-            for line in self.run_cmd_return_output_list(cmd):
-                if 'in use' in line:
-                    return pow(2, int(line.split()[4].split(':')[-1]))
+            id_ns = self.identify_ns("%sn%s" % (device, namespace))
+            lbafs = id_ns.get('lbafs', [])
+            if 'flbas' in id_ns and (id_ns['flbas'] & 0xf) < len(lbafs):
+                return pow(2, lbafs[id_ns['flbas'] & 0xf]['ds'])
         return 4096
 
     def delete_all_ns(self):
@@ -263,8 +351,14 @@ class NVMeTest(Test):
         :param ns: namespace id to be deleted
         Deletes the specified namespace on the controller
         """
+        record = {'operation': 'delete', 'nsid': namespace}
+        start = time.monotonic()
         cmd = "%s delete-ns %s -n %s" % (self.binary, self.device, namespace)
-        process.system(cmd, shell=True, ignore_status=True)
+        self.timed_step(record, 'delete', cmd)
+        self.id_ns_cache.clear()
+        self.wait_block_devices(record, 'remove', start, nsid=namespace)
+        record['total'] = round(time.monotonic() - start, 6)
+        self.ns_ops.append(record)
 
     def create_full_capacity_ns(self):
         """
@@ -288,12 +382,163 @@ class NVMeTest(Test):
         """
         Creates one namespace, with the specified id, block size, controller
         """
+        record = {'operation': 'create', 'nsid': int(ns_id),
+                  'blocks': int(blocksize)}
+        start = time.monotonic()
         cmd = "%s create-ns %s --nsze=%s --ncap=%s --flbas=0 -dps=0" % (
             self.binary, self.device, int(blocksize), int(blocksize))
-        process.system(cmd, shell=True, ignore_status=True)
+        result = self.timed_step(record, 'create', cmd)
+        # the controller picks the namespace id
+        match = re.search(r'nsid:\s*(\d+)', result.stdout_text)
+        if match:
+            ns_id = match.group(1)
+            record['nsid'] = int(ns_id)
         cmd = "%s attach-ns %s --namespace-id=%s -controllers=%s" % (
             self.binary, self.device, ns_id, controller)
-        process.system(cmd, shell=True, ignore_status=True)
+        self.timed_step(record, 'attach', cmd)
+        cmd = "%s ns-rescan %s" % (self.binary, self.device)
+        self.timed_step(record, 'rescan', cmd)
+        self.id_ns_cache.clear()
+        self.wait_block_devices(record, 'add', start, nsid=ns_id)
+        record['total'] = round(time.monotonic() - start, 6)
+        self.ns_ops.append(record)
+
+    def timed_step(self, record, step, cmd):
+        """
+        Runs the command of a namespace operation step, adds its duration
+        to the operation record, returns its result
+        """
+        start = time.monotonic()
+        result = process.run(cmd, shell=True, ignore_status=True)
+        record[step] = round(time.monotonic() - start, 6)
+        if result.exit_status:
+            record.setdefault('errors', []).append(
+                "%s: %s" % (step, result.stderr_text.strip()))
+        return result
+
+    def timed_op(self, record, func, action=None, count=0):
+        """
+        Calls func, a whole namespace operation, e.g. of avocado.utils.nvme,
+        adds its duration to record and waits for its count block
+        devices to be added or removed (action)
+        """
+        start = time.monotonic()
+        func()
+        record['command'] = round(time.monotonic() - start, 6)
+        if action and count:
+            self.wait_block_devices(record, action, start, count)
+        record['total'] = round(time.monotonic() - start, 6)
+        self.ns_ops.append(record)
+
+    def wait_block_devices(self, record, action, since, count=1, nsid=None,
+                           timeout=30):
+        """
+        Waits for the uevents of count namespace block devices (of
+        namespace nsid, when given) added or removed (action) since the
+        operation start, adds their names and the time of the last one to
+        record. Nothing is done when the uevents are not monitored.
+        """
+        if self.uevents is None:
+            return
+        name = re.compile(r'^nvme\d+n%s$' % (nsid or r'\d+'))
+        deadline = time.monotonic() + timeout
+        while True:
+            events = [event for event in self.block_events
+                      if event.timestamp >= since and
+                      event.action == action and
+                      name.match(event.env.get('DEVNAME', ''))]
+            remaining = deadline - time.monotonic()
+            if len(events) >= count or remaining <= 0:
+                break
+            self.block_events.extend(self.uevents.read(remaining))
+        record['devices'] = [event.env['DEVNAME'] for event in events]
+        record['device'] = None
+        if len(events) >= count:
+            record['device'] = round(events[count - 1].timestamp - since, 6)
+        else:
+            self.log.warning("%s of the %s block devices %s after %ss",
+                             len(events), count, "added" if action == 'add'
+                             else "removed", timeout)
+
+    def start_ns_benchmark(self):
+        """
+        Starts timing the namespace operations
+        """
+        # received in the background, the block uevents arrive while the
+        # namespace commands run
+        self.uevents = UeventMonitor(subsystems=['block'], background=True)
+        self.ns_start = time.monotonic()
+
+    def stop_ns_benchmark(self):
+        """
+        Logs the namespace operation timings and writes them to
+        ns_provisioning.json in the test output directory
+        """
+        total = time.monotonic() - self.ns_start
+        self.uevents.close()
+        self.uevents = None
+        summary = {}
+        for operation in sorted(set(op['operation'] for op in self.ns_ops)):
+            records = [op for op in self.ns_ops
+                       if op['operation'] == operation]
+            summary[operation] = {'count': len(records)}
+            for step in NS_STEPS:
+                values = [op[step] for op in records
+                          if op.get(step) is not None]
+                if not values:
+                    continue
+                summary[operation][step] = {
+                    'sum': round(sum(values), 6),
+                    'mean': round(sum(values) / len(values), 6),
+                    'max': max(values)}
+                self.log.info("%s %s: %s, mean %.3fs, max %.3fs",
+                              operation, step, len(values),
+                              sum(values) / len(values), max(values))
+        self.log.info("Namespace reconfiguration took %.3fs", total)
+        with open(os.path.join(self.outputdir, 'ns_provisioning.json'),
+                  'w') as output:
+            json.dump({'device': self.device, 'total': round(total, 6),
+                       'summary': summary, 'operations': self.ns_ops},
+                      output, indent=2)
+
+    def io_command(self, test, id_ns=None, size=None):
+        """
+        Returns the nvme-cli command line of the IO command test on the
+        namespace id_ns, the test namespace by default
+        """
+        return IO_COMMANDS[test] % {'binary': self.binary,
+                                    'ns': id_ns or self.id_ns,
+                                    'size': size or self.format_size}
+
+    def supported_io_tests(self, device):
+        """
+        Returns the IO command tests the controller supports, in order
+        """
+        oncs = int(self.get_id_ctrl_prop('oncs', device) or '0', 0)
+        return [test for test in IO_TESTS
+                if test not in ONCS_BITS or oncs & (1 << ONCS_BITS[test])]
+
+    def run_ns_io_tests(self, device, namespace, tests):
+        """
+        Runs the IO command tests one after the other on a namespace of
+        the controller, returns their results
+        """
+        id_ns = "%sn%s" % (device, namespace)
+        size = self.get_block_size(device, namespace)
+        results = []
+        for test in tests:
+            start = time.time()
+            result = process.run(self.io_command(test, id_ns, size),
+                                 timeout=300, ignore_status=True, shell=True,
+                                 verbose=False)
+            output = ''
+            if result.exit_status:
+                output = (result.stderr_text or result.stdout_text).strip()
+            results.append({'device': device, 'namespace': namespace,
+                            'test': test, 'passed': not result.exit_status,
+                            'seconds': round(time.time() - start, 3),
+                            'output': output[-512:]})
+        return results
 
     def test_firmware_upgrade(self):
         """
@@ -344,6 +589,7 @@ class NVMeTest(Test):
 
         # Getting the current FW details after updating
         self.get_firmware_log()
+        self.identify_ctrl(self.device, human=True, refresh=True)
         if fw_version != self.get_firmware_version():
             self.log.warn("New Firmware not reflecting after updating")
 
@@ -351,18 +597,29 @@ class NVMeTest(Test):
         """
         Test to create maximum number of namespaces
         """
-        self.delete_all_ns()
-        self.create_max_ns()
-        self.list_ns()
+        self.start_ns_benchmark()
+        try:
+            self.delete_all_ns()
+            self.create_max_ns()
+            self.list_ns()
+        finally:
+            self.stop_ns_benchmark()
 
     def test_create_full_capacity_ns(self):
         """
         Test to create namespace with full capacity
         """
         device = self.device.split("/")[-1]
-        nvme.delete_all_ns(device)
-        nvme.create_full_capacity_ns(device,
-                                     shared_ns=self.shared)
+        self.start_ns_benchmark()
+        try:
+            self.timed_op({'operation': 'delete_all'},
+                          lambda: nvme.delete_all_ns(device), 'remove',
+                          len(self.ns_list()))
+            self.timed_op({'operation': 'create_full_capacity'},
+                          lambda: nvme.create_full_capacity_ns(
+                              device, shared_ns=self.shared), 'add', 1)
+        finally:
+            self.stop_ns_benchmark()
 
     def testformatnamespace(self):
         """
@@ -375,8 +632,7 @@ class NVMeTest(Test):
         """
         Reads from the namespace on the device.
         """
-        cmd = '%s read %s -z %d -t' % (self.binary, self.id_ns,
-                                       self.format_size)
+        cmd = self.io_command('read')
         if process.system(cmd, timeout=300, ignore_status=True, shell=True):
             self.fail("Read failed")
 
@@ -384,8 +640,7 @@ class NVMeTest(Test):
         """
         Write to the namespace on the device.
         """
-        cmd = 'echo 1|%s write %s -z %d -t' % (self.binary, self.id_ns,
-                                               self.format_size)
+        cmd = self.io_command('write')
         if process.system(cmd, timeout=300, ignore_status=True, shell=True):
             self.fail("Write failed")
 
@@ -394,8 +649,7 @@ class NVMeTest(Test):
         Compares data written on the device with given data.
         """
         self.testwrite()
-        cmd = 'echo 1|%s compare %s -z %d' % (self.binary, self.id_ns,
-                                              self.format_size)
+        cmd = self.io_command('compare')
         if process.system(cmd, timeout=300, ignore_status=True, shell=True):
             self.fail("Compare failed")
 
@@ -403,7 +657,7 @@ class NVMeTest(Test):
         """
         flush data on controller.
         """
-        cmd = '%s flush %s' % (self.binary, self.id_ns)
+        cmd = self.io_command('flush')
         if process.system(cmd, ignore_status=True, shell=True):
             self.fail("Flush failed")
 
@@ -411,7 +665,7 @@ class NVMeTest(Test):
         """
         Write zeroes command to the device.
         """
-        cmd = '%s write-zeroes %s' % (self.binary, self.id_ns)
+        cmd = self.io_command('writezeroes')
         if process.system(cmd, ignore_status=True, shell=True):
             self.fail("Writing Zeroes failed")
 
@@ -427,8 +681,7 @@ class NVMeTest(Test):
         """
         The Dataset Management command test.
         """
-        cmd = '%s dsm %s -a 1 -b 1 -s 1 -d -w -r' % (self.binary,
-                                                     self.id_ns)
+        cmd = self.io_command('dsm')
         if process.system(cmd, ignore_status=True, shell=True):
             self.fail("Subsystem reset failed")
 
@@ -461,13 +714,73 @@ class NVMeTest(Test):
         """
         ns_count = self.params.get('namespace_count', default=1)
         device = self.device.split("/")[-1]
-        nvme.create_namespaces(device,
-                               ns_count,
-                               shared_ns=self.shared)
+        self.start_ns_benchmark()
+        try:
+            self.timed_op({'operation': 'create_namespaces',
+                           'count': ns_count},
+                          lambda: nvme.create_namespaces(
+                              device, ns_count, shared_ns=self.shared),
+                          'add', int(ns_count))
+        finally:
+            self.stop_ns_benchmark()
 
     def test_delete_all_ns(self):
         """
         delete all namespaces of specified controller
         """
         device = self.device.split("/")[-1]
-        nvme.delete_all_ns(device)
+        self.start_ns_benchmark()
+        try:
+            self.timed_op({'operation': 'delete_all'},
+                          lambda: nvme.delete_all_ns(device), 'remove',
+                          len(self.ns_list()))
+        finally:
+            self.stop_ns_benchmark()
+
+    def test_parallel_io(self):
+        """
+        Runs the IO command tests on all the namespaces of the nvme
+        devices at once, with a pool of workers, the tests of a namespace
+        one after the other.
+        """
+        devices = [disk.get_absolute_disk_path(resolve_controller(node))
+                   for node in self.params.get('devices',
+                                               default='').split()]
+        devices = devices or [self.device]
+        jobs = []
+        for device in devices:
+            tests = self.supported_io_tests(device)
+            for namespace in self.ns_list(device):
+                jobs.append((device, namespace, tests))
+        if not jobs:
+            self.cancel("No namespaces on %s" % " ".join(devices))
+        workers = int(self.params.get('workers', default=0)) or len(jobs)
+        self.log.info("Testing %s namespaces of %s controllers with %s "
+                      "workers", len(jobs), len(devices), workers)
+        results = []
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='nvme') as pool:
+            for future in [pool.submit(self.run_ns_io_tests, *job)
+                           for job in jobs]:
+                results.extend(future.result())
+        elapsed = time.time() - start
+        failed = [result for result in results if not result['passed']]
+        for result in results:
+            self.log.info("%sn%s %s: %s in %.3fs", result['device'],
+                          result['namespace'], result['test'],
+                          'PASS' if result['passed'] else 'FAIL',
+                          result['seconds'])
+        with open(os.path.join(self.outputdir, 'parallel_io.json'),
+                  'w') as output:
+            json.dump({'devices': devices, 'workers': workers,
+                       'seconds': round(elapsed, 3), 'results': results},
+                      output, indent=2)
+        self.log.info("%s IO command tests on %s namespaces in %.3fs",
+                      len(results), len(jobs), elapsed)
+        if failed:
+            self.fail("%s of %s IO command tests failed: %s" % (
+                len(failed), len(results),
+                ", ".join("%sn%s %s" % (result['device'],
+                                        result['namespace'], result['test'])
+                          for result in failed)))
@@ -24,6 +24,7 @@ simultaneously increasing the bandwidth and providing redundancy.
 
 import time
 import os
+import json
 import socket
 import fcntl
 import struct
@@ -34,10 +35,15 @@ from avocado.utils import distro
 from avocado.utils import process
 from avocado.utils import linux_modules
 from avocado.utils import genio
+from avocado.utils import wait
 from avocado.utils.ssh import Session
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 
+from net_api.netns import NetnsPeer, HOST_IPS, PEER_IPS
+from net_api.linkmon import LinkMonitor, is_running
+from net_api.failover import PingProbe
+
 
 class Bonding(Test):
     '''
@@ -68,17 +74,37 @@ class Bonding(Test):
         if 'setup' in str(self.name) or 'run' in str(self.name):
             if not self.mode:
                 self.cancel("test skipped because mode not specified")
-        interfaces = netifaces.interfaces()
         self.peer_public_ip = self.params.get("peer_public_ip", default="")
         self.user = self.params.get("user_name", default="root")
         self.password = self.params.get("peer_password", '*',
                                         default="None")
-        self.host_interfaces = self.params.get("bond_interfaces",
-                                               default="").split(" ")
+        self.peer_bond_needed = self.params.get("peer_bond_needed",
+                                                default=False)
+        self.netns = None
+        if self.params.get("peer_mode", default="ssh") == "netns":
+            # the bonded host interfaces and the peer interfaces (bonded
+            # too when peer_bond_needed) are linked through a bridge in
+            # the peer network namespace, standing in for the switch
+            links = int(self.params.get("netns_links", default=2))
+            self.netns = NetnsPeer(links=links,
+                                   peer_links=links if self.peer_bond_needed
+                                   else 1, switch=True)
+            self.netns.setup(
+                [self.params.get("host_ips", default="").split(" ")[0] or
+                 HOST_IPS[0]],
+                [self.params.get("peer_ips", default="").split(" ")[0] or
+                 PEER_IPS[0]],
+                self.params.get("netmask", default="") or '255.255.255.0')
+            self.host_interfaces = self.netns.host_interfaces
+            self.peer_interfaces = self.netns.peer_interfaces
+        else:
+            self.host_interfaces = self.params.get("bond_interfaces",
+                                                   default="").split(" ")
+            self.peer_interfaces = self.params.get("peer_interfaces",
+                                                   default="").split(" ")
         if not self.host_interfaces:
             self.cancel("user should specify host interfaces")
-        self.peer_interfaces = self.params.get("peer_interfaces",
-                                               default="").split(" ")
+        interfaces = netifaces.interfaces()
         for self.host_interface in self.host_interfaces:
             if self.host_interface not in interfaces:
                 self.cancel("interface is not available")
@@ -88,10 +114,14 @@ class Bonding(Test):
             self.cancel("peer machine should available")
         self.ipaddr = self.params.get("host_ips", default="").split(" ")
         self.netmask = self.params.get("netmask", default="")
-        self.peer_bond_needed = self.params.get("peer_bond_needed",
-                                                default=False)
+        if self.netns:
+            self.peer_first_ipinterface[0] = \
+                self.peer_first_ipinterface[0] or PEER_IPS[0]
+            self.ipaddr[0] = self.ipaddr[0] or HOST_IPS[0]
+            self.netmask = self.netmask or '255.255.255.0'
         self.localhost = LocalHost()
-        if 'setup' in str(self.name.name):
+        # the netns peer comes with its addresses
+        if 'setup' in str(self.name.name) and not self.netns:
             for ipaddr, interface in zip(self.ipaddr, self.host_interfaces):
                 networkinterface = NetworkInterface(interface, self.localhost)
                 try:
@@ -134,6 +164,9 @@ class Bonding(Test):
         self.peer_wait_time = self.params.get("peer_wait_time", default=20)
         self.sleep_time = int(self.params.get("sleep_time", default=10))
         self.peer_wait_time = self.params.get("peer_wait_time", default=5)
+        self.probe_interval = self.params.get("probe_interval", default=0.01)
+        self.failover_timeout = int(self.params.get("failover_timeout",
+                                                    default=30))
         self.mtu = self.params.get("mtu", default=1500)
         self.ib = False
         if self.host_interface[0:2] == 'ib':
@@ -152,7 +185,9 @@ class Bonding(Test):
         being bonded. So the test uses the public ip address to create an SSH
         session instead of the private one when setting up a bonding interface.
         '''
-        if self.mode == "4" and "setup" in str(self.name.name):
+        if self.netns:
+            self.session = self.netns.session
+        elif self.mode == "4" and "setup" in str(self.name.name):
             self.session = Session(self.peer_public_ip, user=self.user,
                                    password=self.password)
         else:
@@ -180,7 +215,9 @@ class Bonding(Test):
                 self.cancel("failed connecting to peer")
         self.setup_ip()
         self.err = []
-        if self.mode == "4" and "setup" in str(self.name.name):
+        if self.netns:
+            self.remotehost = self.netns.host
+        elif self.mode == "4" and "setup" in str(self.name.name):
             self.remotehost = RemoteHost(self.peer_public_ip, self.user,
                                          password=self.password)
         else:
@@ -313,51 +350,37 @@ class Bonding(Test):
         '''
         bond fail
         '''
-        if len(self.host_interfaces) > 1:
-            for interface in self.host_interfaces:
-                self.log.info("Failing interface %s for mode %s",
-                              interface, arg1)
-                cmd = "ip link set %s down" % interface
-                if process.system(cmd, shell=True, ignore_status=True) != 0:
-                    self.fail("bonding not working when trying to down the\
-                               interface %s " % interface)
-                time.sleep(self.sleep_time)
-                if self.ping_check():
-                    self.log.info("Ping passed for Mode %s", arg1)
-                else:
-                    error_str = "Ping fail in Mode %s when interface %s down"\
-                        % (arg1, interface)
-                    self.log.debug(error_str)
-                    self.err.append(error_str)
-                self.log.info(genio.read_file(self.bond_status))
-                cmd = "ip link set %s up" % interface
-                time.sleep(self.sleep_time)
-                if process.system(cmd, shell=True, ignore_status=True) != 0:
-                    self.fail("Not able to bring up the slave\
-                                    interface %s" % interface)
-                time.sleep(self.sleep_time)
-        else:
-            self.log.debug("Need a min of 2 host interfaces to test\
-                         slave failover in Bonding")
+        links = LinkMonitor()
+        probe = PingProbe(self.peer_first_ipinterface[0], self.bond_name,
+                          self.probe_interval)
+        probe.start()
+        steps = []
+        try:
+            if len(self.host_interfaces) > 1:
+                for interface in self.host_interfaces:
+                    self.log.info("Failing interface %s for mode %s",
+                                  interface, arg1)
+                    steps.append(self.failover_step(links, probe,
+                                                    [interface], "down"))
+                    self.log.info(genio.read_file(self.bond_status))
+                    steps.append(self.failover_step(links, probe,
+                                                    [interface], "up"))
+            else:
+                self.log.debug("Need a min of 2 host interfaces to test\
+                             slave failover in Bonding")
 
-        self.log.info("\n----------------------------------------")
-        self.log.info("Failing all interfaces for mode %s", arg1)
-        self.log.info("----------------------------------------")
-        for interface in self.host_interfaces:
-            cmd = "ip link set %s down" % interface
-            if process.system(cmd, shell=True, ignore_status=True) != 0:
-                self.fail("Could not bring down the interface %s " % interface)
-            time.sleep(self.sleep_time)
-        if not self.ping_check():
-            self.log.info("Ping to Bond interface failed. This is expected")
-        self.log.info(genio.read_file(self.bond_status))
-        for interface in self.host_interfaces:
-            cmd = "ip link set %s up" % interface
-            time.sleep(self.sleep_time)
-            if process.system(cmd, shell=True, ignore_status=True) != 0:
-                self.fail("Not able to bring up the slave\
-                                interface %s" % interface)
-            time.sleep(self.sleep_time)
+            self.log.info("\n----------------------------------------")
+            self.log.info("Failing all interfaces for mode %s", arg1)
+            self.log.info("----------------------------------------")
+            steps.append(self.failover_step(links, probe,
+                                            self.host_interfaces, "down"))
+            self.log.info(genio.read_file(self.bond_status))
+            steps.append(self.failover_step(links, probe,
+                                            self.host_interfaces, "up"))
+        finally:
+            probe.stop()
+            links.close()
+        self.failover_report(probe, steps)
         bond_mtu = ['2000', '3000', '4000', '5000', '6000', '7000',
                     '8000', '9000']
         if self.is_vnic():
@@ -386,6 +409,103 @@ class Bonding(Test):
                 if peer_networkinterface.set_mtu('1500') is not None:
                     self.cancel("Failed to set mtu back to 1500 in peer")
 
+    def active_slave(self):
+        '''
+        currently active slave of the bond, None in the modes without one
+        '''
+        for line in genio.read_file(self.bond_status).splitlines():
+            if line.startswith("Currently Active Slave:"):
+                return line.split(":", 1)[1].strip()
+        return None
+
+    def slave_up(self, interface):
+        '''
+        True when the bond sees the link of the slave interface up
+        '''
+        status = genio.read_file(self.bond_status)
+        for block in status.split("\n\n"):
+            lines = block.splitlines()
+            if "Slave Interface: %s" % interface in lines:
+                return "MII Status: up" in lines
+        return False
+
+    def failover_step(self, links, probe, interfaces, action):
+        '''
+        Brings the slave interfaces down or up while the probe pings the
+        peer through the bond, and waits for the link changes, for the
+        bond to see them and for the traffic to flow again, when some
+        slave is left. Returns the times it took, in ms.
+        '''
+        def elapsed(timestamp):
+            if timestamp is None:
+                return None
+            return round((timestamp - start) * 1000, 3)
+
+        running = action == "up"
+        seq = probe.last_seq()
+        step = {'slaves': interfaces, 'action': action,
+                'active_slave_before': self.active_slave()}
+        start = time.time()
+        for interface in interfaces:
+            cmd = "ip link set %s %s" % (interface, action)
+            if process.system(cmd, shell=True, ignore_status=True) != 0:
+                self.fail("Not able to bring %s the slave interface %s"
+                          % (action, interface))
+        step['start'] = start
+        step['link_ms'] = {}
+        for interface in interfaces:
+            event = links.wait(lambda event: event.ifname == interface and
+                               event.running == running,
+                               self.failover_timeout, since=start)
+            step['link_ms'][interface] = elapsed(event and event.timestamp)
+        if wait.wait_for(lambda: all(self.slave_up(interface) == running
+                                     for interface in interfaces),
+                         self.failover_timeout, step=0.01):
+            step['bond_ms'] = elapsed(time.time())
+        else:
+            step['bond_ms'] = None
+        step['traffic_ms'] = None
+        if running or len(interfaces) < len(self.host_interfaces):
+            step['traffic_ms'] = elapsed(probe.wait_traffic(
+                seq, self.failover_timeout))
+        failovers = [event.timestamp for event in links.since(start)
+                     if event.ifname == self.bond_name and
+                     event.event == "bonding_failover"]
+        step['failover_ms'] = elapsed(min(failovers) if failovers else None)
+        step['active_slave'] = self.active_slave()
+        return step
+
+    def failover_report(self, probe, steps):
+        '''
+        Adds the traffic seen by the probe during each step, logs the
+        steps and writes them to failover.json in the test output
+        directory.
+        '''
+        ends = [step['start'] for step in steps[1:]] + [time.time()]
+        for step, end in zip(steps, ends):
+            step.update(probe.window(step['start'], end))
+            self.log.info("Mode %s, %s %s: link %s ms, bond %s ms, traffic "
+                          "gap %s ms, %s probes lost, active slave %s -> %s",
+                          self.mode, " ".join(step['slaves']),
+                          step['action'], step['link_ms'], step['bond_ms'],
+                          step['gap_ms'], step['lost'],
+                          step['active_slave_before'], step['active_slave'])
+            if step['action'] == "down" and \
+                    len(step['slaves']) < len(self.host_interfaces) and \
+                    step['traffic_ms'] is None:
+                error_str = "Ping fail in Mode %s when interface %s down"\
+                    % (self.mode, " ".join(step['slaves']))
+                self.log.debug(error_str)
+                self.err.append(error_str)
+            elif step['action'] == "up" and step['traffic_ms'] is None:
+                self.err.append("Ping fail in Mode %s after interface %s up"
+                                % (self.mode, " ".join(step['slaves'])))
+        with open(os.path.join(self.outputdir, "failover.json"),
+                  "w") as output:
+            json.dump({'mode': self.mode, 'bond': self.bond_name,
+                       'probe_interval': float(self.probe_interval),
+                       'steps': steps}, output, indent=2)
+
     def bond_setup(self, arg1, arg2):
         '''
         bond setup
@@ -437,23 +557,23 @@ class Bonding(Test):
                 if 'Bonding Mode' in line:
                     bond_name_val = line.split(':')[1]
             self.log.info("Trying bond mode %s [ %s ]", arg2, bond_name_val)
-            for ifs in self.host_interfaces:
-                cmd = "ip link set %s up" % ifs
-                if process.system(cmd, shell=True, ignore_status=True) != 0:
-                    self.fail("unable to interface up")
-            cmd = "ip addr add %s/%s dev %s;ip link set %s up"\
-                  % (self.local_ip, self.net_mask[0],
-                     self.bond_name, self.bond_name)
-            process.system(cmd, shell=True, ignore_status=True)
-            for _ in range(0, 600, 60):
-                if 'state UP' in process.system_output("ip link \
-                     show %s" % self.bond_name, shell=True).decode("utf-8"):
+            with LinkMonitor() as links:
+                for ifs in self.host_interfaces:
+                    cmd = "ip link set %s up" % ifs
+                    if process.system(cmd, shell=True,
+                                      ignore_status=True) != 0:
+                        self.fail("unable to interface up")
+                cmd = "ip addr add %s/%s dev %s;ip link set %s up"\
+                      % (self.local_ip, self.net_mask[0],
+                         self.bond_name, self.bond_name)
+                process.system(cmd, shell=True, ignore_status=True)
+                if is_running(self.bond_name) or \
+                        links.wait(lambda event: event.ifname ==
+                                   self.bond_name and event.running, 600):
                     self.log.info("Bonding setup is successful on\
                                   local machine")
-                    break
-                time.sleep(60)
-            else:
-                self.fail("Bonding setup on local machine has failed")
+                else:
+                    self.fail("Bonding setup on local machine has failed")
             if self.gateway:
                 cmd = 'ip route add default via %s dev %s' % \
                     (self.gateway, self.bond_name)
@@ -531,6 +651,11 @@ class Bonding(Test):
             cmd = 'ip route add default via %s' % \
                 (self.gateway)
             process.system(cmd, shell=True, ignore_status=True)
+        if self.netns:
+            # the veth pairs and the peer bond go away with the namespace
+            self.netns.cleanup()
+            self.error_check()
+            return
         for ipaddr, host_interface in zip(self.ipaddr, self.host_interfaces):
             networkinterface = NetworkInterface(host_interface, self.localhost)
             try:
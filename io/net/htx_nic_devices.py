@@ -32,6 +32,8 @@ from avocado.utils.ssh import Session
 from avocado.utils.download import url_download
 from avocado.utils.software_manager.backends.rpm import RpmBackend
 
+from common_api.htx import HtxMonitor
+
 
 class HtxNicTest(Test):
 
@@ -276,6 +278,8 @@ class HtxNicTest(Test):
         self.time_limit = int(self.params.get("time_limit",
                                               '*', default=2)) * 60
         self.query_cmd = "htxcmdline -query -mdt %s" % self.mdt_file
+        self.monitor_interval = int(self.params.get("monitor_interval", '*',
+                                                    default=60))
         self.htx_url = self.params.get("htx_rpm", default="")
 
     def test_start(self):
@@ -345,33 +349,21 @@ class HtxNicTest(Test):
         self.session.cmd(cmd)
 
     def monitor_htx_run(self):
-        for time_loop in range(0, self.time_limit, 60):
-            self.log.info("Monitoring HTX Error logs in Host")
-            cmd = 'htxcmdline -geterrlog'
-            process.run(cmd, ignore_status=True,
-                        shell=True, sudo=True)
-            if os.stat('/tmp/htxerr').st_size != 0:
-                self.fail("Their are errors while htx run in host")
-            self.log.info("Monitoring HTX Error logs in Peer")
-            self.session.cmd(cmd)
-            output = self.session.cmd('test -s /tmp/htxerr')
-            if not output.exit_status == 0:
-                rc = False
-            else:
-                rc = True
-            if rc:
-                output = self.session.cmd("cat /tmp/htxerr")
-                self.log.debug("HTX error log in peer: %s\n",
-                               "\n".join(output.stdout.decode("utf-8")))
-                self.fail("Their are errors while htx run in peer")
-            self.log.info("Status of N/W devices after every 60 sec")
-            process.system(self.query_cmd, ignore_status=True,
-                           shell=True, sudo=True)
-
-            output = self.session.cmd(self.query_cmd)
-            if not output.exit_status == 0:
-                self.log.info("query o/p in peer lpar\n %s", "\n".join(output))
-            time.sleep(60)
+        """
+        Fails on the first HTX error in host or peer, and samples the N/W
+        devices state every monitor_interval seconds in both into
+        htx-timeseries.csv
+        """
+        monitor = HtxMonitor(self.log, self.outputdir, self.query_cmd,
+                             interval=self.monitor_interval)
+        monitor.add_host('host', lambda cmd: process.run(
+            cmd, ignore_status=True, shell=True, sudo=True))
+        monitor.add_host('peer', self.session.cmd)
+        errors = monitor.run(self.time_limit)
+        if errors:
+            self.log.debug("HTX error log in %s", errors)
+            self.fail("Their are errors while htx run in %s" %
+                      errors.split(':')[0])
 
     def shutdown_active_mdt(self):
         self.log.info("Shutdown active mdt in host")
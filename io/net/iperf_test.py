@@ -22,8 +22,6 @@ bandwidth on IP networks.
 import os
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
-from avocado.utils import build
-from avocado.utils import archive
 from avocado.utils import process
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
@@ -32,6 +30,11 @@ from avocado.utils.ssh import Session
 from avocado.utils.process import SubProcess
 from avocado.utils import distro
 
+from common_api.build_cache import BuildCache, CACHE_DIR
+from net_api.netns import NetnsPeer, HOST_IPS, PEER_IPS
+from net_api.throughput import (ThroughputResult, StackCounters,
+                                link_labels, measure, parse_iperf_csv)
+
 
 class Iperf(Test):
     """
@@ -48,8 +51,20 @@ class Iperf(Test):
         self.peer_public_ip = self.params.get("peer_public_ip", default="")
         self.peer_password = self.params.get("peer_password", '*',
                                              default=None)
+        self.ipaddr = self.params.get("host_ip", default="")
+        self.netmask = self.params.get("netmask", default="")
+        self.netns = None
+        if self.params.get("peer_mode", default="ssh") == "netns":
+            # the peer is a network namespace linked by a veth pair
+            self.netns = NetnsPeer()
+            self.ipaddr = self.ipaddr or HOST_IPS[0]
+            self.peer_ip = self.peer_ip or PEER_IPS[0]
+            self.netmask = self.netmask or '255.255.255.0'
+            self.netns.setup([self.ipaddr], [self.peer_ip], self.netmask)
+            device = self.netns.host_interfaces[0]
+        else:
+            device = self.params.get("interface", default="")
         interfaces = os.listdir('/sys/class/net')
-        device = self.params.get("interface", default="")
         if device in interfaces:
             self.iface = device
         elif localhost.validate_mac_addr(device) and device in localhost.get_all_hwaddr():
@@ -57,28 +72,39 @@ class Iperf(Test):
         else:
             self.iface = None
             self.cancel("%s interface is not available" % device)
-        self.ipaddr = self.params.get("host_ip", default="")
-        self.netmask = self.params.get("netmask", default="")
         self.hbond = self.params.get("hbond", default=False)
         if self.hbond:
             self.networkinterface = NetworkInterface(self.iface, localhost,
                                                      if_type='Bond')
         else:
             self.networkinterface = NetworkInterface(self.iface, localhost)
-        try:
-            self.networkinterface.add_ipaddr(self.ipaddr, self.netmask)
-            self.networkinterface.save(self.ipaddr, self.netmask)
-        except Exception:
-            self.networkinterface.save(self.ipaddr, self.netmask)
-        self.networkinterface.bring_up()
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
+        if self.netns:
+            self.session = self.netns.session
+        else:
+            try:
+                self.networkinterface.add_ipaddr(self.ipaddr, self.netmask)
+                self.networkinterface.save(self.ipaddr, self.netmask)
+            except Exception:
+                self.networkinterface.save(self.ipaddr, self.netmask)
+            self.networkinterface.bring_up()
+            self.session = Session(self.peer_ip, user=self.peer_user,
+                                   password=self.peer_password)
         if not self.session.connect():
             self.cancel("failed connecting to peer")
+        cache_dir = self.params.get("build_cache_dir", default=CACHE_DIR)
+        rebuild = self.params.get("rebuild", default=False)
+        self.build_cache = BuildCache(self.log, cache_dir=cache_dir,
+                                      rebuild=rebuild)
+        self.peer_build_cache = BuildCache(self.log, self.session,
+                                           cache_dir=cache_dir,
+                                           rebuild=rebuild)
         smm = SoftwareManager()
         for pkg in ["gcc", "autoconf", "perl", "m4", "libtool", "gcc-c++", "flex", "bison"]:
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("%s package is need to test" % pkg)
+            if self.netns:
+                # the namespace shares the host file systems
+                continue
             cmd = "%s install %s" % (smm.backend.base_command, pkg)
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
@@ -91,17 +117,15 @@ class Iperf(Test):
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("%s package Can not install" % pkg)
         if detected_distro.name == "SuSE":
-            self.nmap = os.path.join(self.teststmpdir, 'nmap')
             nmap_download = self.params.get("nmap_download", default="https:"
                                             "//nmap.org/dist/"
                                             "nmap-7.93.tar.bz2")
             tarball = self.fetch_asset(nmap_download)
-            self.version = os.path.basename(tarball.split('.tar')[0])
-            self.n_map = os.path.join(self.nmap, self.version)
-            archive.extract(tarball, self.nmap)
+            self.n_map = self.build_cache.build(
+                'nmap', tarball, './configure ppc64le && make -j$(nproc)')
+            if not self.n_map:
+                self.cancel("Unable to compile nmap")
             os.chdir(self.n_map)
-            process.system('./configure ppc64le', shell=True)
-            build.make(self.n_map)
             process.system('./nping/nping -h', shell=True)
 
         if detected_distro.name == "Ubuntu":
@@ -126,47 +150,44 @@ class Iperf(Test):
         if self.peer_ip == "":
             self.cancel("%s peer machine is not available" % self.peer_ip)
         self.mtu = self.params.get("mtu", default=1500)
-        self.remotehost = RemoteHost(self.peer_ip, self.peer_user,
-                                     password=self.peer_password)
-        self.peer_interface = self.remotehost.get_interface_by_ipaddr(
-            self.peer_ip).name
+        if self.netns:
+            self.remotehost = self.netns.host
+            self.remotehost_public = self.netns.host
+            self.peer_interface = self.netns.peer_interfaces[0]
+        else:
+            self.remotehost = RemoteHost(self.peer_ip, self.peer_user,
+                                         password=self.peer_password)
+            self.peer_interface = self.remotehost.get_interface_by_ipaddr(
+                self.peer_ip).name
+            self.remotehost_public = RemoteHost(
+                self.peer_public_ip, self.peer_user,
+                password=self.peer_password)
         self.peer_networkinterface = NetworkInterface(self.peer_interface,
                                                       self.remotehost)
-        self.remotehost_public = RemoteHost(
-            self.peer_public_ip, self.peer_user,
-            password=self.peer_password)
         self.peer_public_networkinterface = NetworkInterface(
             self.peer_interface, self.remotehost_public)
         if self.peer_networkinterface.set_mtu(self.mtu) is not None:
             self.cancel("Failed to set mtu in peer")
         if self.networkinterface.set_mtu(self.mtu) is not None:
             self.cancel("Failed to set mtu in host")
-        self.iperf = os.path.join(self.teststmpdir, 'iperf')
         iperf_download = self.params.get("iperf_download", default="https:"
                                          "//sourceforge.net/projects/iperf2/"
                                          "files/iperf-2.1.9.tar.gz")
         tarball = self.fetch_asset(iperf_download, expire='7d')
-        archive.extract(tarball, self.iperf)
-        self.version = os.path.basename(tarball.split('.tar')[0])
-        self.iperf_dir = os.path.join(self.iperf, self.version)
-        destination = "%s:/tmp" % self.peer_ip
-        output = self.session.copy_files(self.iperf_dir, destination,
-                                         recursive=True)
-        if not output:
-            self.cancel("unable to copy the iperf into peer machine")
-        cmd = "cd /tmp/%s;./configure ppc64le;make" % self.version
-        output = self.session.cmd(cmd)
-        if not output.exit_status == 0:
+        self.peer_iperf_dir = self.peer_build_cache.build(
+            'iperf', tarball, './configure ppc64le && make -j$(nproc)')
+        if not self.peer_iperf_dir:
             self.cancel("Unable to compile Iperf into peer machine")
         self.iperf_run = str(self.params.get("PERF_SERVER_RUN", default=False))
         if self.iperf_run:
-            cmd = "/tmp/%s/src/iperf -s" % self.version
+            cmd = "%s/src/iperf -s" % self.peer_iperf_dir
             cmd = self.session.get_raw_ssh_command(cmd)
             self.obj = SubProcess(cmd)
             self.obj.start()
-        os.chdir(self.iperf_dir)
-        process.system('./configure', shell=True)
-        build.make(self.iperf_dir)
+        self.iperf_dir = self.build_cache.build(
+            'iperf', tarball, './configure && make -j$(nproc)')
+        if not self.iperf_dir:
+            self.cancel("Unable to compile Iperf")
         self.iperf = os.path.join(self.iperf_dir, 'src')
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="85")
 
@@ -196,37 +217,31 @@ class Iperf(Test):
             iperf_pthread = 4
         os.chdir(self.iperf)
         if self.networkinterface.is_vnic() or self.hbond:
-            cmd = "iperf -c %s -P %s -t 20 -i 5" % (self.peer_ip, iperf_pthread)
+            cmd = "iperf -c %s -P %s -t 20 -i 5 -y C" % (
+                self.peer_ip, iperf_pthread)
         else:
-            cmd = "./iperf -c %s" % self.peer_ip
-        result = process.run(cmd, shell=True, ignore_status=True)
+            cmd = "./iperf -c %s -y C" % self.peer_ip
+        throughput = ThroughputResult('iperf', peer=self.peer_ip,
+                                      hbond=self.hbond,
+                                      **link_labels(self.iface))
+        counters = {'host': StackCounters(lambda cmd: process.run(
+            cmd, ignore_status=True, shell=True)),
+            'peer': StackCounters(self.session.cmd)}
+        result = measure(throughput, counters, lambda: process.run(
+            cmd, shell=True, ignore_status=True))
         nping_result = self.nping()
         if result.exit_status:
             self.fail("FAIL: Iperf Run failed")
-        if self.networkinterface.is_vnic() or self.hbond:
-            for line in result.stdout.decode("utf-8").splitlines():
-                if 'SUM' in line and 'Mbits/sec' in line:
-                    tput = int(line.split()[5])
-                elif 'SUM' in line and 'Gbits/sec' in line:
-                    tput = int(float(line.split()[5])) * 1000
-                elif 'SUM' in line and 'Kbits/sec' in line:
-                    tput = int(float(line.split()[5])) / 1000
-        else:
-            for line in result.stdout.decode("utf-8").splitlines():
-                if 'local {}'.format(self.ipaddr) in line:
-                    id = line[3]
-            for line in result.stdout.decode("utf-8").splitlines():
-                if id in line and 'Mbits/sec' in line:
-                    tput = int(line.split()[6])
-                elif id in line and 'Gbits/sec' in line:
-                    tput = int(float(line.split()[6])) * 1000
-                elif id in line and 'Kbits/sec' in line:
-                    tput = int(float(line.split()[6])) / 1000
+        parse_iperf_csv(result.stdout_text, throughput)
+        throughput.write(self.outputdir)
+        tput = throughput.aggregate()
+        if tput is None:
+            self.fail("FAIL: no throughput in the iperf output")
         if tput < (int(self.expected_tp) * speed) / 100:
             self.fail("FAIL: Throughput Actual - %s%%, Expected - %s%%"
                       ", Throughput Actual value - %s "
-                      % (round((tput*100)/speed, 4), self.expected_tp,
-                         str(tput)+'Mb/sec'))
+                      % (round(throughput.percent_of(speed), 4),
+                         self.expected_tp, '%.2fMb/sec' % tput))
         for line in nping_result.stdout.decode("utf-8").splitlines():
             if 'Raw packets' in line:
                 lost = int(line.split("|")[2].split(" ")[2])*10
@@ -238,7 +253,7 @@ class Iperf(Test):
         Killing Iperf process in peer machine
         """
         if self.iface:
-            cmd = "pkill iperf; rm -rf /tmp/%s" % self.version
+            cmd = "pkill iperf || true"
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("Either the ssh to peer machine machine\
@@ -250,15 +265,18 @@ class Iperf(Test):
                 self.peer_networkinterface.set_mtu('1500')
             except Exception:
                 self.peer_public_networkinterface.set_mtu('1500')
-            self.networkinterface.remove_ipaddr(self.ipaddr, self.netmask)
-            try:
-                self.networkinterface.restore_from_backup()
-            except Exception:
-                self.networkinterface.remove_cfg_file()
-                self.log.info("backup file not available, could not restore file.")
+            if not self.netns:
+                self.networkinterface.remove_ipaddr(self.ipaddr, self.netmask)
+                try:
+                    self.networkinterface.restore_from_backup()
+                except Exception:
+                    self.networkinterface.remove_cfg_file()
+                    self.log.info("backup file not available, could not restore file.")
             if self.hbond:
                 self.networkinterface.restore_slave_cfg_file()
             self.remotehost.remote_session.quit()
             if hasattr(self, 'remotehost_public'):
                 self.remotehost_public.remote_session.quit()
             self.session.quit()
+        if self.netns:
+            self.netns.cleanup()
@@ -21,7 +21,7 @@ Irq-balance and CPU affinity test for IO subsystem.
 import re
 import os
 from avocado import Test
-from avocado.utils import process, cpu, wait, dmesg, genio
+from avocado.utils import process, cpu, wait, genio
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost
 from avocado.utils.process import CmdError
@@ -29,6 +29,8 @@ import multiprocessing
 import subprocess
 import time
 
+from common_api.kmsg import KmsgWatcher
+
 totalcpus = int(multiprocessing.cpu_count()) - 1
 errorlog = ['WARNING: CPU:', 'Oops',
             'Segfault', 'soft lockup', 'ard LOCKUP',
@@ -56,6 +58,7 @@ class irq_balance(Test):
         '''
         Set up
         '''
+        self.kmsg = KmsgWatcher(errorlog)
         self.interface = None
         device = self.params.get("interface", default=None)
         self.disk = self.params.get("disk", default=None)
@@ -317,7 +320,7 @@ class irq_balance(Test):
             wait.wait_for(self.get_module_interrupts, timeout=5)
             if len(self.cpu_range) > 1:
                 self.cpu_range_validation()
-        dmesg.collect_errors_dmesg(errorlog)
+        self.check_kmsg()
 
         '''
         un-assgining CPU's in reverse order upto minimum available CPU's
@@ -333,7 +336,7 @@ class irq_balance(Test):
                 self.cpu_range_validation()
             wait.wait_for(self.get_module_interrupts, timeout=5)
             self.cpu_range = self.cpu_range[:-1]
-        dmesg.collect_errors_dmesg(errorlog)
+        self.check_kmsg()
 
     def test_cpu_serial_off_on(self):
         '''
@@ -363,7 +366,7 @@ class irq_balance(Test):
             if cpus not in cpu.online_list():
                 self.fail(f" The onlined cpu {cpus} is still showing as"
                           f" offline, Please check the logs")
-        dmesg.collect_errors_dmesg(errorlog)
+        self.check_kmsg()
 
     def test_smt_toggle(self):
         '''
@@ -435,13 +438,21 @@ class irq_balance(Test):
                     time.sleep(2)
                 else:
                     self.fail(f'dd command failed, Please check logs')
-        dmesg.collect_errors_dmesg(errorlog)
+        self.check_kmsg()
+
+    def check_kmsg(self):
+        '''
+        Logs the kernel errors reported since the previous check
+        '''
+        for record in self.kmsg.check():
+            self.log.error("dmesg: %s", record)
 
     def tearDown(self):
         """
         Sets back SMT to original value as was before the test.
         Sets back cpu states to online
         """
+        self.kmsg.close()
         if hasattr(self, 'curr_smt'):
             process.system_output(f"ppc64_cpu "
                                   f"--smt={self.check_current_smt()}",
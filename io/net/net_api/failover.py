@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Failover traffic probe.
+
+A failover used to be checked by sleeping, then running a few pings.
+PingProbe pings a peer continuously at a high rate (every 10 ms by
+default) for the whole run, with the time of every reply, so the gap in
+the traffic and the probes lost around a link failure or recovery are
+measured, e.g. for a bond slave going down or up.
+
+Usage::
+
+    probe = PingProbe('192.168.1.2', interface='bond0')
+    probe.start()
+    start, seq = time.time(), probe.last_seq()
+    ... bring a link down ...
+    probe.wait_traffic(seq, timeout=30)
+    end = time.time()
+    probe.stop()
+    log.info(probe.window(start, end))
+"""
+
+import re
+
+from avocado.utils import process, wait
+
+__all__ = ['PingProbe']
+
+_REPLY = re.compile(r'^\[(?P<ts>[\d.]+)\] \d+ bytes from .*icmp_seq=(?P<seq>\d+)')
+_NO_ANSWER = re.compile(r'^\[(?P<ts>[\d.]+)\] no answer yet for '
+                        r'icmp_seq=(?P<seq>\d+)')
+# icmp_seq is 16 bits, it wraps after 65536 probes
+SEQ_WRAP = 65536
+
+
+class PingProbe():
+    """Pings peer every interval seconds until stopped.
+
+    :param peer: address to ping
+    :param interface: interface to ping through, None for the route one
+    :param interval: seconds between probes, below 0.2 needs root
+    """
+
+    def __init__(self, peer, interface=None, interval=0.01):
+        self.interval = float(interval)
+        cmd = 'ping -D -O -n -i %s %s%s' % (
+            interval, '-I %s ' % interface if interface else '', peer)
+        self.proc = process.SubProcess(cmd)
+        # probe sequence number: time of the (first) reply, and time the
+        # probe was reported unanswered
+        self.replies = {}
+        self.unanswered = {}
+        self._parsed = 0
+        self._wraps = 0
+        self._last = 0
+
+    def start(self):
+        self.proc.start()
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.parse()
+
+    def _seq(self, value):
+        seq = int(value) + self._wraps * SEQ_WRAP
+        if seq < self._last - SEQ_WRAP // 2:
+            self._wraps += 1
+            seq += SEQ_WRAP
+        self._last = max(self._last, seq)
+        return seq
+
+    def parse(self):
+        """Reads the ping output printed since the previous parse."""
+        output = self.proc.get_stdout()
+        end = output.rfind(b'\n') + 1
+        if end <= self._parsed:
+            return
+        lines = output[self._parsed:end].decode('utf-8', 'replace')
+        self._parsed = end
+        for line in lines.splitlines():
+            match = _REPLY.match(line)
+            if match:
+                # duplicates, e.g. of a broadcast bond, keep the first
+                self.replies.setdefault(self._seq(match.group('seq')),
+                                        float(match.group('ts')))
+                continue
+            match = _NO_ANSWER.match(line)
+            if match:
+                self.unanswered[self._seq(match.group('seq'))] = \
+                    float(match.group('ts'))
+
+    def last_seq(self):
+        """Returns the sequence number of the latest probe reported."""
+        self.parse()
+        return self._last
+
+    def wait_traffic(self, seq, timeout):
+        """
+        Waits up to timeout seconds for a reply to a probe sent after
+        probe seq, returns its time or None.
+        """
+        def replied():
+            self.parse()
+            times = [ts for probe, ts in self.replies.items() if probe > seq]
+            return min(times) if times else None
+        return wait.wait_for(replied, timeout, step=self.interval * 5)
+
+    def window(self, start, end):
+        """
+        Returns the traffic between start and end (times): the longest
+        time without replies (from the last reply before start, in ms),
+        the time the traffic resumed after it, the replies and the
+        probes lost, i.e. the ones sent in the window never replied.
+        """
+        self.parse()
+        before = [(ts, seq) for seq, ts in self.replies.items() if ts < start]
+        previous, first_seq = max(before) if before else (start, None)
+        times = sorted(ts for ts in self.replies.values()
+                       if start <= ts < end)
+        window = {'replies': len(times), 'gap_ms': None, 'resumed_ms': None,
+                  'lost': 0}
+        gap, resumed = 0, None
+        for prev, current in zip([previous] + times, times):
+            if current - prev > gap:
+                gap, resumed = current - prev, current
+        if not times:
+            gap = end - previous
+        window['gap_ms'] = round(gap * 1000, 3)
+        if resumed is not None:
+            window['resumed_ms'] = round(max(resumed - start, 0) * 1000, 3)
+        seqs = [seq for seq, ts in self.replies.items() if start <= ts < end]
+        seqs += [seq for seq, ts in self.unanswered.items()
+                 if start <= ts < end]
+        if seqs:
+            if first_seq is None:
+                first_seq = min(seqs) - 1
+            window['lost'] = len([seq for seq in range(first_seq + 1,
+                                                       max(seqs) + 1)
+                                  if seq not in self.replies])
+        return window
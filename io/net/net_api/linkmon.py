@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+rtnetlink link monitor.
+
+Tests used to sleep a fixed time after bringing a link down or up and
+only check the outcome afterwards. LinkMonitor subscribes to the
+rtnetlink link group and returns the link changes as the kernel sends
+them, stamped with the (wall clock) time they were received, so a test
+waits for the change it expects and knows how long it took.
+
+Usage::
+
+    with LinkMonitor() as links:
+        process.run('ip link set eth1 down')
+        event = links.wait(lambda event: event.ifname == 'eth1' and
+                           not event.running, timeout=10)
+"""
+
+import collections
+import os
+import select
+import socket
+import struct
+import time
+
+__all__ = ['LinkEvent', 'LinkMonitor', 'parse_link_messages', 'is_running']
+
+RTMGRP_LINK = 1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+RTATTR = struct.Struct('=HH')
+IFLA_IFNAME = 3
+IFLA_MASTER = 10
+IFLA_OPERSTATE = 16
+IFLA_EVENT = 44
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+# RFC 2863 operational states, as in /sys/class/net/<iface>/operstate
+OPERSTATES = ('unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing',
+              'dormant', 'up')
+# IFLA_EVENT values, e.g. bonding_failover when a bond changes its
+# active slave
+LINK_EVENTS = ('none', 'reboot', 'features', 'bonding_failover',
+               'notify_peers', 'igmp_resend', 'bonding_options')
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+class LinkEvent(collections.namedtuple('LinkEvent',
+                                       'timestamp action index ifname flags '
+                                       'operstate master event')):
+    """A rtnetlink link message, action is 'new' or 'del'."""
+
+    @property
+    def running(self):
+        """True when the link is up and has a carrier."""
+        return self.action == 'new' and \
+            bool(self.flags & IFF_UP) and bool(self.flags & IFF_LOWER_UP)
+
+    def __str__(self):
+        return '%s %s %s%s' % (self.action, self.ifname, self.operstate,
+                               ' %s' % self.event if self.event else '')
+
+
+def parse_link_messages(data, timestamp=None):
+    """
+    Parses the RTM_NEWLINK and RTM_DELLINK messages of a rtnetlink
+    datagram (ifinfomsg followed by attributes), skips the others.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    events = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type = NLMSGHDR.unpack_from(data, offset)[:2]
+        if length < NLMSGHDR.size:
+            break
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            body = offset + NLMSGHDR.size
+            _, index, flags, _ = IFINFOMSG.unpack_from(data, body)[1:]
+            attrs = {}
+            pos = body + IFINFOMSG.size
+            while pos + RTATTR.size <= offset + length:
+                attr_len, attr_type = RTATTR.unpack_from(data, pos)
+                if attr_len < RTATTR.size:
+                    break
+                attrs[attr_type & 0x3fff] = data[pos + RTATTR.size:
+                                                 pos + attr_len]
+                pos += _align(attr_len)
+            ifname = attrs.get(IFLA_IFNAME, b'').rstrip(b'\0').decode()
+            operstate = None
+            if IFLA_OPERSTATE in attrs:
+                state = attrs[IFLA_OPERSTATE][0]
+                operstate = OPERSTATES[state] if state < len(OPERSTATES) \
+                    else str(state)
+            master = None
+            if IFLA_MASTER in attrs:
+                master = struct.unpack('=I', attrs[IFLA_MASTER][:4])[0]
+            event = None
+            if IFLA_EVENT in attrs:
+                value = struct.unpack('=I', attrs[IFLA_EVENT][:4])[0]
+                event = LINK_EVENTS[value] if value < len(LINK_EVENTS) \
+                    else str(value)
+            events.append(LinkEvent(timestamp,
+                                    'new' if msg_type == RTM_NEWLINK
+                                    else 'del', index, ifname, flags,
+                                    operstate, master, event))
+        offset += _align(length)
+    return events
+
+
+def is_running(ifname):
+    """True when the operational state of ifname is up."""
+    try:
+        with open(os.path.join('/sys/class/net', ifname, 'operstate')) as attr:
+            return attr.read().strip() == 'up'
+    except OSError:
+        return False
+
+
+class LinkMonitor():
+    """Receives the rtnetlink link messages.
+
+    All the events received are kept in events, in order.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  socket.NETLINK_ROUTE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((0, RTMGRP_LINK))
+        self.sock.setblocking(False)
+        self.events = []
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self, timeout=0):
+        """
+        Returns the events received since the previous read, waiting up
+        to timeout seconds for the first one when there are none.
+        """
+        events = []
+        if timeout and not select.select([self.sock], [], [], timeout)[0]:
+            return events
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            events.extend(parse_link_messages(data))
+        self.events.extend(events)
+        return events
+
+    def wait(self, predicate, timeout, since=0):
+        """
+        Returns the first event predicate is true for, among the events
+        received from since on, waiting up to timeout seconds for it.
+        Returns None on timeout. Events are not consumed, so the waits
+        for several links find their events whatever order they came in.
+        """
+        deadline = time.time() + timeout
+        checked = 0
+        while True:
+            while checked < len(self.events):
+                event = self.events[checked]
+                checked += 1
+                if event.timestamp >= since and predicate(event):
+                    return event
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self.read(timeout=remaining)
+
+    def since(self, timestamp):
+        """Returns the events received from timestamp on."""
+        self.read()
+        return [event for event in self.events
+                if event.timestamp >= timestamp]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
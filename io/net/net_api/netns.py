@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Network namespace loopback peer.
+
+The network tests drive a physical peer over ssh. NetnsPeer builds the
+peer in a network namespace of the host instead, linked to it by veth
+pairs, optionally through a VLAN filtering bridge standing in for the
+switch. Its session runs the peer commands in the namespace with the
+same methods as the ssh Session, and its host can be given to
+NetworkInterface in place of a RemoteHost, so the test bodies run
+unchanged on a single machine.
+
+Usage::
+
+    peer = NetnsPeer(links=2)
+    peer.setup(host_ips=['192.168.77.1'], peer_ips=['192.168.77.2'])
+    session = peer.session
+    peer_iface = NetworkInterface(peer.peer_interfaces[0], peer.host)
+    ...
+    peer.cleanup()
+"""
+
+import ipaddress
+import shlex
+
+from avocado.utils import process
+from avocado.utils.network.hosts import Host
+
+__all__ = ['NetnsPeer', 'NetnsSession', 'NetnsHost', 'prefix_length',
+           'HOST_IPS', 'PEER_IPS']
+
+BRIDGE = 'avswitch0'
+# addresses of the host and peer interfaces, when the test has none
+HOST_IPS = ['192.168.77.1', '192.168.77.3', '192.168.77.5', '192.168.77.7']
+PEER_IPS = ['192.168.77.2', '192.168.77.4', '192.168.77.6', '192.168.77.8']
+
+
+def prefix_length(netmask):
+    """Returns the prefix length of a netmask, which may be one already."""
+    return ipaddress.IPv4Network('0.0.0.0/%s' % netmask).prefixlen
+
+
+class NetnsSession():
+    """Runs commands in a network namespace, like an ssh Session.
+
+    The namespace shares the host file systems, copy_files copies
+    locally and the 'host:' part of the paths is ignored.
+    """
+
+    def __init__(self, netns):
+        self.netns = netns
+        self.host = netns
+
+    def connect(self):
+        return True
+
+    def cleanup_master(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def get_raw_ssh_command(self, command):
+        """Returns the command line running command in the namespace."""
+        return 'ip netns exec %s sh -c %s' % (self.netns,
+                                              shlex.quote(command))
+
+    def cmd(self, command, ignore_status=True, timeout=None):
+        if timeout:
+            command = 'timeout %s %s' % (timeout, command)
+        return process.run(self.get_raw_ssh_command(command),
+                           ignore_status=ignore_status)
+
+    def copy_files(self, source, destination, recursive=False):
+        cmd = 'cp %s %s %s' % ('-r' if recursive else '',
+                               source.split(':')[-1],
+                               destination.split(':')[-1])
+        return not process.run(cmd, ignore_status=True,
+                               shell=True).exit_status
+
+
+class NetnsHost(Host):
+    """Network namespace host for NetworkInterface, as a RemoteHost."""
+
+    def __init__(self, netns):
+        super().__init__(netns)
+        self.remote_session = NetnsSession(netns)
+
+
+class NetnsPeer():
+    """Peer in a network namespace linked to the host with veth pairs.
+
+    :param name: network namespace name
+    :param links: number of host interfaces
+    :param peer_links: number of peer interfaces, links by default; with
+                       a switch they may differ, e.g. a bond of two host
+                       interfaces with a single peer interface
+    :param host_prefix: name prefix of the host interfaces
+    :param peer_prefix: name prefix of the peer interfaces
+    :param switch: links the interfaces through a VLAN filtering bridge
+                   in the namespace, its ports are in host_ports and
+                   peer_ports, otherwise host and peer interfaces are the
+                   two ends of a veth pair
+    """
+
+    def __init__(self, name='avocado-peer', links=1, peer_links=None,
+                 host_prefix='vhost', peer_prefix='vpeer', switch=False):
+        self.name = name
+        self.switch = switch
+        if peer_links is None or not switch:
+            peer_links = links
+        self.host_interfaces = ['%s%d' % (host_prefix, index)
+                                for index in range(links)]
+        self.peer_interfaces = ['%s%d' % (peer_prefix, index)
+                                for index in range(peer_links)]
+        self.host_ports = ['sw%s' % name for name in self.host_interfaces]
+        self.peer_ports = ['sw%s' % name for name in self.peer_interfaces]
+        self.session = NetnsSession(name)
+        self.host = NetnsHost(name)
+
+    def run(self, cmd):
+        """Runs cmd on the host, raises CmdError when it fails."""
+        return process.run(cmd, shell=True)
+
+    def exists(self):
+        output = process.run('ip netns list', ignore_status=True).stdout_text
+        return self.name in [line.split()[0] for line in output.splitlines()
+                             if line.strip()]
+
+    def setup(self, host_ips=(), peer_ips=(), netmask='255.255.255.0'):
+        """
+        Creates the namespace and the links, and assigns the addresses to
+        the host and peer interfaces, in order. Does nothing when the
+        namespace exists already, e.g. set up by a previous test.
+        """
+        if self.exists():
+            return
+        prefix = prefix_length(netmask)
+        self.run('ip netns add %s' % self.name)
+        self.session.cmd('ip link set lo up')
+        if self.switch:
+            self.session.cmd('ip link add %s type bridge vlan_filtering 1'
+                             % BRIDGE, ignore_status=False)
+            self.session.cmd('ip link set %s up' % BRIDGE)
+            for name in self.peer_interfaces:
+                self.session.cmd('ip link add %s type veth peer name sw%s'
+                                 % (name, name), ignore_status=False)
+                self.add_port('sw%s' % name)
+        for index, name in enumerate(self.host_interfaces):
+            if self.switch:
+                other = 'sw%s' % name
+            else:
+                other = self.peer_interfaces[index]
+            # moved afterwards, not every iproute2 creates the peer end
+            # in another namespace
+            self.run('ip link add %s type veth peer name %s'
+                     % (name, other))
+            self.run('ip link set %s netns %s' % (other, self.name))
+            if self.switch:
+                self.add_port(other)
+            self.run('ip link set %s up' % name)
+        for name in self.peer_interfaces:
+            self.session.cmd('ip link set %s up' % name)
+        for ipaddr, name in zip(host_ips, self.host_interfaces):
+            self.run('ip addr add %s/%s dev %s' % (ipaddr, prefix, name))
+        for ipaddr, name in zip(peer_ips, self.peer_interfaces):
+            self.session.cmd('ip addr add %s/%s dev %s'
+                             % (ipaddr, prefix, name), ignore_status=False)
+
+    def add_port(self, port):
+        """Adds port to the bridge, as a trunk with native VLAN 1."""
+        self.session.cmd('ip link set %s master %s' % (port, BRIDGE),
+                         ignore_status=False)
+        self.session.cmd('ip link set %s up' % port)
+        self.set_port_vlan(port, 1)
+
+    def set_port_vlan(self, port, vlan, tag_native=False):
+        """
+        Makes a switch port a trunk of all the VLANs with native VLAN
+        vlan, whose frames are sent tagged when tag_native is True, like
+        'switchport trunk native vlan' and 'vlan dot1q tag native'.
+        """
+        self.session.cmd('bridge vlan del dev %s vid 1-4094' % port)
+        self.session.cmd('bridge vlan add dev %s vid 1-4094' % port,
+                         ignore_status=False)
+        self.session.cmd('bridge vlan add dev %s vid %s pvid %s'
+                         % (port, vlan, '' if tag_native else 'untagged'),
+                         ignore_status=False)
+
+    def cleanup(self):
+        """Removes the namespace, the veth pairs go away with it."""
+        if self.exists():
+            process.run('ip netns del %s' % self.name, ignore_status=True)
+        for name in self.host_interfaces:
+            process.run('ip link del %s' % name, ignore_status=True)
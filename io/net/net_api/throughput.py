@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Network throughput results.
+
+The throughput tests used to scrape one number out of the human readable
+output of iperf, uperf and netperf, truncating it to an integer, and
+only compare it with a percentage of the link speed. ThroughputResult
+holds the per stream and aggregate throughput (in Mb/s) parsed from the
+machine readable output of those tools, with the TCP retransmits and the
+CPU utilization of both hosts during the run and the latency when the
+tool reports it, along with the setup (interface, driver, MTU, ...), and
+is written as JSON to the test output directory so runs on different
+adapters, MTUs or bond modes can be compared.
+
+Usage::
+
+    result = ThroughputResult('iperf', **link_labels('eth1'))
+    counters = {'host': StackCounters(run_local),
+                'peer': StackCounters(session.cmd)}
+    run = measure(result, counters,
+                  lambda: process.run('iperf -c peer -y C'))
+    parse_iperf_csv(run.stdout_text, result)
+    result.write(outputdir)
+"""
+
+import collections
+import json
+import os
+import re
+
+__all__ = ['ThroughputResult', 'StackCounters', 'link_labels', 'measure',
+           'parse_iperf_csv', 'parse_uperf_raw', 'parse_uperf_summary',
+           'parse_netperf_keyval', 'NETPERF_SELECTORS']
+
+# netperf omni output selectors requested with -k
+NETPERF_SELECTORS = ('THROUGHPUT', 'THROUGHPUT_UNITS', 'ELAPSED_TIME',
+                     'PROTOCOL', 'DIRECTION', 'LOCAL_TRANSPORT_RETRANS',
+                     'MEAN_LATENCY', 'P99_LATENCY')
+# throughput units of netperf, in Mb/s
+NETPERF_UNITS = {'10^3bits/s': 0.001, '10^6bits/s': 1.0, '10^9bits/s': 1000.0}
+COUNTERS_CMD = 'head -n 1 /proc/stat; grep ^Tcp: /proc/net/snmp'
+# throughput units of the uperf summary, in Mb/s
+UPERF_UNITS = {'K': 0.001, 'M': 1.0, 'G': 1000.0}
+_UPERF_RATE = re.compile(r'(?P<value>[\d.]+)\s*(?P<unit>[KMG])b/s')
+_UPERF_RAW = re.compile(r'timestamp_ms:(?P<ms>[\d.]+)\s+name:(?P<name>\S+)\s+'
+                        r'nr_bytes:(?P<bytes>\d+)\s+nr_ops:(?P<ops>\d+)')
+
+
+def link_labels(interface):
+    """
+    Returns the interface name, driver, speed (Mb/s) and MTU from sysfs,
+    the labels comparing runs on different adapters needs.
+    """
+    base = os.path.join('/sys/class/net', interface)
+    labels = collections.OrderedDict(interface=interface)
+    try:
+        labels['driver'] = os.path.basename(os.readlink(
+            os.path.join(base, 'device', 'driver')))
+    except OSError:
+        # virtual devices, e.g. bonds
+        labels['driver'] = None
+    for name in ('speed', 'mtu'):
+        try:
+            with open(os.path.join(base, name)) as attr:
+                labels[name] = int(attr.read())
+        except (OSError, ValueError):
+            labels[name] = None
+    return labels
+
+
+class ThroughputResult():
+    """Results of a network throughput run.
+
+    :param tool: benchmark name
+    :param labels: setup of the run, e.g. interface, driver, mtu, bond mode
+    """
+
+    def __init__(self, tool, **labels):
+        self.tool = tool
+        self.labels = labels
+        self.streams = []
+        self.throughput = None
+        self.retransmits = None
+        self.cpu = {}
+        self.latency = {}
+        self.extra = {}
+
+    def add_stream(self, name, throughput, **values):
+        """Adds a stream, throughput in Mb/s, values are e.g. bytes, ops."""
+        stream = collections.OrderedDict(name=name, throughput=throughput)
+        stream.update(values)
+        self.streams.append(stream)
+
+    def add_counters(self, host, counters):
+        """Adds the StackCounters.stop() values of host."""
+        if counters.get('cpu_util') is not None:
+            self.cpu[host] = counters['cpu_util']
+        # the sender's count of the whole stack, the tool's own count of
+        # its connections replaces it when parsed afterwards
+        if host == 'host' and self.retransmits is None:
+            self.retransmits = counters.get('retransmits')
+
+    def aggregate(self):
+        """
+        Returns the aggregate throughput in Mb/s, the sum of the streams
+        when the tool did not report it.
+        """
+        if self.throughput is None and self.streams:
+            return sum(stream['throughput'] for stream in self.streams)
+        return self.throughput
+
+    def percent_of(self, speed):
+        """Returns the aggregate throughput in percent of speed (Mb/s)."""
+        throughput = self.aggregate()
+        if throughput is None or not speed:
+            return None
+        return throughput * 100.0 / speed
+
+    def to_dict(self):
+        return collections.OrderedDict([
+            ('tool', self.tool), ('labels', self.labels),
+            ('throughput', self.aggregate()), ('streams', self.streams),
+            ('retransmits', self.retransmits), ('cpu_util', self.cpu),
+            ('latency', self.latency), ('extra', self.extra)])
+
+    def write(self, outputdir, name='throughput.json'):
+        """Writes the result as JSON in outputdir, returns its path."""
+        path = os.path.join(outputdir, name)
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
+        return path
+
+
+class StackCounters():
+    """CPU utilization and TCP retransmits of a host during a run.
+
+    :param run: runs a command on the host and returns a CmdResult, e.g.
+                process.run or Session.cmd
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.begin = None
+
+    def read(self):
+        """Returns the (busy, total) CPU ticks and the TCP counters."""
+        lines = self.run(COUNTERS_CMD).stdout_text.splitlines()
+        # user to steal, guest and guest_nice are counted in user and nice
+        cpu = [int(value) for value in lines[0].split()[1:9]] if lines \
+            else []
+        # idle and iowait
+        idle = sum(cpu[3:5])
+        tcp = {}
+        if len(lines) >= 3:
+            tcp = dict(zip(lines[1].split()[1:],
+                           [int(value) for value in lines[2].split()[1:]]))
+        return sum(cpu) - idle, sum(cpu), tcp
+
+    def start(self):
+        self.begin = self.read()
+
+    def stop(self):
+        """
+        Returns the CPU utilization in percent and the TCP segments sent
+        and retransmitted since start().
+        """
+        busy, total, tcp = self.read()
+        counters = {'cpu_util': None, 'retransmits': None,
+                    'segments_out': None}
+        if self.begin is None:
+            return counters
+        if total > self.begin[1]:
+            counters['cpu_util'] = round((busy - self.begin[0]) * 100.0 /
+                                         (total - self.begin[1]), 2)
+        for key, name in (('RetransSegs', 'retransmits'),
+                          ('OutSegs', 'segments_out')):
+            if key in tcp and key in self.begin[2]:
+                counters[name] = tcp[key] - self.begin[2][key]
+        return counters
+
+
+def measure(result, counters, func):
+    """
+    Calls func while the StackCounters of counters, a dict keyed by host
+    name, are running, adds them to result and returns what func returned.
+    """
+    for host in counters.values():
+        host.start()
+    value = func()
+    for name, host in counters.items():
+        result.add_counters(name, host.stop())
+    return value
+
+
+def parse_iperf_csv(output, result):
+    """
+    Adds the streams and the aggregate of 'iperf -y C' output (iperf 2) to
+    result: timestamp, source, source port, destination, destination
+    port, id, interval, bytes and bits/s per line, the sum of the parallel
+    streams has id -1. Only the reports of the whole run are kept.
+    """
+    reports = {}
+    for line in output.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 9:
+            continue
+        try:
+            start, end = [float(value) for value in fields[6].split('-')]
+            nbytes, bps = int(fields[7]), float(fields[8])
+        except ValueError:
+            continue
+        if start != 0:
+            continue
+        previous = reports.get(fields[5])
+        if previous is None or end >= previous[0]:
+            reports[fields[5]] = (end, nbytes, bps)
+    for stream_id, (end, nbytes, bps) in sorted(reports.items()):
+        if stream_id == '-1':
+            result.throughput = bps / 1000000.0
+        else:
+            result.add_stream(stream_id, bps / 1000000.0, bytes=nbytes,
+                              seconds=end)
+    return result
+
+
+def parse_uperf_raw(output, result):
+    """
+    Adds the streams of 'uperf -R' output to result. The raw statistics
+    are 'timestamp_ms:<ms> name:<name> nr_bytes:<n> nr_ops:<n>' samples,
+    the throughput of each thread (Thr*) is computed from its first and
+    last sample, the aggregate from the groups (Group*) when reported.
+    """
+    samples = collections.OrderedDict()
+    for match in _UPERF_RAW.finditer(output):
+        sample = (float(match.group('ms')), int(match.group('bytes')),
+                  int(match.group('ops')))
+        samples.setdefault(match.group('name'), []).append(sample)
+    rates = collections.OrderedDict()
+    for name, points in samples.items():
+        (first_ms, first_bytes, first_ops) = points[0]
+        (last_ms, last_bytes, last_ops) = points[-1]
+        if last_ms <= first_ms:
+            continue
+        seconds = (last_ms - first_ms) / 1000.0
+        rates[name] = ((last_bytes - first_bytes) * 8 / seconds / 1000000.0,
+                       last_bytes - first_bytes,
+                       (last_ops - first_ops) / seconds, seconds)
+    threads = [name for name in rates if name.startswith('Thr')]
+    groups = [name for name in rates if name.startswith('Group')]
+    for name in threads or [name for name in rates if name not in groups]:
+        throughput, nbytes, ops, seconds = rates[name]
+        result.add_stream(name, throughput, bytes=nbytes,
+                          ops_per_sec=round(ops, 2), seconds=seconds)
+    if groups:
+        result.throughput = sum(rates[name][0] for name in groups)
+    return result
+
+
+def parse_uperf_summary(output, peer, result):
+    """
+    Sets the aggregate of result from the throughput uperf reports for
+    peer in its run statistics, for uperf builds without raw statistics.
+    """
+    for line in output.splitlines():
+        match = _UPERF_RATE.search(line)
+        if peer in line and match:
+            result.throughput = float(match.group('value')) * \
+                UPERF_UNITS[match.group('unit')]
+    return result
+
+
+def parse_netperf_keyval(output, result):
+    """
+    Adds the results of netperf omni '-k' output (KEY=value lines, see
+    NETPERF_SELECTORS) to result. Transaction rates of request/response
+    tests are stored in extra, the latencies in usec.
+    """
+    values = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            values[key] = value
+    try:
+        throughput = float(values.get('THROUGHPUT', ''))
+    except ValueError:
+        return result
+    units = values.get('THROUGHPUT_UNITS', '10^6bits/s')
+    if units in NETPERF_UNITS:
+        result.add_stream('0', throughput * NETPERF_UNITS[units],
+                          seconds=float(values.get('ELAPSED_TIME') or 0))
+    else:
+        result.extra['transactions_per_sec'] = throughput
+    for key in ('PROTOCOL', 'DIRECTION'):
+        if key in values:
+            result.extra[key.lower()] = values[key]
+    for key, name in (('MEAN_LATENCY', 'mean'), ('P99_LATENCY', 'p99')):
+        try:
+            latency = float(values.get(key, ''))
+        except ValueError:
+            continue
+        # netperf reports -1 when the latency was not measured
+        if latency >= 0:
+            result.latency[name] = latency
+    try:
+        retransmits = int(values.get('LOCAL_TRANSPORT_RETRANS', ''))
+    except ValueError:
+        retransmits = -1
+    if retransmits >= 0:
+        result.retransmits = retransmits
+    return result
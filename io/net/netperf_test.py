@@ -26,14 +26,17 @@ import os
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import distro
-from avocado.utils import build
-from avocado.utils import archive
 from avocado.utils import process
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils.ssh import Session
 
+from common_api.build_cache import BuildCache, CACHE_DIR
+from net_api.throughput import (ThroughputResult, StackCounters,
+                                link_labels, measure, parse_netperf_keyval,
+                                NETPERF_SELECTORS)
+
 
 class Netperf(Test):
     """
@@ -108,40 +111,26 @@ class Netperf(Test):
         if self.networkinterface.set_mtu(self.mtu) is not None:
             self.cancel("Failed to set mtu in host")
         self.netperf_run = str(self.params.get("PERF_SERVER_RUN", default=False))
-        self.netperf = os.path.join(self.teststmpdir, 'netperf')
         netperf_download = self.params.get("netperf_download", default="https:"
                                            "//github.com/HewlettPackard/"
                                            "netperf/archive/netperf-2.7.0.zip")
         tarball = self.fetch_asset(netperf_download, expire='7d')
-        archive.extract(tarball, self.netperf)
-        self.version = "%s-%s" % ("netperf",
-                                  os.path.basename(tarball.split('.zip')[0]))
-        destination = "%s:/tmp" % self.peer_ip
-        output = self.session.copy_files(tarball, destination,
-                                         recursive=True)
-        if not output:
-            self.cancel("unable to copy the netperf into peer machine")
-        self.netperf_dir_peer = "/tmp/%s" % self.version
-        self.netperf_dir = os.path.join(self.netperf, self.version)
-        cmd1 = "unzip -o /tmp/%s -d /tmp;cd %s" % (os.path.basename(tarball), self.netperf_dir_peer)
-        output = self.session.cmd(cmd1)
-        if not output.exit_status == 0:
-            self.fail("test failed because command failed in peer machine")
-        os.chdir(self.netperf_dir)
         patch_file = self.params.get('patch', default='nettest_omni.patch')
         patch = self.get_data(patch_file)
-        process.run('patch -p1 < %s' % patch, shell=True)
-        peer_patch_name = patch.split('/')[-1]
-        peer_destination = "%s:%s" % (self.peer_ip, self.netperf_dir_peer)
-        self.session.copy_files(patch, peer_destination,
-                                recursive=True)
-        cmd = "cd %s; patch -p1 < %s; ./configure --build=powerpc64le;make" % (
-               self.netperf_dir_peer, peer_patch_name)
-        self.session.cmd(cmd)
-        if not output.exit_status == 0:
+        build_cmd = "patch -p1 < %s && ./configure --build=powerpc64le && " \
+                    "make -j$(nproc)" % os.path.basename(patch)
+        cache_dir = self.params.get("build_cache_dir", default=CACHE_DIR)
+        rebuild = self.params.get("rebuild", default=False)
+        self.netperf_dir_peer = BuildCache(
+            self.log, self.session, cache_dir=cache_dir,
+            rebuild=rebuild).build('netperf', tarball, build_cmd, [patch])
+        if not self.netperf_dir_peer:
             self.fail("test failed because command failed in peer machine")
-        process.system('./configure --build=powerpc64le', shell=True)
-        build.make(self.netperf_dir)
+        self.netperf_dir = BuildCache(
+            self.log, cache_dir=cache_dir,
+            rebuild=rebuild).build('netperf', tarball, build_cmd, [patch])
+        if not self.netperf_dir:
+            self.fail("Unable to compile netperf")
         self.perf = os.path.join(self.netperf_dir, 'src', 'netperf')
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="90")
         self.duration = self.params.get("duration", default="300")
@@ -158,11 +147,11 @@ class Netperf(Test):
         netperf test
         """
         if self.netperf_run:
-            cmd = "chmod 777 /tmp/%s/src" % self.version
+            cmd = "chmod 777 %s/src" % self.netperf_dir_peer
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("test failed because netserver not available")
-            cmd = "/tmp/%s/src/netserver -4" % self.version
+            cmd = "%s/src/netserver -4" % self.netperf_dir_peer
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("test failed because netserver not available")
@@ -184,18 +173,31 @@ class Netperf(Test):
                 cmd = "%s -t %s" % (cmd, self.option)
         cmd = "%s -l %s -i %s,%s" % (cmd, self.duration, self.max,
                                      self.min)
-        result = process.run(cmd, shell=True, ignore_status=True)
+        # omni keyval output, a test specific option
+        if ' -- ' not in cmd:
+            cmd = "%s --" % cmd
+        cmd = "%s -k %s" % (cmd, ','.join(NETPERF_SELECTORS))
+        throughput = ThroughputResult('netperf', peer=self.peer_ip,
+                                      option=self.option,
+                                      **link_labels(self.iface))
+        counters = {'host': StackCounters(lambda cmd: process.run(
+            cmd, ignore_status=True, shell=True)),
+            'peer': StackCounters(self.session.cmd)}
+        result = measure(throughput, counters, lambda: process.run(
+            cmd, shell=True, ignore_status=True))
         if result.exit_status != 0:
             self.fail("FAIL: Run failed")
-        for line in result.stdout.decode("utf-8").splitlines():
-            if line and 'Throughput' in line.split()[-1]:
-                tput = int(result.stdout.decode("utf-8").split()[-1].
-                           split('.')[0])
-                if tput < (int(self.expected_tp) * speed) / 100:
-                    self.fail("FAIL: Throughput Actual - %s%%, Expected - %s%%"
-                              ", Throughput Actual value - %s "
-                              % ((tput*100)/speed, self.expected_tp,
-                                 str(tput)+'Mb/sec'))
+        parse_netperf_keyval(result.stdout_text, throughput)
+        throughput.write(self.outputdir)
+        tput = throughput.aggregate()
+        # request/response tests report a transaction rate instead
+        if tput is None and 'transactions_per_sec' not in throughput.extra:
+            self.fail("FAIL: no throughput in the netperf output")
+        if tput is not None and tput < (int(self.expected_tp) * speed) / 100:
+            self.fail("FAIL: Throughput Actual - %s%%, Expected - %s%%"
+                      ", Throughput Actual value - %s "
+                      % (throughput.percent_of(speed), self.expected_tp,
+                         '%.2fMb/sec' % tput))
 
         if 'WARNING' in result.stdout.decode("utf-8"):
             self.log.warn('Test completed with warning')
@@ -205,7 +207,7 @@ class Netperf(Test):
         removing the data in peer machine
         """
         if self.iface:
-            cmd = "pkill netserver; rm -rf /tmp/%s" % self.version
+            cmd = "pkill netserver || true"
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("test failed because peer sys not connected")
@@ -33,6 +33,8 @@ from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils import wait
 
+from net_api.netns import NetnsPeer, HOST_IPS, PEER_IPS
+
 
 class NetworkTest(Test):
     '''
@@ -58,7 +60,15 @@ class NetworkTest(Test):
         interfaces = os.listdir('/sys/class/net')
         local = LocalHost()
         device = self.params.get("interface")
-        if device in interfaces:
+        self.netns = None
+        if self.params.get("peer_mode", default="ssh") == "netns":
+            # the peer is a network namespace linked by a veth pair
+            self.netns = NetnsPeer()
+            self.netns.setup([self.params.get("host_ip") or HOST_IPS[0]],
+                             [self.params.get("peer_ip") or PEER_IPS[0]],
+                             self.params.get("netmask") or '255.255.255.0')
+            self.interface = self.netns.host_interfaces[0]
+        elif device in interfaces:
             self.interface = device
         elif local.validate_mac_addr(device) and device in local.get_all_hwaddr():
             self.interface = local.get_interface_by_hwaddr(device).name
@@ -68,6 +78,8 @@ class NetworkTest(Test):
         self.ipaddr = self.params.get("host_ip", default="")
         self.netmask = self.params.get("netmask", default="")
         self.ip_config = self.params.get("ip_config", default=True)
+        if self.netns:
+            self.ip_config = False
         self.hbond = self.params.get("hbond", default=False)
         if self.hbond:
             self.networkinterface = NetworkInterface(
@@ -84,6 +96,8 @@ class NetworkTest(Test):
         if not wait.wait_for(self.networkinterface.is_link_up, timeout=120):
             self.fail("Link up of interface is taking longer than 120 seconds")
         self.peer = self.params.get("peer_ip")
+        if self.netns:
+            self.peer = self.peer or PEER_IPS[0]
         if not self.peer:
             self.cancel("No peer provided")
         self.mtu = self.params.get("mtu", default=1500)
@@ -91,20 +105,27 @@ class NetworkTest(Test):
         self.peer_user = self.params.get("peer_user", default="root")
         self.peer_password = self.params.get("peer_password", '*',
                                              default=None)
-        if 'scp' or 'ssh' in str(self.name.name):
-            self.session = Session(self.peer, user=self.peer_user,
-                                   password=self.peer_password)
-            self.session.cleanup_master()
-            if not self.session.connect():
-                self.cancel("failed connecting to peer")
-        self.remotehost = RemoteHost(self.peer, self.peer_user,
-                                     password=self.peer_password)
-        self.peer_interface = self.remotehost.get_interface_by_ipaddr(
-            self.peer).name
+        if self.netns:
+            self.session = self.netns.session
+            self.remotehost = self.netns.host
+            self.remotehost_public = self.netns.host
+            self.peer_interface = self.netns.peer_interfaces[0]
+        else:
+            if 'scp' or 'ssh' in str(self.name.name):
+                self.session = Session(self.peer, user=self.peer_user,
+                                       password=self.peer_password)
+                self.session.cleanup_master()
+                if not self.session.connect():
+                    self.cancel("failed connecting to peer")
+            self.remotehost = RemoteHost(self.peer, self.peer_user,
+                                         password=self.peer_password)
+            self.peer_interface = self.remotehost.get_interface_by_ipaddr(
+                self.peer).name
+            self.remotehost_public = RemoteHost(
+                self.peer_public_ip, self.peer_user,
+                password=self.peer_password)
         self.peer_networkinterface = NetworkInterface(self.peer_interface,
                                                       self.remotehost)
-        self.remotehost_public = RemoteHost(self.peer_public_ip, self.peer_user,
-                                            password=self.peer_password)
         self.peer_public_networkinterface = NetworkInterface(self.peer_interface,
                                                              self.remotehost_public)
         self.mtu = self.params.get("mtu", default=1500)
@@ -223,6 +244,8 @@ class NetworkTest(Test):
         '''
         Test scp
         '''
+        if self.netns:
+            self.cancel("the netns peer shares the host file systems")
         process.run("dd if=/dev/zero of=/tmp/tempfile bs=1024000000 count=1",
                     shell=True)
         md_val1 = hashlib.md5(open('/tmp/tempfile', 'rb').read()).hexdigest()
@@ -350,3 +373,5 @@ class NetworkTest(Test):
             self.remotehost_public.remote_session.quit()
         if 'scp' or 'ssh' in str(self.name.name):
             self.session.quit()
+        if self.netns:
+            self.netns.cleanup()
@@ -24,8 +24,6 @@ import os
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import distro
-from avocado.utils import build
-from avocado.utils import archive
 from avocado.utils import process
 from avocado.utils.ssh import Session
 from avocado.utils.genio import read_file
@@ -33,6 +31,12 @@ from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils.process import SubProcess
 
+from common_api.build_cache import BuildCache, CACHE_DIR
+from net_api.netns import NetnsPeer, HOST_IPS, PEER_IPS
+from net_api.throughput import (ThroughputResult, StackCounters,
+                                link_labels, measure, parse_uperf_raw,
+                                parse_uperf_summary)
+
 
 class Uperf(Test):
     """
@@ -46,32 +50,52 @@ class Uperf(Test):
         local = LocalHost()
         self.uperf_run = False
         self.networkinterface = None
-        interfaces = os.listdir('/sys/class/net')
         self.peer_ip = self.params.get("peer_ip", default="")
         self.peer_public_ip = self.params.get("peer_public_ip", default="")
         self.peer_user = self.params.get("peer_user", default="root")
         self.peer_password = self.params.get("peer_password", '*',
                                              default="None")
-        device = self.params.get("interface", default=None)
+        self.ipaddr = self.params.get("host_ip", default="")
+        self.netmask = self.params.get("netmask", default="")
+        self.netns = None
+        if self.params.get("peer_mode", default="ssh") == "netns":
+            # the peer is a network namespace linked by a veth pair
+            self.netns = NetnsPeer()
+            self.ipaddr = self.ipaddr or HOST_IPS[0]
+            self.peer_ip = self.peer_ip or PEER_IPS[0]
+            self.netmask = self.netmask or '255.255.255.0'
+            self.netns.setup([self.ipaddr], [self.peer_ip], self.netmask)
+            device = self.netns.host_interfaces[0]
+        else:
+            device = self.params.get("interface", default=None)
+        interfaces = os.listdir('/sys/class/net')
         if device in interfaces:
             self.iface = device
         elif local.validate_mac_addr(device) and device in local.get_all_hwaddr():
             self.iface = local.get_interface_by_hwaddr(device).name
         else:
             self.cancel("%s interface is not available" % device)
-        self.ipaddr = self.params.get("host_ip", default="")
-        self.netmask = self.params.get("netmask", default="")
         self.networkinterface = NetworkInterface(self.iface, local)
-        try:
-            self.networkinterface.add_ipaddr(self.ipaddr, self.netmask)
-            self.networkinterface.save(self.ipaddr, self.netmask)
-        except Exception:
-            self.networkinterface.save(self.ipaddr, self.netmask)
-        self.networkinterface.bring_up()
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
+        if self.netns:
+            self.session = self.netns.session
+        else:
+            try:
+                self.networkinterface.add_ipaddr(self.ipaddr, self.netmask)
+                self.networkinterface.save(self.ipaddr, self.netmask)
+            except Exception:
+                self.networkinterface.save(self.ipaddr, self.netmask)
+            self.networkinterface.bring_up()
+            self.session = Session(self.peer_ip, user=self.peer_user,
+                                   password=self.peer_password)
         if not self.session.connect():
             self.cancel("failed connecting to peer")
+        cache_dir = self.params.get("build_cache_dir", default=CACHE_DIR)
+        rebuild = self.params.get("rebuild", default=False)
+        self.build_cache = BuildCache(self.log, cache_dir=cache_dir,
+                                      rebuild=rebuild)
+        self.peer_build_cache = BuildCache(self.log, self.session,
+                                           cache_dir=cache_dir,
+                                           rebuild=rebuild)
         smm = SoftwareManager()
         detected_distro = distro.detect()
         pkgs = ["gcc", "gcc-c++", "autoconf",
@@ -86,36 +110,43 @@ class Uperf(Test):
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("Unable to install the package %s on host machine"
                             % pkg)
+            if self.netns:
+                # the namespace shares the host file systems
+                continue
             cmd = "%s install %s" % (smm.backend.base_command, pkg)
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.cancel("Unable to install the package %s on peer machine "
                             % pkg)
         if detected_distro.name == "SuSE":
-            self.nmap = os.path.join(self.teststmpdir, 'nmap')
             nmap_download = self.params.get("nmap_download", default="https:"
                                             "//nmap.org/dist/"
                                             "nmap-7.93.tar.bz2")
             tarball = self.fetch_asset(nmap_download)
-            self.version = os.path.basename(tarball.split('.tar')[0])
-            self.n_map = os.path.join(self.nmap, self.version)
-            archive.extract(tarball, self.nmap)
+            self.n_map = self.build_cache.build(
+                'nmap', tarball, './configure ppc64le && make -j$(nproc)')
+            if not self.n_map:
+                self.cancel("Unable to compile nmap")
             os.chdir(self.n_map)
-            process.system('./configure ppc64le', shell=True)
-            build.make(self.n_map)
             process.system('./nping/nping -h', shell=True)
 
         if self.peer_ip == "":
             self.cancel("%s peer machine is not available" % self.peer_ip)
         self.mtu = self.params.get("mtu", default=1500)
-        self.remotehost = RemoteHost(self.peer_ip, self.peer_user,
-                                     password=self.peer_password)
-        self.peer_interface = self.remotehost.get_interface_by_ipaddr(
-            self.peer_ip).name
+        if self.netns:
+            self.remotehost = self.netns.host
+            self.remotehost_public = self.netns.host
+            self.peer_interface = self.netns.peer_interfaces[0]
+        else:
+            self.remotehost = RemoteHost(self.peer_ip, self.peer_user,
+                                         password=self.peer_password)
+            self.peer_interface = self.remotehost.get_interface_by_ipaddr(
+                self.peer_ip).name
+            self.remotehost_public = RemoteHost(
+                self.peer_public_ip, self.peer_user,
+                password=self.peer_password)
         self.peer_networkinterface = NetworkInterface(self.peer_interface,
                                                       self.remotehost)
-        self.remotehost_public = RemoteHost(self.peer_public_ip, self.peer_user,
-                                            password=self.peer_password)
         self.peer_public_networkinterface = NetworkInterface(self.peer_interface,
                                                              self.remotehost_public)
         if self.peer_networkinterface.set_mtu(self.mtu) is not None:
@@ -127,27 +158,23 @@ class Uperf(Test):
                                          "archive/master.zip")
         tarball = self.fetch_asset("uperf.zip", locations=[uperf_download],
                                    expire='7d')
-        archive.extract(tarball, self.teststmpdir)
-        self.uperf_dir = os.path.join(self.teststmpdir, "uperf-master")
-        destination = "%s:/tmp" % self.peer_ip
-        output = self.session.copy_files(self.uperf_dir, destination,
-                                         recursive=True)
-        if not output:
-            self.cancel("unable to copy the uperf into peer machine")
-        cmd = "cd /tmp/uperf-master;autoreconf -fi;./configure ppc64le;make"
-        output = self.session.cmd(cmd)
-        if not output.exit_status == 0:
+        self.peer_uperf_dir = self.peer_build_cache.build(
+            'uperf', tarball,
+            'autoreconf -fi && ./configure ppc64le && make -j$(nproc)')
+        if not self.peer_uperf_dir:
             self.cancel("Unable to compile Uperf into peer machine")
         self.uperf_run = str(self.params.get("PERF_SERVER_RUN", default=False))
         if self.uperf_run:
-            cmd = "/tmp/uperf-master/src/uperf -s &"
+            cmd = "%s/src/uperf -s &" % self.peer_uperf_dir
             cmd = self.session.get_raw_ssh_command(cmd)
             self.obj = SubProcess(cmd)
             self.obj.start()
+        self.uperf_dir = self.build_cache.build(
+            'uperf', tarball,
+            'autoreconf -fi && ./configure ppc64le && make -j$(nproc)')
+        if not self.uperf_dir:
+            self.cancel("Unable to compile Uperf")
         os.chdir(self.uperf_dir)
-        process.system('autoreconf -fi', shell=True)
-        process.system('./configure ppc64le', shell=True)
-        build.make(self.uperf_dir)
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="85")
 
     def nping(self):
@@ -170,23 +197,29 @@ class Uperf(Test):
         messages using multiple threads or processes.
         """
         speed = int(read_file("/sys/class/net/%s/speed" % self.iface))
-        cmd = "h=%s proto=tcp ./src/uperf -m manual/throughput.xml -a" \
-            % self.peer_ip
-        result = process.run(cmd, shell=True, ignore_status=True)
+        cmd = "h=%s proto=tcp ./src/uperf -m manual/throughput.xml -a " \
+            "-R -i 1" % self.peer_ip
+        throughput = ThroughputResult('uperf', peer=self.peer_ip,
+                                      **link_labels(self.iface))
+        counters = {'host': StackCounters(lambda cmd: process.run(
+            cmd, ignore_status=True, shell=True)),
+            'peer': StackCounters(self.session.cmd)}
+        result = measure(throughput, counters, lambda: process.run(
+            cmd, shell=True, ignore_status=True))
         if result.exit_status:
             self.fail("FAIL: Uperf Run failed")
-        for line in result.stdout.decode("utf-8").splitlines():
-            if self.peer_ip in line:
-                if 'Mb/s' in line:
-                    tput = int(line.split()[3].split('.')[0])
-                else:
-                    # Converting the throughput calculated in Gb to Mb
-                    tput = int(line.split()[3].split('.')[0]) * 1000
-                if tput < (int(self.expected_tp) * speed) / 100:
-                    self.fail("FAIL: Throughput Actual - %s%%, Expected - %s%%"
-                              ", Throughput Actual value - %s "
-                              % ((tput*100)/speed, self.expected_tp,
-                                 str(tput)+'Mb/sec'))
+        parse_uperf_raw(result.stdout_text, throughput)
+        if throughput.aggregate() is None:
+            parse_uperf_summary(result.stdout_text, self.peer_ip, throughput)
+        throughput.write(self.outputdir)
+        tput = throughput.aggregate()
+        if tput is None:
+            self.fail("FAIL: no throughput in the uperf output")
+        if tput < (int(self.expected_tp) * speed) / 100:
+            self.fail("FAIL: Throughput Actual - %s%%, Expected - %s%%"
+                      ", Throughput Actual value - %s "
+                      % (throughput.percent_of(speed), self.expected_tp,
+                         '%.2fMb/sec' % tput))
         nping_result = self.nping()
         for line in nping_result.stdout.decode("utf-8").splitlines():
             if 'Raw packets' in line:
@@ -203,7 +236,7 @@ class Uperf(Test):
         if self.networkinterface:
             if self.uperf_run:
                 self.obj.stop()
-            cmd = "pkill uperf; rm -rf /tmp/uperf-master"
+            cmd = "pkill uperf || true"
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("Either the ssh to peer machine machine\
@@ -214,13 +247,16 @@ class Uperf(Test):
                 self.peer_networkinterface.set_mtu('1500')
             except Exception:
                 self.peer_public_networkinterface.set_mtu('1500')
-            self.networkinterface.remove_ipaddr(self.ipaddr, self.netmask)
-            try:
-                self.networkinterface.restore_from_backup()
-            except Exception:
-                self.log.info(
-                    "backup file not available, could not restore file.")
+            if not self.netns:
+                self.networkinterface.remove_ipaddr(self.ipaddr, self.netmask)
+                try:
+                    self.networkinterface.restore_from_backup()
+                except Exception:
+                    self.log.info(
+                        "backup file not available, could not restore file.")
             self.remotehost.remote_session.quit()
             if hasattr(self, 'remotehost_public'):
                 self.remotehost_public.remote_session.quit()
             self.session.quit()
+        if self.netns:
+            self.netns.cleanup()
@@ -24,6 +24,8 @@ from avocado.utils.ssh import Session
 from avocado.utils.process import CmdError
 from avocado.utils.network.hosts import LocalHost
 
+from net_api.netns import NetnsPeer, HOST_IPS, PEER_IPS
+
 
 class VlanTest(Test):
 
@@ -40,6 +42,9 @@ class VlanTest(Test):
     :param peer_user: Userid of the peer
     :param peer_password: Password of the peer to ssh into
     :param netmask: netmask of the test N/W Interfaces
+    :param peer_mode: 'ssh', or 'netns' for a peer in a network namespace
+                      linked through a VLAN filtering bridge standing in
+                      for the switch
     """
 
     def setUp(self):
@@ -47,9 +52,12 @@ class VlanTest(Test):
         test parameters
         """
         self.parameters()
-        self.switch_login(self.switch_name, self.userid, self.password)
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
+        if self.netns:
+            self.session = self.netns.session
+        else:
+            self.switch_login(self.switch_name, self.userid, self.password)
+            self.session = Session(self.peer_ip, user=self.peer_user,
+                                   password=self.peer_password)
         if not self.session.connect():
             self.cancel("failed connecting to peer")
         self.get_ips()
@@ -57,8 +65,16 @@ class VlanTest(Test):
     def parameters(self):
         local = LocalHost()
         self.host_intf = None
+        self.netns = None
+        self.cidr_value = self.params.get("cidr_value", '*', default=None)
+        if self.params.get("peer_mode", default="ssh") == "netns":
+            self.cidr_value = self.cidr_value or "24"
+            self.netns = NetnsPeer(switch=True)
+            self.netns.setup([HOST_IPS[0]], [PEER_IPS[0]], self.cidr_value)
+            device = self.netns.host_interfaces[0]
+        else:
+            device = self.params.get("interface", default=None)
         interfaces = os.listdir('/sys/class/net')
-        device = self.params.get("interface", default=None)
         if device in interfaces:
             self.host_intf = device
         elif local.validate_mac_addr(device) and device in local.get_all_hwaddr():
@@ -80,8 +96,11 @@ class VlanTest(Test):
         self.peer_user = self.params.get("peer_user", '*', default=None)
         self.peer_password = self.params.get("peer_password", '*',
                                              default=None)
-        self.cidr_value = self.params.get("cidr_value", '*', default=None)
         self.prompt = ">"
+        if self.netns:
+            self.host_port = self.netns.host_ports[0]
+            self.peer_port = self.netns.peer_ports[0]
+            self.peer_intf = self.netns.peer_interfaces[0]
 
     def switch_login(self, ip, username, password):
         '''
@@ -220,6 +239,10 @@ class VlanTest(Test):
         Set both host & peer interface ports with corresponding
         vlan's (host_vlan, peer_vlan)
         """
+        if self.netns:
+            self.set_vlan_port(host_vlan, self.host_port)
+            self.set_vlan_port(peer_vlan, self.peer_port)
+            return
         self.log.info("Enabling the privilege mode")
         self.run_switch_command("enable")
         self.log.info("Entering configuration mode")
@@ -231,6 +254,12 @@ class VlanTest(Test):
         """
         Sets the interface port to a vlan num
         """
+        if self.netns:
+            self.log.info("Changing the VLAN to %s of port %s", vlan_num,
+                          port_id)
+            self.netns.set_port_vlan(port_id, vlan_num, tag_native=getattr(
+                self, 'test_type', None) == "full")
+            return
         cmd = "show mac-address-table interface port %s" % port_id
         self.run_switch_command(cmd)
         self.log.info("Going to port %s", port_id)
@@ -324,7 +353,12 @@ class VlanTest(Test):
         Restore back the default VLAN ID 1
         and also restore interfaces back when full test is run
         """
-        if self.host_intf:
+        if self.netns:
+            # the switch and the links go away with the namespace
+            if self.host_intf:
+                self.peer_logout()
+            self.netns.cleanup()
+        elif self.host_intf:
             self.vlan_port_conf("1", "1")
             if hasattr(self, 'test_type') and self.test_type == "full":
                 # Disable PVID tagging as other tests need it to be in disabled.
@@ -19,23 +19,37 @@
 This scripts basic EEH tests on all PCI device
 """
 
+import os
+import json
 import time
+import select
 import psutil
 from avocado import Test
 from avocado.utils import process, wait
 from avocado.utils import pci
 from avocado.utils import genio
 from avocado.utils import distro
-from avocado.utils import dmesg
 from avocado.utils import multipath
 from avocado.utils import data_structures
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost
 
+from common_api.kmsg import KmsgWatcher
+from common_api.uevent import UeventMonitor
+
 EEH_HIT = 0
 EEH_MISS = 1
 
+# EEH recovery phases and the kernel messages which enter them
+EEH_PHASES = (('frozen', ('EEH: Frozen', 'EEH: Detected')),
+              ('reset', ('EEH: Reset', "EEH: Beginning: 'slot_reset'")),
+              ('resume', ('EEH: Notify device driver to resume',
+                          "EEH: Beginning: 'resume'")),
+              ('recovered', ('EEH: Recovery successful.',)),
+              ('failed', ('Unable to recover from failure',)),
+              ('removed', ('permanently disabled',)))
+
 
 class EEHRecoveryFailed(Exception):
 
@@ -54,6 +68,81 @@ class EEHRecoveryFailed(Exception):
             )
 
 
+class EEHObserver():
+
+    """
+    Follows a PE through an EEH recovery, from the kernel messages and
+    the PCI uevents, and times every phase from the error injection.
+    """
+
+    def __init__(self, pci_device):
+        self.pci_device = pci_device
+        self.kmsg = KmsgWatcher(levels=None)
+        self.uevents = UeventMonitor(subsystems=('pci',))
+        self.start = time.monotonic()
+        self.events = {}
+
+    def begin(self):
+        """
+        Forgets about everything logged so far, called right before an
+        error injection.
+        """
+        self.kmsg.read()
+        self.uevents.read()
+        self.start = time.monotonic()
+        self.events = {}
+
+    def __record(self, name, timestamp):
+        if name not in self.events:
+            self.events[name] = timestamp - self.start
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds for new kernel messages or uevents,
+        and records the phases they enter.
+        """
+        if not select.select([self.kmsg, self.uevents], [], [], timeout)[0]:
+            return
+        now = time.monotonic()
+        for record in self.kmsg.read():
+            for name, messages in EEH_PHASES:
+                if any(message in record.message for message in messages):
+                    self.__record(name, now)
+        for event in self.uevents.read():
+            if event.env.get('PCI_SLOT_NAME') != self.pci_device:
+                continue
+            if event.action == 'remove':
+                self.__record('device_removed', event.timestamp)
+            elif event.action == 'add':
+                self.__record('device_added', event.timestamp)
+            elif 'ERROR_EVENT' in event.env:
+                self.__record(event.env['ERROR_EVENT'].lower(),
+                              event.timestamp)
+
+    def mark(self, name):
+        """Records name as entered now."""
+        self.__record(name, time.monotonic())
+
+    def wait_for(self, names, timeout):
+        """
+        Returns the first of the names phases entered within timeout
+        seconds, None if none was.
+        """
+        end = time.monotonic() + timeout
+        while True:
+            for name in names:
+                if name in self.events:
+                    return name
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.poll(remaining)
+
+    def close(self):
+        self.kmsg.close()
+        self.uevents.close()
+
+
 class EEH(Test):
 
     """
@@ -128,6 +217,10 @@ class EEH(Test):
                 self.pci_class_name = 'scsi_host'
             self.pci_interface = pci.get_interfaces_in_pci_address(
                 self.pci_device, self.pci_class_name)[-1]
+        self.recovery_settle = int(self.params.get('recovery_settle',
+                                                   default=0))
+        self.eeh_timing = []
+        self.observer = EEHObserver(self.pci_device)
         self.log.info("===============Testing EEH Frozen PE==================")
 
     def test_eeh_basic_pe(self):
@@ -169,21 +262,15 @@ class EEH(Test):
                                 break
                             else:
                                 self.log.info("PE recovered successfully")
-                        time.sleep(10)
+                                self.report_timing(func)
                         if pci.get_pci_class_name(self.pci_device) == "fc_host":
-                            after_eeh_path_status = multipath.get_multipath_details()
-                            get_diff_bef_aft = data_structures.recursive_compare_dict(
-                                    before_eeh_path_status,
-                                    after_eeh_path_status,
-                                    diff_btw_dict=[]
-                                )
-                            if len(get_diff_bef_aft) != 0:
-                                for value in get_diff_bef_aft[:]:
-                                    if ("path_faults " in value) or ("switch_grp " in value):
-                                        get_diff_bef_aft.remove(value)
-                                if len(get_diff_bef_aft) != 0:
-                                    self.fail("Some devices/disks are failed to recover after EEH")
-                                    self.log.info(get_diff_bef_aft)
+                            if not wait.wait_for(
+                                    lambda: not self.multipath_diff(
+                                        before_eeh_path_status),
+                                    timeout=60):
+                                self.log.info(self.multipath_diff(
+                                    before_eeh_path_status))
+                                self.fail("Some devices/disks are failed to recover after EEH")
                 else:
                     self.log.warning(f"EEH inject failed for 5 times with function {func}")
                     enter_loop = False
@@ -202,7 +289,7 @@ class EEH(Test):
         Injects Error, and checks for PE recovery
         returns True, if recovery is success, else False
         """
-        dmesg.clear_dmesg()
+        self.observer.begin()
         # Start network traffic for net pci_class
         if self.pci_class_name == 'net':
             self.networkinterface.ping_flood(self.interface,
@@ -252,62 +339,65 @@ class EEH(Test):
         """
         Check if the PE is recovered successfully after injecting EEH
         """
-        cmd = "dmesg"
-        tries = 60
-        for _ in range(0, tries):
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'EEH: Recovery successful.' in res.stdout.decode("utf-8"):
-                self.log.info("waiting for PE to recover %s", self.pci_device)
-                # EEH Recovery is not similar for all adapters. For some
-                # adapters, specifically multipath, we see that the adapter
-                # needs some more time to recover after the message "Notify
-                # device driver to resume" on the dmesg.
-                # There is no reliable way to determine this extra time
-                # required, nor a way to determine the recovery. So, a sleep
-                # time of 10s is introduced.
-                time.sleep(10)
-                break
-            time.sleep(1)
-        else:
+        state = self.observer.wait_for(('recovered', 'successful_recovery',
+                                        'failed', 'failed_recovery',
+                                        'removed'), 60)
+        if state not in ('recovered', 'successful_recovery'):
             raise EEHRecoveryFailed("EEH recovery failed", self.pci_device)
-        tries = 30
-        for _ in range(0, tries):
-            for device in pci.get_pci_addresses():
-                if self.pci_device in device:
-                    return True
-                time.sleep(1)
+        self.log.info("waiting for PE to recover %s", self.pci_device)
+        # a reset with hotplug activity removes the device and adds it back
+        if 'device_removed' in self.observer.events:
+            self.observer.wait_for(('device_added',), 30)
+        if not wait.wait_for(lambda: os.path.exists(
+                "/sys/bus/pci/devices/%s" % self.pci_device),
+                timeout=30, step=0.1):
             return False
+        self.observer.mark('enumerated')
+        # EEH Recovery is not similar for all adapters, some need more
+        # time after the driver resume, which can not be detected
+        if self.recovery_settle:
+            time.sleep(self.recovery_settle)
+        return True
 
-    @classmethod
-    def check_eeh_hit(cls):
+    def check_eeh_hit(self):
         """
         Function to check if EEH is successfully hit
         """
-        tries = 30
-        cmd = "dmesg"
-        for _ in range(0, tries):
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'EEH: Frozen' in res.stdout.decode("utf-8") and \
-               res.exit_status == 0:
-                return True
-            time.sleep(1)
-        return False
+        return self.observer.wait_for(('frozen', 'begin_recovery'),
+                                      30) is not None
 
-    @classmethod
-    def check_eeh_removed(cls):
+    def check_eeh_removed(self):
         """
         Function to check if PE is recovered successfully
         """
-        tries = 30
-        for _ in range(0, tries):
-            cmd = "dmesg"
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'permanently disabled' in res.stdout.decode("utf-8") and \
-               res.exit_status == 0:
-                time.sleep(10)
-                return True
-            time.sleep(1)
-        return False
+        return self.observer.wait_for(('removed',), 30) is not None
+
+    @staticmethod
+    def multipath_diff(before_eeh_path_status):
+        """
+        Returns the multipath changes since before the EEH, path faults
+        and switch group changes aside
+        """
+        get_diff_bef_aft = data_structures.recursive_compare_dict(
+            before_eeh_path_status, multipath.get_multipath_details(),
+            diff_btw_dict=[])
+        return [value for value in get_diff_bef_aft
+                if "path_faults " not in value and "switch_grp " not in value]
+
+    def report_timing(self, func):
+        """
+        Logs the time taken by each phase of the last EEH, and saves the
+        timings of all the EEH so far in eeh-timing.json
+        """
+        timing = dict(self.observer.events, function=func)
+        self.eeh_timing.append(timing)
+        self.log.info("EEH %s: %s", len(self.eeh_timing),
+                      ", ".join("%s %.3fs" % (name, timing[name])
+                                for name in sorted(self.observer.events,
+                                                   key=timing.get)))
+        with open(os.path.join(self.outputdir, 'eeh-timing.json'),
+                  'w') as timing_file:
+            json.dump(self.eeh_timing, timing_file, indent=4)
 
     @staticmethod
     def is_baremetal():
@@ -317,3 +407,7 @@ class EEH(Test):
         if 'PowerNV' in genio.read_file("/proc/cpuinfo").strip():
             return True
         return False
+
+    def tearDown(self):
+        if hasattr(self, 'observer'):
+            self.observer.close()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+NUMA page migration bandwidth matrix.
+
+The migration tests used to run the move_pages helpers and only check
+their exit code. The helpers print a 'RESULT type=<page type> src=<node>
+dst=<node> bytes=<n> seconds=<time>' line per move_pages call, timed with
+CLOCK_MONOTONIC. MigrationMatrix collects them into a source x
+destination node matrix of GB/s per page type and page count, writes it
+as JSON and CSV, and compares it with the matrix of a previous run.
+
+Usage::
+
+    matrix = MigrationMatrix()
+    for src, dst in node_pairs(nodes):
+        output = process.run('./bench_movepages -n 100 -s %s -d %s -t thp'
+                             % (src, dst)).stdout_text
+        matrix.add_output(output, pages=100)
+    matrix.write(outputdir)
+    regressions = matrix.compare(load_baseline(path), tolerance=10)
+"""
+
+import csv
+import itertools
+import json
+import os
+import re
+
+__all__ = ['MigrationMatrix', 'parse_results', 'node_pairs', 'load_baseline',
+           'format_regressions']
+
+_RESULT = re.compile(r'^RESULT type=(?P<type>\S+) src=(?P<src>\d+) '
+                     r'dst=(?P<dst>\d+) bytes=(?P<bytes>\d+) '
+                     r'seconds=(?P<seconds>[\d.]+)', re.MULTILINE)
+CSV_FIELDS = ('type', 'pages', 'src', 'dst', 'bytes', 'seconds', 'gbps',
+              'baseline_gbps', 'change_pct')
+
+
+def parse_results(output):
+    """Returns the (type, src, dst, bytes, seconds) RESULT lines of output."""
+    return [(match.group('type'), int(match.group('src')),
+             int(match.group('dst')), int(match.group('bytes')),
+             float(match.group('seconds')))
+            for match in _RESULT.finditer(output)]
+
+
+def node_pairs(nodes):
+    """Returns every (source, destination) pair of distinct nodes."""
+    return list(itertools.permutations(sorted(int(node) for node in nodes),
+                                       2))
+
+
+def load_baseline(path):
+    """Returns the MigrationMatrix written as JSON to path."""
+    with open(path) as source:
+        return MigrationMatrix.from_dict(json.load(source))
+
+
+def format_regressions(regressions):
+    """Returns the MigrationMatrix.compare() regressions as text."""
+    return ', '.join('%s pages=%s %s->%s %s GB/s (baseline %s)'
+                     % (key + (gbps, previous))
+                     for key, gbps, previous in regressions)
+
+
+class MigrationMatrix():
+    """Migration bandwidth per page type, page count and node pair.
+
+    Several results of the same key, e.g. the chunks of one run, are
+    summed, the bandwidth is the bytes moved over the time it took.
+    """
+
+    def __init__(self):
+        # (type, pages, src, dst): [bytes, seconds]
+        self.results = {}
+        self.comparison = {}
+
+    def add(self, page_type, pages, src, dst, nbytes, seconds):
+        totals = self.results.setdefault((page_type, int(pages), int(src),
+                                          int(dst)), [0, 0.0])
+        totals[0] += nbytes
+        totals[1] += seconds
+
+    def add_output(self, output, pages=None, page_size=None):
+        """
+        Adds the RESULT lines of a helper output, returns their count.
+        Without pages, the page count of each result is its size in
+        page_size pages.
+        """
+        results = parse_results(output)
+        for page_type, src, dst, nbytes, seconds in results:
+            if pages is None:
+                self.add(page_type, nbytes // page_size, src, dst, nbytes,
+                         seconds)
+            else:
+                self.add(page_type, pages, src, dst, nbytes, seconds)
+        return len(results)
+
+    def gbps(self, key):
+        nbytes, seconds = self.results[key]
+        return round(nbytes / seconds / 1e9, 3) if seconds else None
+
+    def nodes(self):
+        return sorted({key[2] for key in self.results} |
+                      {key[3] for key in self.results})
+
+    def series(self):
+        """Returns the (type, pages) keys of the matrices, sorted."""
+        return sorted({key[:2] for key in self.results})
+
+    def matrix(self, page_type, pages):
+        """
+        Returns the rows of the GB/s matrix of page_type and pages, one
+        per source node, with a column per destination node, None where
+        not measured.
+        """
+        nodes = self.nodes()
+        return [[self.gbps((page_type, pages, src, dst))
+                 if (page_type, pages, src, dst) in self.results else None
+                 for dst in nodes] for src in nodes]
+
+    def compare(self, baseline, tolerance):
+        """
+        Compares the bandwidth with baseline, another MigrationMatrix,
+        returns the results below baseline by more than tolerance percent
+        as (key, gbps, baseline gbps) tuples.
+        """
+        regressions = []
+        self.comparison = {}
+        for key in sorted(self.results):
+            if key not in baseline.results:
+                continue
+            current, previous = self.gbps(key), baseline.gbps(key)
+            if not current or not previous:
+                continue
+            change = round((current - previous) * 100.0 / previous, 2)
+            self.comparison[key] = (previous, change)
+            if change < -tolerance:
+                regressions.append((key, current, previous))
+        return regressions
+
+    def format(self, page_type, pages):
+        """Returns the GB/s matrix of page_type and pages as text lines."""
+        nodes = self.nodes()
+        lines = ['%s pages=%s GB/s, rows src, columns dst'
+                 % (page_type, pages),
+                 '%6s' % '' + ''.join('%10s' % node for node in nodes)]
+        for src, row in zip(nodes, self.matrix(page_type, pages)):
+            lines.append('%6s' % src + ''.join(
+                '%10s' % ('-' if value is None else value) for value in row))
+        return lines
+
+    def to_dict(self):
+        return {
+            'nodes': self.nodes(),
+            'matrices': [{'type': page_type, 'pages': pages,
+                          'gbps': self.matrix(page_type, pages)}
+                         for page_type, pages in self.series()],
+            'results': [{'type': key[0], 'pages': key[1], 'src': key[2],
+                         'dst': key[3], 'bytes': nbytes,
+                         'seconds': round(seconds, 9),
+                         'gbps': self.gbps(key)}
+                        for key, (nbytes, seconds)
+                        in sorted(self.results.items())]}
+
+    @classmethod
+    def from_dict(cls, data):
+        matrix = cls()
+        for result in data.get('results', []):
+            matrix.add(result['type'], result['pages'], result['src'],
+                       result['dst'], result['bytes'], result['seconds'])
+        return matrix
+
+    def write(self, outputdir, name='migration_matrix'):
+        """
+        Writes the matrix as <name>.json and the results, with their
+        comparison to the baseline, as <name>.csv in outputdir.
+        """
+        with open(os.path.join(outputdir, '%s.json' % name), 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
+        with open(os.path.join(outputdir, '%s.csv' % name), 'w',
+                  newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(CSV_FIELDS)
+            for key, (nbytes, seconds) in sorted(self.results.items()):
+                previous, change = self.comparison.get(key, ('', ''))
+                writer.writerow(list(key) + [nbytes, round(seconds, 9),
+                                             self.gbps(key), previous,
+                                             change])
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+ndctl and daxctl inventory snapshot.
+
+The pmem tests used to run 'ndctl list' for every lookup of a region,
+namespace or DIMM, parsing the whole JSON output each time. PMemInventory
+is a PMem taking one 'ndctl list' snapshot of the buses, DIMMs, regions
+and namespaces (idle ones included) and one 'daxctl list' snapshot of the
+dax regions and devices, indexed by name, and serving the lookups from
+them. The snapshots are dropped by the PMem methods changing the
+configuration (enable, disable, create, destroy, reconfigure, ...) and
+taken again at the next lookup. Lookups the snapshot cannot answer, e.g.
+health (-H) or NUMA (-U) filters, still run the command.
+
+Usage::
+
+    plib = PMemInventory(ndctl, daxctl)
+    regions = plib.run_ndctl_list('-R')
+    namespaces = plib.run_ndctl_list('-N -r %s' % region)
+    plib.create_namespace(region=region)
+    ... a configuration change not made with plib ...
+    plib.invalidate()
+"""
+
+import copy
+import json
+import shlex
+
+from avocado.utils import pmem, process
+
+__all__ = ['PMemInventory', 'NDCTL_SNAPSHOT', 'DAXCTL_SNAPSHOT']
+
+# no -u: the sizes stay numbers, and single objects are still listed
+NDCTL_SNAPSHOT = '-BDRNi'
+DAXCTL_SNAPSHOT = '-RDi'
+# ndctl list object flags and the JSON keys nesting them
+KINDS = {'B': 'buses', 'D': 'dimms', 'R': 'regions', 'N': 'namespaces'}
+# PMem methods changing what 'ndctl list' or 'daxctl list' report
+MUTATORS = ('enable_region', 'disable_region', 'enable_namespace',
+            'disable_namespace', 'create_namespace', 'destroy_namespace',
+            'reconfigure_dax_device', 'set_dax_memory_online',
+            'set_dax_memory_offline', 'write_infoblock')
+
+
+def _kind(obj):
+    """Returns the ndctl list flag of a JSON object, None if unknown."""
+    dev = obj.get('dev', '')
+    for prefix, kind in (('ndbus', 'B'), ('nmem', 'D'), ('region', 'R'),
+                         ('namespace', 'N')):
+        if dev.startswith(prefix):
+            return kind
+    return None
+
+
+def _region_name(value):
+    """Returns the region device name of a region name or index."""
+    return 'region%s' % value if value.isdigit() else value
+
+
+def _idle(obj):
+    return obj.get('state') == 'disabled'
+
+
+class PMemInventory(pmem.PMem):
+    """PMem serving 'ndctl list' and 'daxctl list' from snapshots.
+
+    Only the options made of -B, -D, -R, -N, -i and the -r (region) and
+    -n (namespace) filters of a single object type are served, like
+    '-R', '-Ni' or '-N -r region0'; the others run the command.
+    """
+
+    def __init__(self, ndctl="ndctl", daxctl="daxctl"):
+        super().__init__(ndctl, daxctl)
+        self.snapshots = 0
+        self._ndctl = None
+        self._daxctl = None
+
+    def invalidate(self):
+        """Drops the snapshots, e.g. after a change not made with PMem."""
+        self._ndctl = None
+        self._daxctl = None
+
+    def _ndctl_snapshot(self):
+        if self._ndctl is None:
+            inventory = {kind: [] for kind in KINDS}
+            self._index(super().run_ndctl_list(NDCTL_SNAPSHOT), inventory)
+            self._ndctl = inventory
+            self.snapshots += 1
+        return self._ndctl
+
+    def _index(self, node, inventory, region=None):
+        """
+        Adds the objects of an 'ndctl list' JSON tree to inventory, by
+        type, without their nested objects; the namespaces along with the
+        region they are in.
+        """
+        if isinstance(node, list):
+            for item in node:
+                self._index(item, inventory, region)
+            return
+        if not isinstance(node, dict):
+            return
+        kind = _kind(node)
+        if kind:
+            obj = {key: value for key, value in node.items()
+                   if key not in KINDS.values()}
+            if kind == 'R':
+                region = obj['dev']
+            inventory[kind].append((region, obj))
+        for key in KINDS.values():
+            if key in node:
+                self._index(node[key], inventory, region)
+
+    @staticmethod
+    def _parse(option):
+        """
+        Returns the object type, the region and namespace filters and
+        whether idle objects are listed, for the options served from the
+        snapshot, None for the others.
+        """
+        kinds, idle, filters = [], False, {'r': None, 'n': None}
+        tokens = shlex.split(option or '')
+        while tokens:
+            token = tokens.pop(0)
+            if token in ('-r', '--region', '-n', '--namespace'):
+                if not tokens:
+                    return None
+                filters[token.lstrip('-')[0]] = tokens.pop(0)
+            elif token in ('-i', '--idle'):
+                idle = True
+            elif token.startswith('-') and not token.startswith('--') and \
+                    len(token) > 1 and set(token[1:]) <= set('BDRNi'):
+                idle = idle or 'i' in token
+                kinds.extend(flag for flag in token[1:] if flag != 'i')
+            else:
+                return None
+        kinds = set(kinds) or {'N'}
+        # several types are listed nested, and only regions and
+        # namespaces are filtered by region in the snapshot
+        if len(kinds) != 1:
+            return None
+        kind = kinds.pop()
+        if (filters['r'] and kind not in 'RN') or \
+                (filters['n'] and kind != 'N'):
+            return None
+        return kind, filters['r'], filters['n'], idle
+
+    def run_ndctl_list(self, option=""):
+        """
+        Get the json of each provided options, from the snapshot when the
+        options allow it
+
+        :param option: optional arguments to ndctl list command
+        :return: By default returns entire list of json objects
+        :rtype: list of json objects
+        """
+        parsed = self._parse(option)
+        if parsed is None:
+            return super().run_ndctl_list(option)
+        kind, region, namespace, idle = parsed
+        objects = []
+        for parent, obj in self._ndctl_snapshot()[kind]:
+            if not idle and _idle(obj):
+                continue
+            if region and parent != _region_name(region):
+                continue
+            if namespace and obj['dev'] != namespace:
+                continue
+            objects.append(copy.deepcopy(obj))
+        return objects
+
+    def _daxctl_snapshot(self):
+        if self._daxctl is None:
+            devices = []
+            output = process.system_output('%s list %s' % (self.daxctl,
+                                                           DAXCTL_SNAPSHOT))
+            try:
+                regions = json.loads(output)
+            except ValueError:
+                regions = []
+            if isinstance(regions, dict):
+                regions = [regions]
+            for region in regions:
+                for device in region.get('devices', []):
+                    devices.append((str(region.get('id')), device))
+            self._daxctl = devices
+        return self._daxctl
+
+    def run_daxctl_list(self, options=""):
+        """
+        Get the json of each provided options, from the snapshot for the
+        dax devices of all the regions or of one ('-r <id>')
+
+        :param options: optional arguments to daxctl list command
+        :return: By default returns entire list of json objects
+        :rtype: list of json objects
+        """
+        tokens = shlex.split(options or '')
+        region = None
+        if tokens[:1] == ['-D']:
+            tokens.pop(0)
+        if len(tokens) == 2 and tokens[0] in ('-r', '--region'):
+            region = tokens[1].replace('region', '')
+        elif tokens:
+            return super().run_daxctl_list(options)
+        return [copy.deepcopy(device)
+                for parent, device in self._daxctl_snapshot()
+                if not _idle(device) and region in (None, parent)]
+
+
+def _invalidating(name):
+    """Returns the PMem method name dropping the snapshots when called."""
+    method = getattr(pmem.PMem, name)
+
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.invalidate()
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in MUTATORS:
+    setattr(PMemInventory, _name, _invalidating(_name))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Transparent hugepage workload and vmstat sampler.
+
+The THP tests used to fill memory by running one dd per block, thousands
+of processes on large systems, and only read the THP counters before
+and after. MmapWorkload fills anonymous memory, or files of a (tmpfs)
+directory, with large mmap'd writes from a small pool of worker
+processes, and VmstatSampler records the THP, compaction and swap
+counters of /proc/vmstat at a fixed interval in the background, so the
+THP allocation rate and the split and collapse activity under load are
+measured.
+
+Usage::
+
+    sampler = VmstatSampler(interval=0.5)
+    sampler.start()
+    stats = MmapWorkload(size=1 << 30, path='/mnt/thp', file_size=1 << 22,
+                         workers=4).run(timeout=900)
+    sampler.stop()
+    sampler.write(outputdir, 'thp.json', workload=stats)
+"""
+
+import json
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+
+__all__ = ['MmapWorkload', 'VmstatSampler', 'read_vmstat', 'CHUNK']
+
+# bytes written by one mmap slice assignment
+CHUNK = 1 << 20
+# /proc/vmstat counters recorded by the sampler, by prefix
+VMSTAT_PREFIXES = ('thp_', 'nr_anon_transparent_hugepages', 'nr_shmem_huge',
+                   'nr_file_huge', 'compact_', 'pswp')
+
+
+def read_vmstat(prefixes=VMSTAT_PREFIXES):
+    """Returns the /proc/vmstat counters starting with one of prefixes."""
+    counters = {}
+    with open('/proc/vmstat') as vmstat:
+        for line in vmstat:
+            name, _, value = line.partition(' ')
+            if name.startswith(prefixes):
+                counters[name] = int(value)
+    return counters
+
+
+def _buffer(pattern, size):
+    if pattern == 'random':
+        return os.urandom(size)
+    return b'\0' * size
+
+
+def _write(mapping, size, buf, advise):
+    """Writes buf over the first size bytes of mapping."""
+    if advise and hasattr(mapping, 'madvise'):
+        mapping.madvise(mmap.MADV_HUGEPAGE)
+    for offset in range(0, size, len(buf)):
+        length = min(len(buf), size - offset)
+        mapping[offset:offset + length] = buf[:length]
+
+
+def _fill_anon(size, chunk, pattern, advise):
+    """Worker: writes size bytes of a private anonymous mapping."""
+    buf = _buffer(pattern, min(chunk, size))
+    mapping = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+    try:
+        _write(mapping, size, buf, advise)
+    finally:
+        mapping.close()
+    return size
+
+
+def _fill_files(path, first, last, file_size, chunk, pattern, advise):
+    """Worker: creates and writes the files first to last - 1 of path."""
+    buf = _buffer(pattern, min(chunk, file_size))
+    for index in range(first, last):
+        fd = os.open(os.path.join(path, str(index)),
+                     os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, file_size)
+            mapping = mmap.mmap(fd, file_size)
+            try:
+                _write(mapping, file_size, buf, advise)
+            finally:
+                mapping.close()
+        finally:
+            os.close(fd)
+    return (last - first) * file_size
+
+
+class MmapWorkload():
+    """Fills memory with mmap'd writes from a pool of worker processes.
+
+    :param size: bytes to write
+    :param path: directory the files are created in, e.g. a tmpfs mount
+                 point, None to write anonymous memory
+    :param file_size: size of each file, CHUNK by default; size is
+                      rounded down to a multiple of it, and the anonymous
+                      mappings are multiples of it too
+    :param workers: number of worker processes
+    :param pattern: 'zero' or 'random' data
+    :param advise: marks the mappings MADV_HUGEPAGE
+    :param chunk: bytes written at once
+    """
+
+    def __init__(self, size, path=None, file_size=None, workers=4,
+                 pattern='zero', advise=True, chunk=CHUNK):
+        self.path = path
+        self.file_size = int(file_size or chunk)
+        self.count = int(size) // self.file_size
+        self.size = self.count * self.file_size
+        self.workers = max(1, int(workers))
+        self.pattern = pattern
+        self.advise = advise
+        self.chunk = int(chunk)
+
+    def jobs(self):
+        """Returns the (function, arguments) of the worker jobs."""
+        # a few batches per worker, to balance without a job per file
+        batch = max(1, -(-self.count // (self.workers * 4)))
+        if self.path is None:
+            return [(_fill_anon, ((min(first + batch, self.count) - first) *
+                                  self.file_size, self.chunk, self.pattern,
+                                  self.advise))
+                    for first in range(0, self.count, batch)]
+        return [(_fill_files, (self.path, first,
+                               min(first + batch, self.count),
+                               self.file_size, self.chunk, self.pattern,
+                               self.advise))
+                for first in range(0, self.count, batch)]
+
+    def run(self, timeout=None):
+        """
+        Writes the memory, returns the bytes written, the time it took
+        and the write rate in GB/s. Raises ValueError when the files do
+        not fit in path (a full tmpfs kills the writer with SIGBUS), and
+        multiprocessing.TimeoutError when the workers did not finish in
+        timeout seconds.
+        """
+        if self.path is not None:
+            stat = os.statvfs(self.path)
+            if self.size > stat.f_bavail * stat.f_frsize:
+                raise ValueError('%d bytes do not fit in %s'
+                                 % (self.size, self.path))
+        start = time.time()
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            results = [pool.apply_async(func, args)
+                       for func, args in self.jobs()]
+            deadline = None if timeout is None else start + timeout
+            written = 0
+            for result in results:
+                remaining = None if deadline is None else \
+                    max(deadline - time.time(), 0)
+                written += result.get(remaining)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        seconds = time.time() - start
+        return {'bytes': written, 'files': self.count if self.path else 0,
+                'workers': self.workers, 'seconds': round(seconds, 3),
+                'gbps': round(written / seconds / 1e9, 3) if seconds else None}
+
+
+class VmstatSampler():
+    """Records /proc/vmstat counters every interval seconds until stopped.
+
+    :param interval: seconds between samples
+    :param prefixes: prefixes of the counters recorded
+    """
+
+    def __init__(self, interval=1.0, prefixes=VMSTAT_PREFIXES):
+        self.interval = float(interval)
+        self.prefixes = prefixes
+        # (seconds since start, counters)
+        self.samples = []
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        self.samples.append((round(time.time() - self._start, 3),
+                             read_vmstat(self.prefixes)))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._start = time.time()
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run,
+                                        name='vmstat-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling, after a last sample."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.sample()
+
+    def deltas(self):
+        """Returns the change of each counter from the first sample on."""
+        if not self.samples:
+            return {}
+        first, last = self.samples[0][1], self.samples[-1][1]
+        return {name: last[name] - first.get(name, 0) for name in last}
+
+    def rates(self):
+        """Returns the average change per second of each counter."""
+        if len(self.samples) < 2 or not self.samples[-1][0]:
+            return {}
+        seconds = self.samples[-1][0]
+        return {name: round(delta / seconds, 3)
+                for name, delta in self.deltas().items()}
+
+    def series(self, name):
+        """Returns the (seconds, change since start) samples of name."""
+        if not self.samples:
+            return []
+        first = self.samples[0][1].get(name, 0)
+        return [(seconds, counters.get(name, 0) - first)
+                for seconds, counters in self.samples]
+
+    def to_dict(self):
+        return {'interval': self.interval, 'deltas': self.deltas(),
+                'rates': self.rates(),
+                'samples': [dict(seconds=seconds, **counters)
+                            for seconds, counters in self.samples]}
+
+    def write(self, outputdir, name='vmstat.json', **extra):
+        """
+        Writes the samples as JSON in outputdir with the extra values,
+        e.g. the workload statistics, returns its path.
+        """
+        data = dict(extra)
+        data['vmstat'] = self.to_dict()
+        path = os.path.join(outputdir, name)
+        with open(path, 'w') as output:
+            json.dump(data, output, indent=2)
+        return path
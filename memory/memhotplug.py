@@ -15,13 +15,19 @@
 
 import os
 import glob
+import json
 import re
+import time
+import collections
+import contextlib
 import multiprocessing
 from avocado.utils import cpu
 from avocado import Test
-from avocado.utils import process, memory, build, archive, dmesg
+from avocado.utils import process, memory, build, archive
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from common_api.kmsg import KmsgWatcher
+
 
 MEM_PATH = '/sys/devices/system/memory'
 ERRORLOG = ['WARNING: CPU:', 'Oops',
@@ -33,6 +39,8 @@ ERRORLOG = ['WARNING: CPU:', 'Oops',
             'INFO: possible recursive locking detected',
             'Kernel BUG at', 'Kernel panic - not syncing:',
             'double fault:', 'BUG: Bad page state in']
+# upper bounds (ms) of the offline/online latency histogram buckets
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
 
 
 def online(block):
@@ -70,6 +78,140 @@ def get_hotpluggable_blocks(path, ratio):
     return mem_blocks[:count]
 
 
+def block_node(block):
+    """Returns the NUMA node of a memory block, None when unknown."""
+    nodes = glob.glob('%s/memory%s/node[0-9]*' % (MEM_PATH, block))
+    if not nodes:
+        return None
+    return int(re.findall(r'\d+', os.path.basename(nodes[0]))[0])
+
+
+def block_online(block):
+    """Returns whether the state of a block reads online, without polling."""
+    with open('%s/memory%s/state' % (MEM_PATH, block), 'r') as state_file:
+        return state_file.read().strip() == 'online'
+
+
+def timed_state(block, action):
+    """
+    Writes action (offline or online) to the state of a block, returns
+    the seconds the write took and whether the block is in that state
+    once it returned.
+
+    The state is written and read back directly, memory.hotplug() and
+    memory.hotunplug() poll it for up to 10s, which would be timed too.
+    """
+    start = time.monotonic()
+    try:
+        with open('%s/memory%s/state' % (MEM_PATH, block),
+                  'w') as state_file:
+            state_file.write(action)
+    except IOError:
+        return time.monotonic() - start, False
+    took = time.monotonic() - start
+    return took, block_online(block) == (action == 'online')
+
+
+def histogram(latencies, buckets=LATENCY_BUCKETS):
+    """Returns the number of latencies (ms) per bucket, by bucket label."""
+    counts = collections.OrderedDict(('<=%sms' % bound, 0)
+                                     for bound in buckets)
+    counts['>%sms' % buckets[-1]] = 0
+    for latency in latencies:
+        for bound in buckets:
+            if latency <= bound:
+                counts['<=%sms' % bound] += 1
+                break
+        else:
+            counts['>%sms' % buckets[-1]] += 1
+    return counts
+
+
+def percentile(values, percent):
+    """Returns the nearest rank percentile of values, None if empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def summarize(records, block_size, seconds, buckets=LATENCY_BUCKETS):
+    """
+    Returns the statistics of (block, node, seconds, done) records of
+    one action: success rate per node, latencies of the successful
+    changes (ms) and their histogram, and the GB/s changed over seconds.
+    """
+    latencies = [round(took * 1000, 3) for _, _, took, done in records
+                 if done]
+    nodes = {}
+    for _, node, _, done in records:
+        stats = nodes.setdefault(str(node), {'attempts': 0, 'done': 0})
+        stats['attempts'] += 1
+        stats['done'] += int(done)
+    for stats in nodes.values():
+        stats['success_rate'] = round(stats['done'] * 100.0 /
+                                      stats['attempts'], 2)
+    return {'attempts': len(records), 'done': len(latencies),
+            'seconds': round(seconds, 3),
+            'gbps': round(len(latencies) * block_size / seconds / 1e9, 3)
+            if seconds else None,
+            'latency_ms': {'min': min(latencies) if latencies else None,
+                           'p50': percentile(latencies, 50),
+                           'p90': percentile(latencies, 90),
+                           'p99': percentile(latencies, 99),
+                           'max': max(latencies) if latencies else None},
+            'histogram': histogram(latencies, buckets), 'nodes': nodes}
+
+
+class BackgroundStress():
+    """Runs a stress command line, with sudo, until stopped.
+
+    :param cmd: stress command line
+    :param log: logger of the calling test
+    :param min_time: seconds of load stop() waits for since the start
+    """
+
+    def __init__(self, cmd, log, min_time=0):
+        self.cmd = cmd
+        self.log = log
+        self.min_time = min_time
+        self.proc = None
+        self.started = None
+        self.restarts = 0
+
+    def start(self):
+        self.proc = process.SubProcess(self.cmd, shell=True, sudo=True)
+        self.proc.start()
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def check(self):
+        """Restarts the stress when it exited, e.g. on its timeout."""
+        if self.proc is not None and not self.running():
+            self.log.info("stress exited with %s, restarting",
+                          self.proc.poll())
+            self.restarts += 1
+            self.start()
+
+    def stop(self):
+        """
+        Waits for min_time seconds of load, then kills the process
+        tree, the stress workers included.
+        """
+        if self.proc is None:
+            return
+        remaining = self.min_time - (time.monotonic() - self.started)
+        if remaining > 0 and self.running():
+            time.sleep(remaining)
+        if self.running():
+            process.kill_process_tree(self.proc.get_pid())
+        self.proc.wait()
+        self.proc = None
+
+
 def collect_dmesg(object):
     object.whiteboard = process.system_output("dmesg")
 
@@ -87,6 +229,7 @@ class MemStress(Test):
        5. shared resource : dlpar in CMO mode
        6. try hotplug each different numa node memblocks
        7. run stress memory in background
+       8. benchmark per block offline/online latency
 
     :avocado: tags=memory,privileged
     '''
@@ -121,12 +264,23 @@ class MemStress(Test):
         self.vmcount = self.params.get('vmcount', default=4)
         self.iocount = self.params.get('iocount', default=4)
         self.memratio = self.params.get('memratio', default=5)
+        # 'sync' runs stress between the hotplug steps, 'background'
+        # runs it during the whole hotplug sequence
+        self.stress_mode = self.params.get('stress_mode', default='sync')
+        self.stress_timeout = self.params.get('bench_stress_timeout',
+                                              default=3600)
+        self.stress = None
+        self.bench_stress = self.params.get('bench_stress', default=True)
+        buckets = self.params.get('latency_buckets_ms', default=None)
+        self.buckets = LATENCY_BUCKETS
+        if buckets:
+            self.buckets = [int(bound) for bound in str(buckets).split()]
         self.blocks_hotpluggable = get_hotpluggable_blocks(
             (os.path.join('%s', 'memory*') % MEM_PATH), self.memratio)
         if os.path.exists("%s/auto_online_blocks" % MEM_PATH):
             if not self.__is_auto_online():
                 self.hotplug_all(self.blocks_hotpluggable)
-        dmesg.clear_dmesg()
+        self.kmsg = KmsgWatcher(ERRORLOG)
 
     def hotunplug_all(self, blocks):
         for block in blocks:
@@ -150,47 +304,157 @@ class MemStress(Test):
             return False
 
     def __error_check(self):
-        err_list = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4").splitlines()
-        for error in ERRORLOG:
-            for log in logs:
-                if error in log.decode():
-                    err_list.append(log)
-        if "\n".join(err_list):
+        err_list = self.kmsg.check()
+        if err_list:
+            for record in err_list:
+                self.log.error(record)
             collect_dmesg(self)
             self.fail('ERROR: Test failed, please check the dmesg logs')
 
-    def run_stress(self):
+    def stress_cmd(self, timeout):
         mem_free = memory.meminfo.MemFree.m // 4
         cpu_count = int(multiprocessing.cpu_count()) // 2
-        process.run("stress --cpu %s --io %s --vm %s --vm-bytes %sM --timeout %ss" %
-                    (cpu_count, self.iocount, self.vmcount,
-                     mem_free, self.stresstime), ignore_status=True,
+        return ("stress --cpu %s --io %s --vm %s --vm-bytes %sM "
+                "--timeout %ss" %
+                (cpu_count, self.iocount, self.vmcount, mem_free, timeout))
+
+    def run_stress(self):
+        if self.stress is not None:
+            # the hotplug steps overlap the background stress
+            self.stress.check()
+            return
+        process.run(self.stress_cmd(self.stresstime), ignore_status=True,
                     sudo=True, shell=True)
 
+    def background_stress(self, min_time=0):
+        """Returns a started BackgroundStress."""
+        stress = BackgroundStress(self.stress_cmd(self.stress_timeout),
+                                  self.log, min_time)
+        stress.start()
+        return stress
+
+    @contextlib.contextmanager
+    def stress_load(self):
+        """
+        In background stress mode, runs stress during the block, for at
+        least stresstime seconds, run_stress() then only restarts it
+        when it exited. Does nothing in sync mode.
+        """
+        if self.stress_mode != 'background':
+            yield
+            return
+        self.log.info("Starting the background stress")
+        self.stress = self.background_stress(self.stresstime)
+        try:
+            yield
+        finally:
+            self.stress.stop()
+            self.log.info("Background stress stopped, restarted %d times",
+                          self.stress.restarts)
+            self.stress = None
+
+    def hotplug_benchmark(self, block_nodes, block_size):
+        """
+        Offlines the online blocks of block_nodes one by one, then
+        onlines the ones offlined, timing each block, returns the
+        summaries of both actions.
+        """
+        offlined = []
+        start = time.monotonic()
+        for block, node in block_nodes.items():
+            if block_online(block):
+                took, done = timed_state(block, 'offline')
+                offlined.append((block, node, took, done))
+        offline_seconds = time.monotonic() - start
+        onlined = []
+        start = time.monotonic()
+        for block, node, _, done in offlined:
+            if done:
+                took, done = timed_state(block, 'online')
+                onlined.append((block, node, took, done))
+        online_seconds = time.monotonic() - start
+        return {'offline': summarize(offlined, block_size, offline_seconds,
+                                     self.buckets),
+                'online': summarize(onlined, block_size, online_seconds,
+                                    self.buckets)}
+
+    def log_benchmark(self, phase, results):
+        for action in ('offline', 'online'):
+            stats = results[action]
+            self.log.info("%s %s: %d/%d blocks, %s GB/s, latency ms p50 %s "
+                          "p90 %s p99 %s max %s", phase, action,
+                          stats['done'], stats['attempts'], stats['gbps'],
+                          stats['latency_ms']['p50'],
+                          stats['latency_ms']['p90'],
+                          stats['latency_ms']['p99'],
+                          stats['latency_ms']['max'])
+            for bucket, count in stats['histogram'].items():
+                self.log.info("  %9s %6d %s", bucket, count,
+                              '#' * min(count, 60))
+            for node, node_stats in sorted(stats['nodes'].items()):
+                self.log.info("  node %s: %d/%d (%s%%)", node,
+                              node_stats['done'], node_stats['attempts'],
+                              node_stats['success_rate'])
+
     def test_hotplug_loop(self):
         self.log.info("\nTEST: hotunplug and hotplug in a loop\n")
+        with self.stress_load():
+            for _ in range(self.iteration):
+                self.log.info("\nhotunplug all memory\n")
+                self.hotunplug_all(self.blocks_hotpluggable)
+                self.run_stress()
+                self.log.info("\nReclaim back memory\n")
+                self.hotplug_all(self.blocks_hotpluggable)
+        self.__error_check()
+
+    def test_hotplug_benchmark(self):
+        """
+        Measures the offline and online latency of each block, the
+        offline success rate per NUMA node and the GB/s removed and
+        added, idle and under the background stress load
+        """
+        if self.stress_mode == 'background':
+            self.cancel("benchmark runs its own stress phase, skipping "
+                        "the duplicate background stress_mode variant")
+        self.log.info("\nTEST: hotplug latency and throughput\n")
+        with open('%s/block_size_bytes' % MEM_PATH, 'r') as size_file:
+            block_size = int(size_file.read().strip(), 16)
+        block_nodes = collections.OrderedDict(
+            (block, block_node(block)) for block in self.blocks_hotpluggable)
+        report = {'block_size': block_size, 'blocks': len(block_nodes),
+                  'buckets_ms': list(self.buckets), 'phases': {}}
         for _ in range(self.iteration):
-            self.log.info("\nhotunplug all memory\n")
-            self.hotunplug_all(self.blocks_hotpluggable)
-            self.run_stress()
-            self.log.info("\nReclaim back memory\n")
-            self.hotplug_all(self.blocks_hotpluggable)
+            results = self.hotplug_benchmark(block_nodes, block_size)
+            self.log_benchmark('idle', results)
+            report['phases'].setdefault('idle', []).append(results)
+            if not self.bench_stress:
+                continue
+            stress = self.background_stress()
+            try:
+                results = self.hotplug_benchmark(block_nodes, block_size)
+            finally:
+                stress.stop()
+            self.log_benchmark('stress', results)
+            report['phases'].setdefault('stress', []).append(results)
+        with open(os.path.join(self.outputdir, 'hotplug_bench.json'),
+                  'w') as output:
+            json.dump(report, output, indent=2)
         self.__error_check()
 
     def test_hotplug_toggle(self):
         self.log.info("\nTEST: Memory toggle\n")
-        for _ in range(self.iteration):
-            for block in self.blocks_hotpluggable:
-                err = offline(block)
-                if err:
-                    self.log.error(err)
-                self.log.info("memory%s block hotunplugged", block)
-                self.run_stress()
-                err = online(block)
-                if err:
-                    self.log.error(err)
-                self.log.info("memory%s block hotplugged", block)
+        with self.stress_load():
+            for _ in range(self.iteration):
+                for block in self.blocks_hotpluggable:
+                    err = offline(block)
+                    if err:
+                        self.log.error(err)
+                    self.log.info("memory%s block hotunplugged", block)
+                    self.run_stress()
+                    err = online(block)
+                    if err:
+                        self.log.error(err)
+                    self.log.info("memory%s block hotplugged", block)
         self.__error_check()
 
     def test_dlpar_mem_hotplug(self):
@@ -198,15 +462,17 @@ class MemStress(Test):
             if b"mem_dlpar=yes" in process.system_output("drmgr -C",
                                                          ignore_status=True, shell=True):
                 self.log.info("\nDLPAR remove memory operation\n")
-                for _ in range(len(self.blocks_hotpluggable) // 2):
-                    process.run(
-                        "drmgr -c mem -d 5 -w 30 -r", shell=True,
-                        ignore_status=True, sudo=True)
-                self.run_stress()
-                self.log.info("\nDLPAR add memory operation\n")
-                for _ in range(len(self.blocks_hotpluggable) // 2):
-                    process.run(
-                        "drmgr -c mem -d 5 -w 30 -a", shell=True, ignore_status=True, sudo=True)
+                with self.stress_load():
+                    for _ in range(len(self.blocks_hotpluggable) // 2):
+                        process.run(
+                            "drmgr -c mem -d 5 -w 30 -r", shell=True,
+                            ignore_status=True, sudo=True)
+                    self.run_stress()
+                    self.log.info("\nDLPAR add memory operation\n")
+                    for _ in range(len(self.blocks_hotpluggable) // 2):
+                        process.run(
+                            "drmgr -c mem -d 5 -w 30 -a", shell=True,
+                            ignore_status=True, sudo=True)
                 self.__error_check()
             else:
                 self.log.info('UNSUPPORTED: dlpar not configured..')
@@ -217,19 +483,23 @@ class MemStress(Test):
         self.log.info("\nTEST: Numa Node memory off on\n")
         with open('/sys/devices/system/node/has_normal_memory', 'r') as node_file:
             nodes = node_file.read()
-        for node in re.split("[,-]", nodes):
-            node = node.strip('\n')
-            self.log.info("Hotplug all memory in Numa Node %s", node)
-            mem_blocks = get_hotpluggable_blocks((
-                '/sys/devices/system/node/node%s/memory[0-9]*' % node), self.memratio)
-            for block in mem_blocks:
-                self.log.info(
-                    "offline memory%s in numa node%s", block, node)
-                err = offline(block)
-                if err:
-                    self.log.error(err)
-            self.run_stress()
+        with self.stress_load():
+            for node in re.split("[,-]", nodes):
+                node = node.strip('\n')
+                self.log.info("Hotplug all memory in Numa Node %s", node)
+                mem_blocks = get_hotpluggable_blocks((
+                    '/sys/devices/system/node/node%s/memory[0-9]*' % node),
+                    self.memratio)
+                for block in mem_blocks:
+                    self.log.info(
+                        "offline memory%s in numa node%s", block, node)
+                    err = offline(block)
+                    if err:
+                        self.log.error(err)
+                self.run_stress()
         self.__error_check()
 
     def tearDown(self):
         self.hotplug_all(self.blocks_hotpluggable)
+        if hasattr(self, 'kmsg'):
+            self.kmsg.close()
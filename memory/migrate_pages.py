@@ -23,6 +23,10 @@ from avocado import Test
 from avocado.utils import process, build, memory, distro
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from mem_api.migration_matrix import (MigrationMatrix,
+                                      format_regressions,
+                                      load_baseline, node_pairs)
+
 
 class MigratePages(Test):
     """
@@ -31,6 +35,8 @@ class MigratePages(Test):
     2) hugepages
     3) hugepages with overcommit
     4) transparent hugepages
+    In benchmark mode the chunks are moved between every pair of nodes
+    and the move_pages bandwidth is reported as a node matrix.
     :avocado: tags=memory,hugepage,migration
     """
 
@@ -43,8 +49,11 @@ class MigratePages(Test):
         self.hpage = self.params.get('h_page', default=False)
         self.hpage_commit = self.params.get('h_commit', default=False)
         self.thp = self.params.get('thp', default=False)
+        self.bench = self.params.get('bench', default=False)
+        self.baseline = self.params.get('baseline', default=None)
+        self.tolerance = float(self.params.get('tolerance', default=10))
 
-        nodes = memory.numa_nodes_with_memory()
+        self.nodes = nodes = memory.numa_nodes_with_memory()
         if len(nodes) < 2:
             self.cancel('Test requires two numa nodes to run.'
                         'Node list with memory: %s' % nodes)
@@ -101,8 +110,47 @@ class MigratePages(Test):
         elif self.thp:
             cmd += ' -t'
 
+        if self.bench:
+            self.benchmark(cmd)
+            return
         ret = process.system(cmd, shell=True, sudo=True, ignore_status=True)
         if ret == 255:
             self.cancel("Environment prevents test! Check logs for node data")
         elif ret != 0:
             self.fail('Please check the logs for failure')
+
+    def benchmark(self, cmd):
+        """
+        Runs cmd for every pair of nodes and reports the move_pages
+        bandwidth as a node matrix, compared with a baseline when given
+        """
+        page_size = memory.get_page_size()
+        if self.hpage:
+            page_size = memory.get_huge_page_size() * 1024
+        matrix = MigrationMatrix()
+        failures = []
+        for src, dst in node_pairs(self.nodes):
+            pair_cmd = '%s -s %s -d %s' % (cmd, src, dst)
+            result = process.run(pair_cmd, shell=True, sudo=True,
+                                 ignore_status=True)
+            if result.exit_status == 255:
+                self.log.warn("Not enough memory to move from node %s to "
+                              "%s, skipped", src, dst)
+            elif result.exit_status or \
+                    not matrix.add_output(result.stdout_text,
+                                          page_size=page_size):
+                failures.append(pair_cmd)
+        for page_type, count in matrix.series():
+            for line in matrix.format(page_type, count):
+                self.log.info(line)
+        regressions = []
+        if self.baseline:
+            regressions = matrix.compare(load_baseline(self.baseline),
+                                         self.tolerance)
+        matrix.write(self.outputdir)
+        if failures:
+            self.fail('Migration failed: %s' % ', '.join(failures))
+        if regressions:
+            self.fail('Migration bandwidth below the baseline by more than '
+                      '%s%%: %s' % (self.tolerance,
+                                    format_regressions(regressions)))
@@ -4,6 +4,7 @@
 #include <stdlib.h>
 #include <unistd.h>
 #include <fcntl.h>
+#include <time.h>
 #include <numa.h>
 #include <numaif.h>
 #ifdef HAVE_HUGETLB_HEADER
@@ -22,6 +23,8 @@
 unsigned long total_mem = 0;
 int max_node;
 int nodes_to_use[2];
+/* source and destination nodes given with -s and -d */
+int src_node = -1, dst_node = -1;
 
 /* Does mmap for given size and returns address*/
 void *mmap_memory(unsigned long size, int hugepage)
@@ -64,6 +67,21 @@ void get_numa_nodes_to_use(unsigned long memory_to_use)
 	unsigned long free_node_sizes;
 	long node_size;
 	int node_iterator, got_nodes = 0;
+	if (src_node >= 0 && dst_node >= 0) {
+		nodes_to_use[0] = src_node;
+		nodes_to_use[1] = dst_node;
+		for (node_iterator = 0; node_iterator < 2; node_iterator++) {
+			node_size = numa_node_size(nodes_to_use[node_iterator],
+						   &free_node_sizes);
+			if (node_size == -1 || free_node_sizes <= memory_to_use) {
+				printf("Not enough free memory in node %d\n",
+				       nodes_to_use[node_iterator]);
+				exit(255);
+			}
+		}
+		printf("Nodes used in test %d %d \n", nodes_to_use[0], nodes_to_use[1]);
+		return;
+	}
 	/* Get 2 Nodes which contains given memory of total system*/
 	for(node_iterator=0; node_iterator <= max_node; node_iterator++){
 		node_size = numa_node_size(node_iterator,&free_node_sizes);
@@ -186,6 +204,8 @@ void write_read_pattern_numa_migration(unsigned long unit_memory, unsigned long
 		unsigned long npages = 0, pages_numa_map = 0;
 		int mbind_status, *status, *nodes;
 	        void **addrs;
+		struct timespec ts_start, ts_end;
+		double seconds;
 		/* Determine No of Pages */
 		npages = memory_to_use / page_size;
 		if (memory_to_use % page_size)
@@ -263,11 +283,18 @@ void write_read_pattern_numa_migration(unsigned long unit_memory, unsigned long
 	                nodes[j] = nodes_to_use[1];
 	                status[j] = 0;
 	        }
+		clock_gettime(CLOCK_MONOTONIC, &ts_start);
 		mbind_status = move_pages(0, npages, addrs, nodes, status, MPOL_MF_MOVE_ALL); 
+		clock_gettime(CLOCK_MONOTONIC, &ts_end);
 		if(mbind_status){
 	                perror("mbind() fails");
 	                exit(-1);
 	        }
+		seconds = ts_end.tv_sec - ts_start.tv_sec +
+			  (ts_end.tv_nsec - ts_start.tv_nsec) / 1e9;
+		printf("RESULT type=%s src=%d dst=%d bytes=%lu seconds=%.9f\n",
+		       hugepage ? "hugetlb" : thp ? "thp" : "base",
+		       nodes_to_use[0], nodes_to_use[1], memory_to_use, seconds);
 		/* Read Patterns from Node 2 */
 	        printf("Lock all mapped memory %p till\n", mmap_pointer[i]);
 		lock_mem(mmap_pointer[i], memory_to_use);
@@ -324,11 +351,17 @@ int main(int argc, char *argv[])
         memory = (total_mem * 10) / 100;
 
         /* TODO: get no.of pages and work with those instead of memory*/
-        while ((c = getopt(argc, argv, "n:oth")) != -1) {
+        while ((c = getopt(argc, argv, "n:s:d:oth")) != -1) {
                 switch(c) {
                 case 'n':
 			chunks = strtoul(optarg, NULL, 10);
                         break;
+                case 's':
+			src_node = strtol(optarg, NULL, 10);
+                        break;
+                case 'd':
+			dst_node = strtol(optarg, NULL, 10);
+                        break;
                 case 't':
 			thp = 1;
                         break;
@@ -345,9 +378,9 @@ int main(int argc, char *argv[])
 #endif
                 default:
 #ifdef HAVE_HUGETLB_HEADER
-                        errmsg("%s [-n <no-of-chunks] [-t fot THP] [-o for hugepage-overcommit] [-h for hugepage]\n", argv[0]);
+                        errmsg("%s [-n <no-of-chunks] [-s <source node>] [-d <destination node>] [-t fot THP] [-o for hugepage-overcommit] [-h for hugepage]\n", argv[0]);
 #else
-                        errmsg("%s [-n <no-of-chunks] [-t fot THP]\n", argv[0]);
+                        errmsg("%s [-n <no-of-chunks] [-s <source node>] [-d <destination node>] [-t fot THP]\n", argv[0]);
 #endif
                         break;
                 }
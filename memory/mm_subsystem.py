@@ -21,9 +21,14 @@ from avocado.utils import memory
 from avocado.utils import process
 from avocado.utils import git
 from avocado.utils import distro
-from avocado.utils import dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from common_api.kmsg import KmsgWatcher
+
+ERRORLOG = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
+            'ard LOCKUP', 'Unable to handle paging request',
+            'rcu_sched detected stalls', 'NMI backtrace for cpu']
+
 
 class MmSubsystemTest(Test):
     '''
@@ -31,19 +36,9 @@ class MmSubsystemTest(Test):
 
     :avocado: tags=memory
     '''
-    @staticmethod
-    def check_dmesg():
-        errorlog = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
-                    'ard LOCKUP', 'Unable to handle paging request',
-                    'rcu_sched detected stalls', 'NMI backtrace for cpu']
-        err = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4"
-                                     "").decode("utf-8").splitlines()
-        for error in errorlog:
-            for log in logs:
-                if error in log:
-                    err.append(log)
-        return "\n".join(err)
+
+    def check_dmesg(self):
+        return "\n".join(str(record) for record in self.kmsg.check())
 
     def setUp(self):
         """
@@ -91,6 +86,7 @@ class MmSubsystemTest(Test):
 
         for item in rm_list:
             self.test_dic.pop(item)
+        self.kmsg = KmsgWatcher(ERRORLOG)
 
     def test(self):
         """
@@ -100,7 +96,6 @@ class MmSubsystemTest(Test):
         fail_msg = []
         self.log.info("Tests to be run are %s", self.test_dic)
         for cnt in list(self.test_dic.keys()):
-            dmesg.clear_dmesg()
             if process.system("./random %s" % cnt, ignore_status=True):
                 failed.append(cnt)
 
@@ -113,3 +108,7 @@ class MmSubsystemTest(Test):
             self.log.info('ERROR in dmesg:  %s', fail_msg)
             self.log.info('Tests failed:  %s', failed)
             self.fail('Test failed, please check above for failures')
+
+    def tearDown(self):
+        if hasattr(self, 'kmsg'):
+            self.kmsg.close()
@@ -38,6 +38,8 @@ from avocado.utils import git
 from avocado.utils.git import GitRepoHelper
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from mem_api.pmem_inventory import PMemInventory
+
 
 class NdctlTest(Test):
 
@@ -280,7 +282,10 @@ class NdctlTest(Test):
         self.modes = ['raw', 'sector', 'fsdax', 'devdax']
         self.part = None
         self.disk = None
-        self.plib = pmem.PMem(self.ndctl, self.daxctl)
+        if self.params.get('inventory_cache', default=True):
+            self.plib = PMemInventory(self.ndctl, self.daxctl)
+        else:
+            self.plib = pmem.PMem(self.ndctl, self.daxctl)
         if not self.plib.check_buses():
             self.cancel("Test needs at least one region")
 
@@ -1089,7 +1094,7 @@ class NdctlTest(Test):
             except pmem.PMemException:
                 self.fail("Namespace creation with mode %s and 1GB alignment"
                           " must have failed!" % mode)
-        process.system('ndctl destroy-namespace all -f')
+        self.plib.destroy_namespace(force=True)
 
     @avocado.fail_on(pmem.PMemException)
     def test_daxctl_1gb_alignment_memhotplug_unplug(self):
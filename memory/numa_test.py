@@ -24,6 +24,12 @@ from avocado import skipIf
 from avocado.utils import process, build, memory, distro, genio
 from avocado.utils.software_manager.manager import SoftwareManager
 
+from mem_api.migration_matrix import (MigrationMatrix,
+                                      format_regressions,
+                                      load_baseline, node_pairs)
+
+NODE_HUGEPAGES = ('/sys/devices/system/node/node%s/hugepages/'
+                  'hugepages-%skB/nr_hugepages')
 SINGLE_NODE = len(memory.numa_nodes_with_memory()) < 2
 
 
@@ -39,6 +45,16 @@ class NumaTest(Test):
         shutil.copyfile(self.get_data(file_name),
                         os.path.join(self.teststmpdir, file_name))
 
+    @staticmethod
+    def thp_enabled():
+        """Returns True when THP is enabled (always or madvise)."""
+        thp = "/sys/kernel/mm/transparent_hugepage/enabled"
+        if not os.path.isfile(thp):
+            return False
+        thp_file = genio.read_file(thp)
+        return "[always] madvise" in thp_file or \
+            "always [madvise] never" in thp_file
+
     def setUp(self):
         smm = SoftwareManager()
         dist = distro.detect()
@@ -119,19 +135,95 @@ class NumaTest(Test):
         """
         Test PFN's before and after offlining
         """
-        thp = "/sys/kernel/mm/transparent_hugepage/enabled"
-        if os.path.isfile(thp):
-            thp_file = genio.read_file(thp)
-            if "[always] madvise" in thp_file or "always [madvise] never" in thp_file:
-                self.nr_pages = self.params.get('nr_pages', default=100)
-                os.chdir(self.teststmpdir)
-                self.log.info("Starting test...")
-                cmd = './bench_movepages -n %s' % self.nr_pages
-                ret = process.system(
-                    cmd, shell=True, sudo=True, ignore_status=True)
-                if ret != 0:
-                    self.fail('Please check the logs for failure')
-            else:
-                self.cancel("THP migration is not enabled on the system")
-        else:
+        if not self.thp_enabled():
             self.cancel("THP migration is not enabled on the system")
+        self.nr_pages = self.params.get('nr_pages', default=100)
+        os.chdir(self.teststmpdir)
+        self.log.info("Starting test...")
+        cmd = './bench_movepages -n %s' % self.nr_pages
+        ret = process.system(
+            cmd, shell=True, sudo=True, ignore_status=True)
+        if ret != 0:
+            self.fail('Please check the logs for failure')
+
+    def reserve_hugepages(self, nodes, count):
+        """
+        Adds count hugepages to the pool of each node, returns the
+        previous pool sizes, None when they could not all be reserved.
+        """
+        hp_size = memory.get_huge_page_size()
+        previous = {}
+        for node in nodes:
+            path = NODE_HUGEPAGES % (node, hp_size)
+            previous[node] = int(genio.read_file(path).strip())
+            genio.write_file(path, str(previous[node] + count))
+        for node in nodes:
+            path = NODE_HUGEPAGES % (node, hp_size)
+            if int(genio.read_file(path).strip()) < previous[node] + count:
+                self.restore_hugepages(previous)
+                return None
+        return previous
+
+    @staticmethod
+    def restore_hugepages(previous):
+        hp_size = memory.get_huge_page_size()
+        for node, count in previous.items():
+            genio.write_file(NODE_HUGEPAGES % (node, hp_size), str(count))
+
+    @skipIf(SINGLE_NODE, "Test requires two numa nodes to run")
+    def test_migration_matrix(self):
+        """
+        Benchmarks move_pages from every memory node to every other one,
+        for each page type and page count, into a matrix of GB/s written
+        as JSON and CSV, and compares it with a baseline when given
+        """
+        counts = [int(count) for count in str(self.params.get(
+            'bench_nr_pages', default='10 100')).split()]
+        types = str(self.params.get('bench_page_types',
+                                    default='base thp hugetlb')).split()
+        baseline = self.params.get('baseline', default=None)
+        tolerance = float(self.params.get('tolerance', default=10))
+        nodes = memory.numa_nodes_with_memory()
+        if 'thp' in types and not self.thp_enabled():
+            self.log.warn("THP is not enabled, skipping THP migration")
+            types.remove('thp')
+        previous = {}
+        if 'hugetlb' in types:
+            previous = self.reserve_hugepages(nodes, max(counts))
+            if previous is None:
+                self.log.warn("Unable to reserve %s hugepages per node, "
+                              "skipping hugetlb migration", max(counts))
+                types.remove('hugetlb')
+                previous = {}
+
+        os.chdir(self.teststmpdir)
+        matrix = MigrationMatrix()
+        failures = []
+        try:
+            for page_type in types:
+                for count in counts:
+                    for src, dst in node_pairs(nodes):
+                        cmd = './bench_movepages -n %s -s %s -d %s -t %s' % (
+                            count, src, dst, page_type)
+                        result = process.run(cmd, shell=True, sudo=True,
+                                             ignore_status=True)
+                        if result.exit_status or \
+                                not matrix.add_output(result.stdout_text,
+                                                      pages=count):
+                            failures.append(cmd)
+        finally:
+            self.restore_hugepages(previous)
+
+        for page_type, count in matrix.series():
+            for line in matrix.format(page_type, count):
+                self.log.info(line)
+        regressions = []
+        if baseline:
+            regressions = matrix.compare(load_baseline(baseline), tolerance)
+        matrix.write(self.outputdir)
+        if failures:
+            self.fail('Migration failed: %s' % ', '.join(failures))
+        if regressions:
+            self.fail('Migration bandwidth below the baseline by more than '
+                      '%s%%: %s' % (tolerance,
+                                    format_regressions(regressions)))
@@ -39,10 +39,15 @@ void **addrs;
 int nr_pages;    /* number of pages in page size */
 int page_size;
 int hpage_size;
-unsigned long dest_node;
+unsigned long src_node, dest_node;
 int *status, *nodes;
 
-double test_migration(void *p, char *msg)
+/*
+ * Moves the nr_pages pages of size step from p to dest_node, returns the
+ * time move_pages took. Prints it with a RESULT line for the benchmark:
+ * RESULT type=<type> src=<node> dst=<node> bytes=<n> seconds=<time>
+ */
+double test_migration(void *p, char *msg, char *type, int step)
 {
 	int thp_pages = 0;
 	int non_thp_pages = 0;
@@ -53,11 +58,13 @@ double test_migration(void *p, char *msg)
 
 	if (verbose)
 		fprintf(stderr, "%s\n", msg);
-	for (i = 0; i < nr_pages; i++) {
-		addrs[i] = p + (i * page_size);
+	int count = (long)nr_pages * page_size / step;
+
+	for (i = 0; i < count; i++) {
+		addrs[i] = p + ((long)i * step);
 		nodes[i] = dest_node;
 		status[i] = 0;
-		ret =  get_pfn(p + (i* page_size), &pfn);
+		ret =  get_pfn(p + ((long)i * step), &pfn);
 		if (ret)
 			continue;
 		if (pfn) {
@@ -72,13 +79,13 @@ double test_migration(void *p, char *msg)
 	}
 
 	clock_gettime(CLOCK_MONOTONIC, &ts_start);
-	ret = numa_move_pages(0, nr_pages, addrs, nodes, status, MPOL_MF_MOVE_ALL);
+	ret = numa_move_pages(0, count, addrs, nodes, status, MPOL_MF_MOVE_ALL);
 	if (ret == -1)
 		errmsg("Failed move_pages\n");
 	clock_gettime(CLOCK_MONOTONIC, &ts_end);
 
-	for (i = 0; i < nr_pages; i++) {
-		ret = get_pfn(p + (i* page_size), &pfn);
+	for (i = 0; i < count; i++) {
+		ret = get_pfn(p + ((long)i * step), &pfn);
 		if (ret)
 			continue;
 		if (pfn && verbose)
@@ -87,9 +94,37 @@ double test_migration(void *p, char *msg)
 	time = ts_end.tv_sec - ts_start.tv_sec + (ts_end.tv_nsec - ts_start.tv_nsec) / 1e9;
 	printf("%s time(seconds) (thp_pages %d non_thp_pages = %d) = %.6f\n",
 	       msg, thp_pages, non_thp_pages, time);
+	printf("RESULT type=%s src=%lu dst=%lu bytes=%lu seconds=%.9f\n",
+	       type, src_node, dest_node, (unsigned long)nr_pages * page_size,
+	       time);
 	return time;
 }
 
+/* Allocates size bytes of type on src_node and writes them */
+void *alloc_on_src(char *type, unsigned long size, struct bitmask *src)
+{
+	void *p;
+
+	if (!strcmp(type, "hugetlb")) {
+		p = mmap(NULL, size, PROT_READ|PROT_WRITE,
+			 MAP_ANONYMOUS|MAP_PRIVATE|MAP_HUGETLB, -1, 0);
+		if (p == MAP_FAILED)
+			errmsg("Failed hugetlb mmap, reserve hugepages on node %lu\n",
+			       src_node);
+	} else {
+		p = aligned_alloc(!strcmp(type, "thp") ? hpage_size : page_size,
+				  size);
+		if (p == NULL)
+			errmsg("Failed mmap\n");
+		madvise(p, size, !strcmp(type, "thp") ? MADV_HUGEPAGE :
+			MADV_NOHUGEPAGE);
+	}
+	if (mbind(p, size, MPOL_BIND, src->maskp, src->size + 1, 0))
+		errmsg("Failed mbind to node %lu\n", src_node);
+	memset(p, 'a', size);
+	return p;
+}
+
 int main(int argc, char *argv[])
 {
 	int c;
@@ -98,21 +133,34 @@ int main(int argc, char *argv[])
 	int protflag = PROT_READ|PROT_WRITE;
 	unsigned long nr_nodes = numa_max_node() + 1;
 	struct bitmask *all_nodes, *old_nodes;
-        unsigned long src_node;
         double thp_time, bp_time;
+	char *type = NULL;
+	long src = -1, dst = -1;
 
 	page_size = getpagesize();
 	hpage_size = gethugepagesize();
 
-        while ((c = getopt(argc, argv, "n:vh")) != -1) {
+        while ((c = getopt(argc, argv, "n:s:d:t:vh")) != -1) {
 		switch(c) {
 		case 'n':
 			nr_pages = strtoul(optarg, NULL, 10);
 			/* Now update nr_pages using system page size */
 			nr_pages = nr_pages * hpage_size/page_size;
 			break;
+		case 's':
+			src = strtol(optarg, NULL, 10);
+			break;
+		case 'd':
+			dst = strtol(optarg, NULL, 10);
+			break;
+		case 't':
+			/* benchmark a single type: base, thp or hugetlb */
+			type = optarg;
+			break;
 		case 'h':
-			errmsg("%s -n <number of pages>\n", argv[0]);
+			errmsg("%s -n <number of pages> [-s <source node>] "
+			       "[-d <destination node>] [-t base|thp|hugetlb]\n",
+			       argv[0]);
 			break;
 		case 'v':
 			verbose = 1;
@@ -129,8 +177,10 @@ int main(int argc, char *argv[])
 
 	all_nodes = numa_bitmask_alloc(nr_nodes);
 	old_nodes = numa_bitmask_alloc(nr_nodes);
-        src_node = get_first_mem_node();
-        dest_node = get_next_mem_node(src_node);
+        src_node = src >= 0 ? src : get_first_mem_node();
+        dest_node = dst >= 0 ? dst : get_next_mem_node(src_node);
+	if (src_node == dest_node)
+		errmsg("Source and destination nodes are the same\n");
 	printf("src node = %ld and dest node = %ld pages %d\n",
 	       src_node, dest_node, nr_pages);
 
@@ -143,6 +193,18 @@ int main(int argc, char *argv[])
 	status = malloc(sizeof(char *) * nr_pages + 1);
 	nodes  = malloc(sizeof(char *) * nr_pages + 1);
 
+	if (type) {
+		if (strcmp(type, "base") && strcmp(type, "thp") &&
+		    strcmp(type, "hugetlb"))
+			errmsg("invalid page type %s\n", type);
+		p = alloc_on_src(type, (unsigned long)nr_pages * page_size,
+				 old_nodes);
+		numa_sched_setaffinity(0, all_nodes);
+		test_migration(p, type, type,
+			       strcmp(type, "hugetlb") ? page_size : hpage_size);
+		return 0;
+	}
+
 	p = aligned_alloc(page_size, nr_pages *page_size);
 	if (p == NULL)
 		errmsg("Failed mmap\n");
@@ -159,8 +221,8 @@ int main(int argc, char *argv[])
 
 	numa_sched_setaffinity(0, all_nodes);
 
-	thp_time = test_migration(hp, "THP migration");
-	bp_time = test_migration(p, "Base migration");
+	thp_time = test_migration(hp, "THP migration", "thp", page_size);
+	bp_time = test_migration(p, "Base migration", "base", page_size);
 
 	if (bp_time < thp_time)
 		errmsg("THP page migration took more time\n");
@@ -15,22 +15,77 @@
 # Author: Harish <harish@linux.vnet.ibm.com>
 #
 
+import hashlib
+import json
+import mmap
+import multiprocessing
 import os
 import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from avocado import Test
 from avocado.utils import process, memory, disk, genio
 
+# fast non cryptographic checksums, the other algorithms are hashlib ones
+CHECKSUMS = {'crc32': zlib.crc32, 'adler32': zlib.adler32}
+
+
+def chunk_digest(mapping, offset, size, algorithm):
+    """
+    Returns the digest of size bytes of mapping from offset. Both zlib
+    and hashlib release the GIL while hashing, so threads scale.
+    """
+    data = memoryview(mapping)[offset:offset + size]
+    try:
+        if algorithm in CHECKSUMS:
+            return '%08x' % CHECKSUMS[algorithm](data)
+        return hashlib.new(algorithm, data).hexdigest()
+    finally:
+        data.release()
+
+
+def digest_table(path, chunk_size, algorithm, workers):
+    """Returns the digests of the chunk_size chunks of path, in order."""
+    with open(path, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        with mmap.mmap(source.fileno(), size,
+                       prot=mmap.PROT_READ) as mapping:
+            with ThreadPoolExecutor(max_workers=workers,
+                                    thread_name_prefix='sum-check') \
+                    as executor:
+                return list(executor.map(
+                    lambda offset: chunk_digest(mapping, offset, chunk_size,
+                                                algorithm),
+                    range(0, size, chunk_size)))
+
 
 class SumCheck(Test):
     """
     Test allocates file chuck of RAM size and checks for md5sum of the file
-    repetitively so that memory integrity persists
+    repetitively so that memory integrity persists. In chunked mode the
+    file is mmap'd and its chunks are hashed in parallel, a mismatch
+    reports the offsets of the chunks that changed.
 
     :avocado: tags=memory
     """
 
     def setUp(self):
         self.iter = int(self.params.get('iterations', default='5'))
+        self.mode = self.params.get('mode', default='md5sum')
+        self.chunk_size = int(self.params.get('chunk_size',
+                                              default=64 * 1024 * 1024))
+        self.algorithm = self.params.get('algorithm', default='crc32')
+        self.workers = int(self.params.get(
+            'workers', default=multiprocessing.cpu_count()))
+        if self.algorithm not in CHECKSUMS and \
+                self.algorithm not in hashlib.algorithms_available:
+            self.cancel('Unknown hash algorithm %s' % self.algorithm)
+        # the shake_* digests have no fixed length to compare
+        if self.algorithm not in CHECKSUMS and \
+                not hashlib.new(self.algorithm).digest_size:
+            self.cancel('Variable length hash algorithm %s is not supported'
+                        % self.algorithm)
         dir_to_use = self.params.get('dir_to_use', default=None)
         self.memsize = int(self.params.get(
             'mem_size', default=memory.meminfo.MemFree.k * 0.9))
@@ -57,6 +112,9 @@ class SumCheck(Test):
                            (self.ddfile, self.memsize))
         except process.CmdError as details:
             self.fail("Chunk creation failed due to %s" % details)
+        if self.mode == 'chunked':
+            self.chunked_check()
+            return
         for i in range(self.iter):
             mdsum.append(process.system_output('md5sum %s' % self.ddfile))
             self.log.info("MD5 : %s", mdsum[i])
@@ -64,5 +122,47 @@ class SumCheck(Test):
         if len(set(mdsum)) > 1:
             self.fail('Md5sum for created file differs')
 
+    def chunked_check(self):
+        """
+        Hashes the chunks of the file every iteration and compares them
+        with the digest table of the first one.
+        """
+        size = os.path.getsize(self.ddfile)
+        table = None
+        changes = []
+        for i in range(self.iter):
+            start = time.time()
+            digests = digest_table(self.ddfile, self.chunk_size,
+                                   self.algorithm, self.workers)
+            seconds = time.time() - start
+            self.log.info("Iteration %d: %d %s chunks of %d bytes in %.2fs"
+                          " (%.2f GB/s)", i, len(digests), self.algorithm,
+                          self.chunk_size, seconds,
+                          size / seconds / 1e9 if seconds else 0)
+            if table is None:
+                table = digests
+                continue
+            for index, (expected, found) in enumerate(zip(table, digests)):
+                if expected != found:
+                    offset = index * self.chunk_size
+                    self.log.error("Iteration %d: chunk at offset %#x-%#x "
+                                   "changed, %s instead of %s", i, offset,
+                                   min(offset + self.chunk_size, size) - 1,
+                                   found, expected)
+                    changes.append({'iteration': i, 'offset': offset,
+                                    'expected': expected, 'found': found})
+
+        with open(os.path.join(self.outputdir, 'chunk_digests.json'),
+                  'w') as output:
+            json.dump({'algorithm': self.algorithm,
+                       'chunk_size': self.chunk_size, 'size': size,
+                       'digests': table, 'changes': changes}, output,
+                      indent=2)
+        if changes:
+            offsets = sorted({change['offset'] for change in changes})
+            self.fail('%d chunk(s) of the file changed, at offsets %s'
+                      % (len(offsets),
+                         ', '.join('%#x' % offset for offset in offsets)))
+
     def tearDown(self):
         genio.write_file("/proc/sys/vm/drop_caches", "3")
@@ -15,6 +15,7 @@
 # Copyright: 2017 IBM
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
+import multiprocessing
 import os
 from avocado import Test
 from avocado import skipIf, skipUnless
@@ -23,6 +24,8 @@ from avocado.utils import memory
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
 
+from mem_api.thp_workload import MmapWorkload, VmstatSampler
+
 
 THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
 
@@ -30,7 +33,7 @@ THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
 class Thp(Test):
 
     '''
-    The test enables THP and stress the system using dd load
+    The test enables THP and stress the system with mmap'd writes
     and verifies whether THP has been allocated for usage or not
 
     :avocado: tags=memory,privileged,hugepage
@@ -52,6 +55,13 @@ class Thp(Test):
         free_mem = self.params.get(
             "mem_size", default=memory.meminfo.MemFree.m)
         self.dd_timeout = self.params.get("dd_timeout", default=900)
+        # 'anon' writes anonymous memory, 'tmpfs' files of a tmpfs
+        # mounted with huge=always
+        self.target = self.params.get("target", default="anon")
+        self.workers = self.params.get(
+            "workers", default=min(multiprocessing.cpu_count(), 8))
+        self.interval = self.params.get("sample_interval", default=1.0)
+        self.device = None
         self.thp_split = None
         try:
             memory.read_from_vmstat("thp_split_page")
@@ -64,15 +74,17 @@ class Thp(Test):
         self.count = free_mem // self.block_size
 
         # Mount device as per free memory size
-        if not os.path.exists(self.mem_path):
-            os.makedirs(self.mem_path)
-        self.device = Partition(device="none", mountpoint=self.mem_path)
-        self.device.mount(mountpoint=self.mem_path, fstype="tmpfs",
-                          args='-o size=%dM' % free_mem, mnt_check=False)
+        if self.target == 'tmpfs':
+            if not os.path.exists(self.mem_path):
+                os.makedirs(self.mem_path)
+            self.device = Partition(device="none", mountpoint=self.mem_path)
+            self.device.mount(mountpoint=self.mem_path, fstype="tmpfs",
+                              args='-o size=%dM,huge=always' % free_mem,
+                              mnt_check=False)
 
     def test(self):
         '''
-        Enables THP , Runs the dd workload and checks whether THP
+        Enables THP, runs the mmap workload and checks whether THP
         has been allocated.
         '''
 
@@ -82,52 +94,53 @@ class Thp(Test):
         except Exception as details:
             self.fail("Failed  %s" % details)
 
-        # Read thp values before stressing the system
-        thp_alloted_before = int(memory.read_from_vmstat("thp_fault_alloc"))
-        thp_split_before = int(memory.read_from_vmstat(self.thp_split))
-        thp_collapse_alloc_before = int(memory.read_from_vmstat
-                                        ("thp_collapse_alloc"))
-
-        # Start Stresssing the  System
-        self.log.info('Stress testing using dd command')
-
         if not self.count:
             self.cancel("Please pass valid value for mem_size in yaml file")
-        for iterator in range(self.count):
-            stress_cmd = 'dd if=/dev/zero of=%s/%d bs=%dM count=1'\
-                         % (self.mem_path, iterator, self.block_size)
-            if(process.system(stress_cmd, timeout=self.dd_timeout,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('dd command failed  %s' % stress_cmd)
-
-        # Read thp values after stressing the system
-        thp_alloted_after = int(memory.read_from_vmstat("thp_fault_alloc"))
-        thp_split_after = int(memory.read_from_vmstat(self.thp_split))
-        thp_collapse_alloc_after = int(memory.read_from_vmstat
-                                       ("thp_collapse_alloc"))
+
+        # anonymous THPs are counted as fault allocations, tmpfs ones as
+        # file allocations
+        alloc = "thp_fault_alloc"
+        if self.target == 'tmpfs':
+            alloc = "thp_file_alloc"
+        workload = MmapWorkload(
+            size=self.count * self.block_size * 1024 * 1024,
+            path=self.mem_path if self.target == 'tmpfs' else None,
+            file_size=self.block_size * 1024 * 1024, workers=self.workers)
+
+        # Start Stresssing the  System
+        self.log.info('Stress testing with mmap writes from %d workers',
+                      self.workers)
+        sampler = VmstatSampler(interval=self.interval)
+        sampler.start()
+        try:
+            stats = workload.run(timeout=self.dd_timeout)
+        except (ValueError, multiprocessing.TimeoutError) as details:
+            self.fail('mmap workload failed: %s' % details)
+        finally:
+            sampler.stop()
+        sampler.write(self.outputdir, 'thp.json', workload=stats,
+                      target=self.target)
+        deltas = sampler.deltas()
+        rates = sampler.rates()
 
         # Check whether THP is Used or not
-        if thp_alloted_after <= thp_alloted_before:
-            e_msg = "Thp usage count has not increased\n"
-            e_msg += "Before Stress:%d\nAfter stress:%d" % (thp_alloted_before,
-                                                            thp_alloted_after)
-            self.fail(e_msg)
-        else:
-            thp_fault_alloc = thp_alloted_after - thp_alloted_before
-            thp_split = thp_split_after - thp_split_before
-            thp_collapse_alloc = (thp_collapse_alloc_after -
-                                  thp_collapse_alloc_before)
-            self.log.info("\nTest statistics, changes during test run:")
-            self.log.info("thp_fault_alloc=%d\nthp_split=%d\n"
-                          "thp_collapse_alloc=%d\n",
-                          thp_fault_alloc, thp_split, thp_collapse_alloc)
+        if deltas.get(alloc, 0) <= 0:
+            self.fail("Thp usage count has not increased during the "
+                      "stress: %s=%d" % (alloc, deltas.get(alloc, 0)))
+        self.log.info("\nTest statistics, changes during test run:")
+        self.log.info("%s=%d (%.2f/s)\nthp_split=%d\n"
+                      "thp_collapse_alloc=%d\n", alloc, deltas[alloc],
+                      rates.get(alloc, 0), deltas.get(self.thp_split, 0),
+                      deltas.get("thp_collapse_alloc", 0))
+        self.log.info("Wrote %d bytes in %.2fs (%s GB/s)", stats['bytes'],
+                      stats['seconds'], stats['gbps'])
 
     def tearDown(self):
         '''
         Removes the files created and unmounts the tmpfs.
         '''
 
-        if self.mem_path:
+        if self.device:
             self.log.info('Cleaning Up!!!')
             self.device.unmount()
             process.system('rm -rf %s' % self.mem_path, ignore_status=True)
@@ -18,6 +18,7 @@
 import os
 import time
 import mmap
+import multiprocessing
 import avocado
 from avocado import Test
 from avocado import skipIf, skipUnless
@@ -27,6 +28,8 @@ from avocado.utils import disk
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
 
+from mem_api.thp_workload import MmapWorkload, VmstatSampler
+
 
 THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
 
@@ -34,8 +37,9 @@ THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
 class ThpDefrag(Test):
 
     '''
-    Defrag test enables THP and fragments the system memory using dd load
-    and turns on THP defrag and checks whether defrag occurred.
+    Defrag test enables THP and fragments the system memory with page
+    sized mmap'd files and turns on THP defrag and checks whether defrag
+    occurred.
 
     :avocado: tags=memory,privileged,hugepage
     '''
@@ -46,12 +50,16 @@ class ThpDefrag(Test):
                 "Hugepagesize not defined in kernel.")
     def setUp(self):
         '''
-        Sets required params for dd workload and mounts the tmpfs
+        Sets required params for the workload and mounts the tmpfs
         '''
 
         # Get required mem info
         self.mem_path = os.path.join(data_dir.get_tmp_dir(), 'thp_space')
         self.block_size = int(mmap.PAGESIZE) // 1024
+        self.workers = self.params.get(
+            "workers", default=min(multiprocessing.cpu_count(), 8))
+        self.interval = self.params.get("sample_interval", default=1.0)
+        self.sampler = VmstatSampler(interval=self.interval)
         # add mount point
         if os.path.exists(self.mem_path):
             os.makedirs(self.mem_path)
@@ -79,14 +87,20 @@ class ThpDefrag(Test):
         # Turns off Defrag
         memory.set_thp_value("khugepaged/defrag", "0")
 
+        self.sampler.start()
+
         # Fragments The memory
-        self.log.info("Fragmenting the memory Using dd command \n")
-        for iterator in range(self.count):
-            defrag_cmd = 'dd if=/dev/urandom of=%s/%d bs=%dK count=1'\
-                         % (self.mem_path, iterator, self.block_size)
-            if(process.system(defrag_cmd, timeout=900,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('Defrag command Failed %s' % defrag_cmd)
+        self.log.info("Fragmenting the memory using page sized files \n")
+        workload = MmapWorkload(size=self.count * self.block_size * 1024,
+                                path=self.mem_path,
+                                file_size=self.block_size * 1024,
+                                workers=self.workers, pattern='random')
+        try:
+            stats = workload.run(timeout=900)
+        except (ValueError, multiprocessing.TimeoutError) as details:
+            self.fail('Fragmenting workload failed: %s' % details)
+        self.log.info("Wrote %d files in %.2fs", stats['files'],
+                      stats['seconds'])
 
         hugepagesize = memory.get_huge_page_size()
         nr_full = int(0.8 * (memory.meminfo.MemTotal.k / hugepagesize))
@@ -102,6 +116,16 @@ class ThpDefrag(Test):
 
         # Sets max hugepages after defrag on
         nr_hp_after = self.set_max_hugepages(nr_full)
+        self.sampler.stop()
+        deltas = self.sampler.deltas()
+        self.sampler.write(self.outputdir, 'thp_defrag.json', workload=stats,
+                           hugepages={'before': nr_hp_before,
+                                      'after': nr_hp_after})
+        self.log.info("compact_stall=%d compact_success=%d "
+                      "thp_collapse_alloc=%d during the test",
+                      deltas.get('compact_stall', 0),
+                      deltas.get('compact_success', 0),
+                      deltas.get('thp_collapse_alloc', 0))
 
         # Check for memory defragmentation
         if nr_hp_before >= nr_hp_after:
@@ -129,6 +153,7 @@ class ThpDefrag(Test):
 
         if self.mem_path:
             self.log.info('Cleaning Up!!!')
+            self.sampler.stop()
             memory.set_thp_value("khugepaged/defrag", "0")
             memory.set_num_huge_pages(0)
             self.device.unmount()
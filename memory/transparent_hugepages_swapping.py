@@ -16,6 +16,7 @@
 # Copyright: 2017 IBM
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
+import multiprocessing
 import os
 from avocado import Test
 from avocado import skipIf, skipUnless
@@ -24,6 +25,8 @@ from avocado.utils import memory
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
 
+from mem_api.thp_workload import MmapWorkload, VmstatSampler
+
 
 THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
 
@@ -42,7 +45,7 @@ class ThpSwapping(Test):
                 "Hugepagesize not defined in kernel.")
     def setUp(self):
         '''
-        Sets the Required params for dd and mounts the tmpfs dir
+        Sets the Required params for the workload and mounts the tmpfs dir
         '''
 
         self.swap_free = []
@@ -53,6 +56,9 @@ class ThpSwapping(Test):
         self.swap_free.append(memory.meminfo.SwapFree.m)
         self.mem_path = os.path.join(data_dir.get_tmp_dir(), 'thp_space')
         self.dd_timeout = 900
+        self.workers = self.params.get(
+            "workers", default=min(multiprocessing.cpu_count(), 8))
+        self.interval = self.params.get("sample_interval", default=1.0)
 
         # If swap is enough fill all memory with dd
         if self.swap_free[0] > (mem - mem_free):
@@ -74,7 +80,7 @@ class ThpSwapping(Test):
 
     def test(self):
         '''
-        Enables THP Runs dd, fills out the available memory and checks whether
+        Enables THP, fills out the available memory and checks whether
         THP is swapped out.
         '''
 
@@ -84,13 +90,24 @@ class ThpSwapping(Test):
         except Exception as details:
             self.fail("Failed  %s" % details)
 
-        for iterator in range(self.count):
-            swap_cmd = "dd if=/dev/zero of=%s/%d bs=%sM "\
-                       "count=1" % (self.mem_path, iterator,
-                                    self.hugepage_size * 2)
-            if(process.system(swap_cmd, timeout=self.dd_timeout,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('Swap command Failed %s' % swap_cmd)
+        file_size = self.hugepage_size * 2 * 1024 * 1024
+        workload = MmapWorkload(size=self.count * file_size,
+                                path=self.mem_path, file_size=file_size,
+                                workers=self.workers)
+        sampler = VmstatSampler(interval=self.interval)
+        sampler.start()
+        try:
+            stats = workload.run(timeout=self.dd_timeout)
+        except (ValueError, multiprocessing.TimeoutError) as details:
+            self.fail('Swap workload failed: %s' % details)
+        finally:
+            sampler.stop()
+        sampler.write(self.outputdir, 'thp_swapping.json', workload=stats)
+        deltas = sampler.deltas()
+        self.log.info("pswpout=%d thp_swpout=%d thp_swpout_fallback=%d "
+                      "during the test", deltas.get('pswpout', 0),
+                      deltas.get('thp_swpout', 0),
+                      deltas.get('thp_swpout_fallback', 0))
 
         self.swap_free.append(memory.meminfo.SwapFree.m)
 
@@ -19,12 +19,22 @@ import platform
 from avocado import Test
 from avocado.utils import cpu, distro, process, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
+
+# 24x7 events are not grouped, every event of a batch is read with its
+# own hcall, so the batch is bounded by open fds and command line length
+MAX_BATCH_SIZE = 256
 
 
 class hv_24x7_all_events(Test):
 
     """
     This tests all hv_24x7 events
+
+    Events are run batch_size (default 64) at a time in a single perf
+    stat, a failing batch is bisected down to the single event commands.
+    batch_size of 1 runs one perf stat per event, workers sets how many
+    perf stat runs are executed in parallel.
     :avocado: tags=perf,24x7,events
     """
     # Initializing fail command list
@@ -104,7 +114,9 @@ class hv_24x7_all_events(Test):
         dmesg.clear_dmesg()
 
     def test_all_events(self):
-        perf_args = "-v -e"
+        batch_size = min(self.params.get('batch_size', default=64),
+                         MAX_BATCH_SIZE)
+        events = []
         for line in self.list_of_hv_24x7_events:
             if line.startswith('HP') or line.startswith('CP'):
                 # Running for domain range from 1-6
@@ -114,19 +126,19 @@ class hv_24x7_all_events(Test):
                     else:
                         core_range = self.vir_cores
                     for core in range(0, core_range):
-                        events = "hv_24x7/%s,domain=%s,core=%s/" % \
-                                 (line, domain, core)
-                        cmd = 'perf stat %s %s sleep 1' % (perf_args, events)
-                        res = process.run(cmd, ignore_status=True)
-                        if res.exit_status != 0 or b"not supported" in res.stderr:
-                            self.fail_cmd.append(cmd)
+                        events.append("hv_24x7/%s,domain=%s,core=%s/" %
+                                      (line, domain, core))
             else:
                 for chip_item in range(0, self.chips):
-                    events = "hv_24x7/%s,domain=1,chip=%s/" % (line, chip_item)
-                    cmd = "perf stat %s %s sleep 1" % (perf_args, events)
-                    res = process.run(cmd, ignore_status=True)
-                    if res.exit_status != 0 or b"not supported" in res.stderr:
-                        self.fail_cmd.append(cmd)
+                    events.append("hv_24x7/%s,domain=1,chip=%s/" %
+                                  (line, chip_item))
+
+        validator = EventValidator(self.log, 'perf stat -v -e %s sleep 1',
+                                   batch_size=batch_size,
+                                   workers=self.params.get('workers',
+                                                           default=4),
+                                   markers=('not supported',))
+        self.fail_cmd.extend(validator.run(events))
 
         if len(self.fail_cmd) > 0:
             for cmd in range(len(self.fail_cmd)):
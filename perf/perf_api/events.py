@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Event validation engine shared by the perf event tests.
+
+Instead of running one 'perf stat' per event, events are packed in
+batches into a single 'perf stat -x' run. Batches are spread over a
+number of workers, each one pinned to a different online CPU. A batch
+that fails is bisected until the failing events are isolated, and each
+of them is then confirmed with the single event command line the tests
+always used, which is what gets reported.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from avocado.utils import cpu, process
+
+__all__ = ['EventValidator', 'FAIL_MARKERS']
+
+# Markers perf stat prints in place of a counter value
+FAIL_MARKERS = ('not supported', 'not counted')
+
+
+class EventValidator():
+    """Validates perf events in parallel batches.
+
+    :param log: logger of the calling test
+    :param single_cmd: command used to validate a single event, with '%s'
+                       in place of the event, e.g. 'perf stat -e %s sleep 1'
+    :param batch_size: maximum number of events per perf stat run
+    :param workers: number of perf stat runs executed in parallel
+    :param option: perf stat option that selects an event ('-e' or '-M')
+    :param perf_opts: extra perf stat options for the batched runs
+    :param workload: command perf stat counts in the batched runs
+    :param markers: strings which flag an event failure in the output
+    :param check: callable(cmd, result) returning True when the single
+                  event command failed, defaults to exit status/markers
+    :param separator: field separator of the 'perf stat -x' output, ';' by
+                      default as some event specs contain commas
+    """
+
+    def __init__(self, log, single_cmd, batch_size=16, workers=1,
+                 option='-e', perf_opts='', workload='sleep 1',
+                 markers=FAIL_MARKERS, check=None, separator=';'):
+        self.log = log
+        self.single_cmd = single_cmd
+        self.batch_size = max(int(batch_size), 1)
+        self.workers = max(int(workers), 1)
+        self.option = option
+        self.perf_opts = perf_opts
+        self.workload = workload
+        self.markers = markers
+        self.check = check or self._check
+        self.separator = separator
+        self.fail_cmd = []
+        self._lock = threading.Lock()
+        self._cpus = cpu.cpu_online_list()
+
+    def _check(self, cmd, result):
+        output = (result.stdout + result.stderr).decode()
+        return result.exit_status != 0 or any(marker in output
+                                              for marker in self.markers)
+
+    def _pin(self, cmd):
+        # pin the worker thread's perf stat and workload to one CPU, so
+        # parallel runs do not disturb each other
+        worker = threading.current_thread().name.rsplit('_', 1)[-1]
+        if self.workers == 1 or not worker.isdigit():
+            return cmd
+        return 'taskset -c %s %s' % (
+            self._cpus[int(worker) % len(self._cpus)], cmd)
+
+    def _record(self, cmd):
+        with self._lock:
+            self.fail_cmd.append(cmd)
+
+    def run_single(self, event):
+        """
+        Runs the single event command and records it when it fails.
+        """
+        cmd = self.single_cmd % event
+        result = process.run(self._pin(cmd), shell=True, ignore_status=True)
+        if self.check(cmd, result):
+            self._record(cmd)
+
+    def parse_values(self, output, nr_events):
+        """
+        Returns the counter values from 'perf stat -x' output in event
+        order, None when there is not exactly one row per event.
+        """
+        values = []
+        for line in output.splitlines():
+            fields = line.split(self.separator)
+            if line.startswith('#') or len(fields) < 3 or not fields[2]:
+                continue
+            values.append(fields[0])
+        if len(values) != nr_events:
+            return None
+        return values
+
+    def run_batch(self, events):
+        """
+        Runs all events in one perf stat, bisecting the batch on failure.
+        """
+        if len(events) == 1:
+            self.run_single(events[0])
+            return
+        cmd = "perf stat -x '%s' %s %s %s" % (
+            self.separator, self.perf_opts,
+            ' '.join('%s %s' % (self.option, event) for event in events),
+            self.workload)
+        result = process.run(self._pin(cmd), shell=True, ignore_status=True)
+        output = result.stderr.decode()
+        if result.exit_status == 0 and not any(marker in output
+                                               for marker in self.markers):
+            return
+        values = None
+        if result.exit_status == 0:
+            values = self.parse_values(output, len(events))
+        if values is None:
+            mid = len(events) // 2
+            self.run_batch(events[:mid])
+            self.run_batch(events[mid:])
+            return
+        for event, value in zip(events, values):
+            if any(marker in value for marker in self.markers):
+                self.run_single(event)
+
+    def run_commands(self, cmds, func):
+        """
+        Calls func on every command using the worker pool.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix='perf') as pool:
+            for future in [pool.submit(func, cmd) for cmd in cmds]:
+                # re-raise any exception of the worker, e.g. a test cancel
+                future.result()
+
+    def run(self, events):
+        """
+        Validates all events and returns the failed single event commands.
+        """
+        events = list(events)
+        batches = [events[index:index + self.batch_size]
+                   for index in range(0, len(events), self.batch_size)]
+        self.log.info("Validating %s events in %s batches with %s workers",
+                      len(events), len(batches), self.workers)
+        self.run_commands(batches, self.run_batch)
+        return self.fail_cmd
@@ -18,6 +18,7 @@ import platform
 from avocado import Test
 from avocado.utils import distro, process, genio, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
 
 
 class perf_hv_gpci(Test):
@@ -95,12 +96,7 @@ class perf_hv_gpci(Test):
             self.fail("perf hv_gpci: some of the events failed,"
                       "refer to log")
 
-    def run_cmd(self, cmd):
-        result = process.run(cmd, shell=True, ignore_status=True)
-        output = result.stdout.decode() + result.stderr.decode()
-        if (result.exit_status != 0) or ("not supported" in output):
-            self.fail_cmd.append(cmd)
-
+    def run_user_cmd(self, cmd):
         # test hv_gpci events with normal user
         if not process.system('id test', sudo=True, ignore_status=True):
             result = process.run("su - test -c '%s'" % cmd, shell=True,
@@ -113,6 +109,7 @@ class perf_hv_gpci(Test):
             self.log.warn('User test does not exist, skipping test')
 
     def gpci_events(self, val):
+        events = []
         for line in val:
             if line in self.list_phys:
                 line = "%s,%s/" % (line.split(',')[0], line.split(',')[1].replace(
@@ -133,8 +130,17 @@ class perf_hv_gpci(Test):
             if line in self.list_noid:
                 line = "%s/" % line
 
-            cmd = "perf stat -v -e %s sleep 1" % line
-            self.run_cmd(cmd)
+            events.append(line)
+
+        validator = EventValidator(self.log, "perf stat -v -e %s sleep 1",
+                                   batch_size=self.params.get('batch_size',
+                                                              default=16),
+                                   workers=self.params.get('workers',
+                                                           default=4),
+                                   markers=('not supported',))
+        self.fail_cmd.extend(validator.run(events))
+        validator.run_commands([validator.single_cmd % event
+                                for event in events], self.run_user_cmd)
         self.error_check()
 
     def test_gpci_events(self):
@@ -21,6 +21,7 @@ import shutil
 from avocado import Test
 from avocado.utils import cpu, distro, dmesg, process, archive
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
 
 # Global variable to track whether the kernel has been built
 kernel_built = False
@@ -117,12 +118,14 @@ class perf_json(Test):
         dmesg.clear_dmesg()
 
     def test_pmu_events(self):
-        # run all pmu events with perf stat
-        for event in self.perf_list_pmu_events:
-            cmd = "perf stat -e %s -I 1000 sleep 1" % event
-            res = process.run(cmd, shell=True, verbose=True)
-            if (b"not counted" in res.stderr) or (b"not supported" in res.stderr):
-                self.fail_cmd.append(cmd)
+        # run all pmu events with perf stat, in parallel batches
+        validator = EventValidator(self.log,
+                                   "perf stat -e %s -I 1000 sleep 1",
+                                   batch_size=self.params.get('batch_size',
+                                                              default=16),
+                                   workers=self.params.get('workers',
+                                                           default=4))
+        self.fail_cmd.extend(validator.run(sorted(self.perf_list_pmu_events)))
         if self.fail_cmd:
             self.fail("perf pmu events failed are %s" % self.fail_cmd)
 
@@ -18,6 +18,7 @@ import platform
 from avocado import Test
 from avocado.utils import distro, dmesg, genio, process, cpu
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
 
 IS_POWER_NV = 'PowerNV' in genio.read_file('/proc/cpuinfo').rstrip('\t\r\n\0')
 
@@ -75,37 +76,52 @@ class perf_metric(Test):
         # Clear the dmesg to capture the delta at the end of the test.
         dmesg.clear_dmesg()
 
+    def _check_cmd(self, cmd, op):
+        failed = False
+        output = (op.stdout + op.stderr).decode()
+        # When the command failed, checking for expected failure or not.
+        if op.exit_status:
+            found_imc = False
+            found_hv_24_7 = False
+            for ln in output.splitlines():
+                if "hv_24x7" in ln:
+                    found_hv_24_7 = True
+                    break
+                if "imc" in ln:
+                    found_imc = True
+                    break
+            # IMC errors in PowerVM - Expected
+            # hv_24x7 errors in PowerNV - Expected
+            # IMC failed in PowerNV environment - Fail
+            # HV_24X7 failed in PowerVM environment - Fail
+            if (found_imc and not IS_POWER_NV) or\
+               (found_hv_24_7 and IS_POWER_NV):
+                self.log.info("%s failed, due to non supporting"
+                              " environment" % cmd)
+            else:
+                failed = True
+        if ("not counted" in output) or ("not supported" in output):
+            failed = True
+        if "operations is limited" in output:
+            self.cancel("Please enable lpar to allow collecting the"
+                        " hv_24x7 counters info")
+        return failed
+
     def _run_cmd(self, option):
-        for line in self.list_of_metric_events:
-            cmd = "perf stat %s %s -C 0 sleep 1" % (option, line)
-            op = process.run(cmd, ignore_status=True, shell=True, verbose=True)
-            output = (op.stdout + op.stderr).decode()
-            # When the command failed, checking for expected failure or not.
-            if op.exit_status:
-                found_imc = False
-                found_hv_24_7 = False
-                for ln in output.splitlines():
-                    if "hv_24x7" in ln:
-                        found_hv_24_7 = True
-                        break
-                    if "imc" in ln:
-                        found_imc = True
-                        break
-                # IMC errors in PowerVM - Expected
-                # hv_24x7 errors in PowerNV - Expected
-                # IMC failed in PowerNV environment - Fail
-                # HV_24X7 failed in PowerVM environment - Fail
-                if (found_imc and not IS_POWER_NV) or\
-                   (found_hv_24_7 and IS_POWER_NV):
-                    self.log.info("%s failed, due to non supporting"
-                                  " environment" % cmd)
-                else:
-                    self.fail_cmd.append(cmd)
-            if ("not counted" in output) or ("not supported" in output):
-                self.fail_cmd.append(cmd)
-            if "operations is limited" in output:
-                self.cancel("Please enable lpar to allow collecting the"
-                            " hv_24x7 counters info")
+        # metrics are validated in parallel batches, failing batches are
+        # bisected and each suspect metric is checked with _check_cmd
+        perf_opts = option.split()
+        validator = EventValidator(self.log,
+                                   "perf stat %s %%s -C 0 sleep 1" % option,
+                                   batch_size=self.params.get('batch_size',
+                                                              default=8),
+                                   workers=self.params.get('workers',
+                                                           default=4),
+                                   option=perf_opts[-1],
+                                   perf_opts=' '.join(perf_opts[:-1] +
+                                                      ['-C 0']),
+                                   check=self._check_cmd)
+        self.fail_cmd.extend(validator.run(self.list_of_metric_events))
         if self.fail_cmd:
             self.fail("perf_metric: commands failed are %s" % self.fail_cmd)
 
@@ -18,6 +18,7 @@ import platform
 from avocado import Test
 from avocado.utils import cpu, distro, genio, process
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
 
 
 class nestEvents(Test):
@@ -82,17 +83,15 @@ class nestEvents(Test):
                 self.log.info("Failed command: %s" % self.fail_cmd[cmd])
             self.fail("perf_raw_events: some of the events failed, refer to log")
 
-    def run_cmd(self, cmd):
-        if process.system(cmd, shell=True, ignore_status=True):
-            self.fail_cmd.append(cmd)
-
     def test_nest_events(self):
-        perf_stat = "perf stat -e"
-        perf_flags = '-a -A sleep 1'
-
-        for line in self.list_of_nest_events:
-            cmd = "%s %s %s" % (perf_stat, line, perf_flags)
-            self.run_cmd(cmd)
+        # only the exit status of perf stat is checked for nest events
+        validator = EventValidator(self.log, "perf stat -e %s -a -A sleep 1",
+                                   batch_size=self.params.get('batch_size',
+                                                              default=16),
+                                   workers=self.params.get('workers',
+                                                           default=4),
+                                   perf_opts='-a', markers=())
+        self.fail_cmd.extend(validator.run(self.list_of_nest_events))
 
         self.error_check()
 
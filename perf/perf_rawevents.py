@@ -20,6 +20,7 @@ import shutil
 from avocado import Test
 from avocado.utils import distro, process, genio, cpu, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventValidator
 
 
 class PerfRawevents(Test):
@@ -85,14 +86,15 @@ class PerfRawevents(Test):
         # Clear the dmesg to capture the delta at the end of the test.
         dmesg.clear_dmesg()
 
-    def run_event(self, filename, perf_flags):
-        for line in genio.read_all_lines(filename):
-            cmd = "%s%s sleep 1" % (perf_flags, line)
-            result = process.run(cmd, shell=True, ignore_status=True)
-            output = (result.stdout + result.stderr).decode()
-            if result.exit_status != 0 or ("not counted" in output) or\
-                    ("not supported" in output):
-                self.fail_cmd.append(cmd)
+    def run_event(self, filename, prefix=''):
+        events = ["%s%s" % (prefix, line)
+                  for line in genio.read_all_lines(filename) if line]
+        validator = EventValidator(self.log, "perf stat -e %s sleep 1",
+                                   batch_size=self.params.get('batch_size',
+                                                              default=16),
+                                   workers=self.params.get('workers',
+                                                           default=4))
+        self.fail_cmd.extend(validator.run(events))
 
     def error_check(self):
         if self.fail_cmd:
@@ -102,14 +104,12 @@ class PerfRawevents(Test):
 
     def test_raw_code(self):
         file_name = 'raw_codes_' + (self.rev if self.rev != '0082' else '0080')
-        perf_flags = "perf stat -e r"
-        self.run_event(file_name, perf_flags)
+        self.run_event(file_name, 'r')
         self.error_check()
 
     def test_name_event(self):
         file_name = 'name_events_' + (self.rev if self.rev != '0082' else '0080')
-        perf_flags = "perf stat -e "
-        self.run_event(file_name, perf_flags)
+        self.run_event(file_name)
         self.error_check()
 
     def tearDown(self):
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Installs common_api, the helpers shared by tests of several directories.
+The tests themselves are run from the source tree, see README.rst.
+"""
+
+from setuptools import setup
+
+setup(name='avocado-misc-tests-common-api',
+      version='1.0',
+      description='Helpers shared by the avocado-misc-tests',
+      license='GPLv2+',
+      url='https://github.com/avocado-framework-tests/avocado-misc-tests',
+      packages=['common_api'],
+      install_requires=['avocado-framework'])
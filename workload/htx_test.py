@@ -29,6 +29,8 @@ from avocado.utils import build
 from avocado.utils import process, archive
 from avocado.utils import distro
 
+from common_api.htx import HtxMonitor
+
 
 class HtxTest(Test):
 
@@ -85,6 +87,8 @@ class HtxTest(Test):
         self.time_limit = int(self.params.get('time_limit', default=2))
         self.time_unit = self.params.get('time_unit', default='m')
         self.run_type = self.params.get('run_type', default='')
+        self.monitor_interval = int(self.params.get('monitor_interval',
+                                                    default=60))
         if self.time_unit == 'm':
             self.time_limit = self.time_limit * 60
         elif self.time_unit == 'h':
@@ -211,15 +215,18 @@ class HtxTest(Test):
     def test_check(self):
         """
         Checks if HTX is running, and if no errors.
+        The device states are sampled every monitor_interval seconds into
+        htx-timeseries.csv.
         """
-        for _ in range(0, self.time_limit, 60):
-            self.log.info("HTX Error logs")
-            process.system('htxcmdline -geterrlog', ignore_status=True)
-            if os.stat('/tmp/htxerr').st_size != 0:
-                self.fail("check errorlogs for exact error and failure")
-            cmd = 'htxcmdline -query  -mdt %s' % self.mdt_file
-            process.system(cmd, ignore_status=True)
-            time.sleep(60)
+        monitor = HtxMonitor(self.log, self.outputdir,
+                             'htxcmdline -query  -mdt %s' % self.mdt_file,
+                             interval=self.monitor_interval)
+        monitor.add_host('host', lambda cmd: process.run(
+            cmd, ignore_status=True, shell=True))
+        errors = monitor.run(self.time_limit)
+        if errors:
+            self.log.info("HTX error log: %s", errors)
+            self.fail("check errorlogs for exact error and failure")
 
     def test_stop(self):
         '''
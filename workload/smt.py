@@ -13,14 +13,16 @@
 # Author: Samir A Mulani <samir@linux.vnet.ibm.com>
 
 from avocado import Test
-from avocado.utils import process, distro, dmesg
+from avocado.utils import process, distro, genio
 from avocado.utils.software_manager.manager import SoftwareManager
 import os
 import time
 
+from common_api.kmsg import KmsgWatcher
 
-def collect_dmesg(object):
-    return process.system_output("dmesg").decode()
+# kernel log sequence number at the workload start, test_smt_stop only
+# looks at the messages logged after it
+KMSG_SEQ_FILE = '/tmp/smt.kmsg_seq'
 
 
 class smt(Test):
@@ -60,13 +62,15 @@ class smt(Test):
         This function is responsible to validate the dmesg
         for any errors after smt workload run.
         """
-        ERROR = []
         pattern = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
                    'Unable to handle', 'ard LOCKUP']
-        for fail_pattern in pattern:
-            for log in collect_dmesg(self).splitlines():
-                if fail_pattern in log:
-                    ERROR.append(log)
+        start_seq = 0
+        if os.path.exists(KMSG_SEQ_FILE):
+            start_seq = int(genio.read_file(KMSG_SEQ_FILE))
+            os.remove(KMSG_SEQ_FILE)
+        with KmsgWatcher(pattern, levels=None,
+                         start_seq=start_seq) as kmsg:
+            ERROR = [str(record) for record in kmsg.check()]
         if ERROR:
             self.fail("Test failed with following errors in dmesg :  %s " %
                       "\n".join(ERROR))
@@ -79,7 +83,8 @@ class smt(Test):
         """
         Start the SMT Workload
         """
-        dmesg.clear_dmesg()
+        with KmsgWatcher() as kmsg:
+            genio.write_file(KMSG_SEQ_FILE, str(kmsg.mark()))
         relative_path = 'smt.py.data/smt.sh'
         absolute_path = os.path.abspath(relative_path)
         smt_workload = "bash " + absolute_path + " &> /tmp/smt.log &"